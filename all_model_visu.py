@@ -1,10 +1,24 @@
+import argparse
+
 import pandas as pd
 import matplotlib.pyplot as plt
 
-# Charger les données
-df = pd.read_csv("face_recognition_benchmark_detailed.csv")
+from benchmark_store import BenchmarkStore, STORE_PATH
+
+RESULTS_PATH = STORE_PATH
+
+def load_columns(*columns, code_version=None, detector=None):
+    # Ne lire que les colonnes utiles au graphique, et les résultats d'une seule
+    # version du code : les temps des anciennes versions ne sont pas comparables
+    store = BenchmarkStore(RESULTS_PATH)
+    keys = list(columns) + (["detector"] if detector and "detector" not in columns else [])
+    df = pd.DataFrame(store.read(keys, code_version=code_version), columns=keys)
+    if detector:
+        df = df[df["detector"] == detector]
+    return df[list(columns)]
 
-def plotMatteoVSNonMatteo():
+def plotMatteoVSNonMatteo(code_version=None, detector=None):
+    df = load_columns("model", "image_type", "similarity_score", code_version=code_version, detector=detector)
     # Filtrer les données
     df_matteo = df[df["image_type"] == "test_matteo"]
     df_non_matteo = df[df["image_type"] == "non_matteo"]
@@ -56,7 +70,8 @@ def plotMatteoVSNonMatteo():
 
     plt.show()
 
-def plot_encoding_dimensions():
+def plot_encoding_dimensions(code_version=None, detector=None):
+    df = load_columns("model", "embedding_length", code_version=code_version, detector=detector)
     df_encoding = df.groupby("model")["embedding_length"].mean().reset_index()
     plt.figure(figsize=(8, 6))
     plt.bar(df_encoding["model"], df_encoding["embedding_length"], color="purple")
@@ -67,7 +82,8 @@ def plot_encoding_dimensions():
     plt.grid(axis='y')
     plt.show()
 
-def plot_computation_time():
+def plot_computation_time(code_version=None, detector=None):
+    df = load_columns("model", "computation_time", code_version=code_version, detector=detector)
     df_time = df.groupby("model")["computation_time"].mean().reset_index()
     plt.figure(figsize=(8, 6))
     plt.bar(df_time["model"], df_time["computation_time"], color="orange")
@@ -79,7 +95,16 @@ def plot_computation_time():
     plt.show()
 
 
-plotMatteoVSNonMatteo()
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Plot the results of one benchmark run")
+    parser.add_argument("--code-version", help="Code version of the results, defaults to the latest one")
+    parser.add_argument("--detector", help="Only plot the results of this detector")
+    args = parser.parse_args()
+
+    code_version = args.code_version or BenchmarkStore(RESULTS_PATH).latest_code_version()
+    print(f"Résultats de la version {code_version}")
+
+    plotMatteoVSNonMatteo(code_version, args.detector)
 
-plot_computation_time()
-plot_encoding_dimensions()
\ No newline at end of file
+    plot_computation_time(code_version, args.detector)
+    plot_encoding_dimensions(code_version, args.detector)
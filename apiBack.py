@@ -1,12 +1,9 @@
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, Response, stream_with_context
 from flask_cors import CORS
-import face_recognition
 import cv2
 import numpy as np
 from io import BytesIO
 from typing import List
-from ultralytics import YOLO
-from supervision import Detections
 import traceback
 import tempfile
 import sys
@@ -15,10 +12,22 @@ import logging
 import psycopg2
 from psycopg2.extras import RealDictCursor
 from dotenv import load_dotenv
-from face_lookalike import recognize_facesAPI
 import time
+import json
 
-from face_lookalike_deepface import recognize_faces_deepface, load_known_faces,add_face_to_db, recognize_faces_deepface_parralelisation
+# Recognition engines (TensorFlow, dlib, torch) are imported on the first request, see engines.py
+from engines import recognize, detect, get_engine, profile_options, require_student_ids, PROFILES, RECOGNITION_PROFILE
+from db import get_db_connection
+from gallery import get_gallery, get_course_gallery, PRIMARY_MODEL, MATCH_THRESHOLD
+from roster import get_course_roster, invalidate_course_roster
+from roi import get_roi, load_roi, save_roi, delete_roi, roi_scope, validate_polygons
+from pagination import parse_page_size, fetch_page, iter_rows, iter_ndjson
+from response_cache import cached_response, bump_version, cache_stats
+from metrics import stage_timer, start_request, request_stages, render_prometheus, REQUESTS_TOTAL
+from capture import should_capture, capture_request
+from profiling import profiled, load_profile, PROFILING_ENABLED, PROFILE_TOKEN
+from enrollment import submit_enrollment, get_enrollment, is_enrollment_in_progress
+from attendance import attendance_buffer, default_session_id, get_attendance, install_shutdown_handler
 
 app = Flask(__name__)
 CORS(app)  # Enable CORS for all routes
@@ -26,119 +35,535 @@ CORS(app)  # Enable CORS for all routes
 load_dotenv()
 
 # Setup logging
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO").upper(), format='%(asctime)s - %(levelname)s - %(message)s')
+
+# Face crops accepted by one /recognize_crops/ request
+MAX_CROPS_PER_REQUEST = int(os.getenv("MAX_CROPS_PER_REQUEST", "64"))
+# Probe embeddings accepted by one /match_embeddings/ request, and matches returned per probe
+MAX_EMBEDDINGS_PER_REQUEST = int(os.getenv("MAX_EMBEDDINGS_PER_REQUEST", "4096"))
+MAX_MATCHES_PER_EMBEDDING = 10
+EMBEDDING_DTYPES = {"float32": np.dtype("<f4"), "float16": np.dtype("<f2")}
 
 logger = logging.getLogger(__name__)
-print(os.getenv("DB_HOST"))
-# Database connection function
-def get_db_connection():
+logger.info(f"Database host: {os.getenv('DB_HOST')}")
+
+
+def read_uploaded_image(file):
+    """
+    Read and decode an uploaded image
+
+    Returns:
+        tuple: (raw bytes, BGR image or None if the upload is not a decodable image)
+    """
+    with stage_timer("upload_read"):
+        file_bytes = file.read()
+    with stage_timer("decode"):
+        return file_bytes, cv2.imdecode(np.frombuffer(file_bytes, np.uint8), cv2.IMREAD_COLOR)
+
+
+def faces_to_array(results):
+    """Recognition results keyed by name as the list of faces sent to the frontend"""
+    faces_array = []
+    for name, face_data in results.items():
+        face_data['name'] = name  # Add name to the face data
+        faces_array.append(face_data)
+    return faces_array
+
+
+def json_response(payload, status=200):
+    with stage_timer("serialization"):
+        return jsonify(payload), status
+
+
+def unknown_profile_error(profile):
+    """Error message for a `profile` form field that names no speed profile, None if it is valid"""
+    if profile is None or profile in PROFILES:
+        return None
+    return f"Unknown profile '{profile}', expected one of: {', '.join(PROFILES)}"
+
+
+def unknown_course_error(course_id):
+    """
+    Error message for a `course_id` form field that names no course, None
+    if it is absent or valid. Checked before attendance is queued, since a
+    row for a missing course can never be written.
+    """
+    if course_id is None or get_course_roster(course_id) is not None:
+        return None
+    return f"Course {course_id} not found"
+
+
+def run_recognition(file_bytes, img, request_start, course_id=None, session_id=None, params=None, profile=None, camera_id=None):
+    """
+    Recognize the faces of a decoded upload, capture the request if it is
+    sampled and record attendance when a course is given. Shared by the
+    Flask and ASGI /recognize_faces/ endpoints. The ROI mask of the camera,
+    or of the course, restricts the faces to the seating area.
+
+    Returns:
+        dict: Response body, {"faces": [...], "skipped_faces": [...]} plus "session_id" for a course
+    """
+    with stage_timer("gallery_load"):
+        gallery = get_gallery()
+    roi = get_roi(course_id, camera_id)
+
+    # The decoded BGR image is handed to the engine directly, no temporary file
+    skipped = []
+    results = recognize(img, profile=profile, gallery=gallery, skipped=skipped, roi=roi)
+    faces_array = faces_to_array(results)
+
+    if should_capture():
+        capture_request(
+            "recognize_faces",
+            file_bytes,
+            # The resolved profile and mask, so a replay runs what this request ran
+            dict(params or {}, profile=profile or RECOGNITION_PROFILE, roi=roi),
+            faces_array,
+            request_stages(),
+            time.perf_counter() - request_start,
+            gallery
+        )
+
+    # Detections too small, blurred or turned away to be worth embedding
+    response = {"faces": faces_array, "skipped_faces": skipped}
+
+    # Attendance is only recorded when the photo is taken for a course
+    if course_id is not None:
+        session_id = session_id or default_session_id(course_id)
+        attendance_buffer.record_faces(course_id, session_id, faces_array)
+        response["session_id"] = session_id
+    return response
+
+
+def parse_max_side(value):
+    """
+    max_side form field of /count_faces/, None when absent
+
+    Raises:
+        ValueError: If it is not a positive integer
+    """
+    if value in (None, ""):
+        return None
+    try:
+        max_side = int(value)
+    except ValueError:
+        max_side = 0
+    if max_side <= 0:
+        raise ValueError("max_side must be a positive integer")
+    return max_side
+
+
+def run_count(img, profile=None, max_side=None, course_id=None, camera_id=None):
+    """
+    Count the faces of a decoded upload with the detector only. Shared by
+    the Flask and ASGI /count_faces/ endpoints.
+
+    Returns:
+        dict: Response body, {"count": n, "faces": [{"bounding_box", "confidence"}]}
+    """
+    faces = detect(img, profile=profile, max_side=max_side, roi=get_roi(course_id, camera_id))
+    return {"count": len(faces), "faces": faces}
+
+
+@app.route("/count_faces/", methods=['POST'])
+def count_faces_endpoint():
+    """
+    Headcount of a photo for occupancy dashboards: detection only, no
+    embedding or matching. Optional form fields: profile, max_side (detect
+    at a reduced resolution), camera_id / course_id (ROI mask).
+    """
+    start_request()
     try:
-        conn = psycopg2.connect(
-            host=os.getenv("DB_HOST"),
-            user=os.getenv("DB_USER"),
-            password=os.getenv("DB_PASSWORD"),
-            dbname=os.getenv("DB_NAME"),
-            port=os.getenv("DB_PORT")
+        if 'file' not in request.files:
+            REQUESTS_TOTAL.inc(labels={"endpoint": "count_faces", "status": "400"})
+            return jsonify({"error": "No file provided"}), 400
+
+        profile = request.form.get('profile') or None
+        error = unknown_profile_error(profile)
+        try:
+            max_side = parse_max_side(request.form.get('max_side'))
+        except ValueError as e:
+            error = error or str(e)
+        if error:
+            REQUESTS_TOTAL.inc(labels={"endpoint": "count_faces", "status": "400"})
+            return jsonify({"error": error}), 400
+
+        _, img = read_uploaded_image(request.files['file'])
+        if img is None:
+            REQUESTS_TOTAL.inc(labels={"endpoint": "count_faces", "status": "400"})
+            return jsonify({"error": "Failed to decode image"}), 400
+
+        response = run_count(
+            img,
+            profile=profile,
+            max_side=max_side,
+            course_id=request.form.get('course_id', type=int),
+            camera_id=request.form.get('camera_id')
         )
-        return conn
+        REQUESTS_TOTAL.inc(labels={"endpoint": "count_faces", "status": "200"})
+        return json_response(response)
+
+    except Exception as e:
+        error_traceback = traceback.format_exc()
+        logger.error(f"Error in count_faces_endpoint: {str(e)}")
+        logger.error(f"Traceback: {error_traceback}")
+        REQUESTS_TOTAL.inc(labels={"endpoint": "count_faces", "status": "500"})
+        return jsonify({"error": str(e)}), 500
+
+
+def parse_crop_fields(count, landmarks_field, boxes_field):
+    """
+    landmarks and boxes form fields of /recognize_crops/: JSON arrays with
+    one entry per crop, null for none
+
+    Raises:
+        ValueError: If a field is not such an array
+    """
+    parsed = []
+    for name, field in (("landmarks", landmarks_field), ("boxes", boxes_field)):
+        if not field:
+            parsed.append(None)
+            continue
+        try:
+            values = json.loads(field)
+        except ValueError:
+            raise ValueError(f"{name} is not valid JSON")
+        if not isinstance(values, list) or len(values) != count:
+            raise ValueError(f"{name} must be an array with one entry per face")
+        parsed.append(values)
+    landmarks, boxes = parsed
+    for points in landmarks or []:
+        if points is not None and not (
+            isinstance(points, dict)
+            and all(isinstance(points.get(eye), list) and len(points[eye]) == 2 for eye in ('left_eye', 'right_eye'))
+        ):
+            raise ValueError("Each landmarks entry needs left_eye and right_eye as [x, y]")
+    for box in boxes or []:
+        if box is not None and not (isinstance(box, list) and len(box) == 4):
+            raise ValueError("Each box must be [top, right, bottom, left]")
+    return landmarks, boxes
+
+
+@app.route("/recognize_crops/", methods=['POST'])
+def recognize_crops_endpoint():
+    """
+    Recognize faces already detected on the device: several 'faces' files,
+    each a face crop, skip detection and go straight to embedding and
+    matching. Optional form fields: landmarks (to align crops that are not
+    aligned yet), boxes (echoed back), profile, course_id and session_id.
+    """
+    start_request()
+    try:
+        files = request.files.getlist('faces')
+        error = None
+        if not files:
+            error = "No faces provided"
+        elif len(files) > MAX_CROPS_PER_REQUEST:
+            error = f"At most {MAX_CROPS_PER_REQUEST} faces per request"
+        profile = request.form.get('profile') or None
+        error = error or unknown_profile_error(profile)
+        if not error:
+            try:
+                landmarks, boxes = parse_crop_fields(len(files), request.form.get('landmarks'), request.form.get('boxes'))
+            except ValueError as e:
+                error = str(e)
+        if error:
+            REQUESTS_TOTAL.inc(labels={"endpoint": "recognize_crops", "status": "400"})
+            return jsonify({"error": error}), 400
+
+        course_id = request.form.get('course_id', type=int)
+        course_error = unknown_course_error(course_id)
+        if course_error:
+            REQUESTS_TOTAL.inc(labels={"endpoint": "recognize_crops", "status": "404"})
+            return jsonify({"error": course_error}), 404
+
+        crops = []
+        for i, file in enumerate(files):
+            _, crop = read_uploaded_image(file)
+            if crop is None:
+                REQUESTS_TOTAL.inc(labels={"endpoint": "recognize_crops", "status": "400"})
+                return jsonify({"error": f"Failed to decode face {i}"}), 400
+            crops.append(crop)
+
+        with stage_timer("gallery_load"):
+            gallery = get_gallery()
+        skipped = []
+        results = get_engine("deepface").recognize_crops(
+            crops,
+            gallery,
+            landmarks=landmarks,
+            boxes=boxes,
+            cascade=profile_options("deepface", profile)["cascade"],
+            skipped=skipped
+        )
+        response = {"faces": faces_to_array(results), "skipped_faces": skipped}
+
+        if course_id is not None:
+            session_id = request.form.get('session_id') or default_session_id(course_id)
+            attendance_buffer.record_faces(course_id, session_id, response["faces"])
+            response["session_id"] = session_id
+
+        REQUESTS_TOTAL.inc(labels={"endpoint": "recognize_crops", "status": "200"})
+        return json_response(response)
+
+    except Exception as e:
+        error_traceback = traceback.format_exc()
+        logger.error(f"Error in recognize_crops_endpoint: {str(e)}")
+        logger.error(f"Traceback: {error_traceback}")
+        REQUESTS_TOTAL.inc(labels={"endpoint": "recognize_crops", "status": "500"})
+        return jsonify({"error": str(e)}), 500
+
+
+def parse_embeddings(body, dtype, dimension):
+    """
+    Probe embeddings of a /match_embeddings/ body: little-endian floats, one
+    embedding after the other
+
+    Raises:
+        ValueError: If the body is not a whole number of embeddings of the gallery's dimension
+    """
+    item_size = EMBEDDING_DTYPES[dtype].itemsize * dimension
+    if not body or len(body) % item_size:
+        raise ValueError(f"Body must hold {dimension}-d {dtype} embeddings ({item_size} bytes each)")
+    count = len(body) // item_size
+    if count > MAX_EMBEDDINGS_PER_REQUEST:
+        raise ValueError(f"At most {MAX_EMBEDDINGS_PER_REQUEST} embeddings per request")
+    return np.frombuffer(body, dtype=EMBEDDING_DTYPES[dtype]).reshape(count, dimension).astype(np.float32)
+
+
+@app.route("/match_embeddings/", methods=['POST'])
+def match_embeddings_endpoint():
+    """
+    Identify embeddings computed on the device. The body is the raw batch
+    (application/octet-stream); query parameters: model (required, must be
+    the gallery's), dtype (float32 or float16), k (matches per probe) and
+    course_id (search the course's students only).
+    """
+    start_request()
+    try:
+        model = request.args.get('model') or request.headers.get('X-Embedding-Model')
+        dtype = request.args.get('dtype', 'float32')
+        k = request.args.get('k', 1, type=int)
+        error = None
+        if model != PRIMARY_MODEL:
+            error = f"Embeddings must come from {PRIMARY_MODEL}, got {model}"
+        elif dtype not in EMBEDDING_DTYPES:
+            error = f"Unknown dtype '{dtype}', expected one of: {', '.join(EMBEDDING_DTYPES)}"
+        elif not 1 <= k <= MAX_MATCHES_PER_EMBEDDING:
+            error = f"k must be between 1 and {MAX_MATCHES_PER_EMBEDDING}"
+        if error:
+            REQUESTS_TOTAL.inc(labels={"endpoint": "match_embeddings", "status": "400"})
+            return jsonify({"error": error}), 400
+
+        with stage_timer("gallery_load"):
+            gallery = get_gallery()
+        if not len(gallery):
+            REQUESTS_TOTAL.inc(labels={"endpoint": "match_embeddings", "status": "503"})
+            return jsonify({"error": "The gallery is empty"}), 503
+
+        with stage_timer("upload_read"):
+            body = request.get_data(cache=False)
+        try:
+            probes = parse_embeddings(body, dtype, gallery.embeddings.shape[1])
+        except ValueError as e:
+            REQUESTS_TOTAL.inc(labels={"endpoint": "match_embeddings", "status": "400"})
+            return jsonify({"error": str(e)}), 400
+
+        course_id = request.args.get('course_id', type=int)
+        if course_id is not None:
+            roster = get_course_roster(course_id)
+            if roster is None:
+                REQUESTS_TOTAL.inc(labels={"endpoint": "match_embeddings", "status": "404"})
+                return jsonify({"error": "Course not found"}), 404
+            with stage_timer("gallery_load"):
+                gallery = get_course_gallery(course_id, [student['studentid'] for student in roster])
+
+        with stage_timer("matching"):
+            indices, distances = gallery.top_k(probes, k)
+            matches = [
+                [
+                    {
+                        'student_id': gallery.student_ids[index],
+                        'name': gallery.names[index],
+                        'distance': float(distance),
+                        'matched': bool(distance <= MATCH_THRESHOLD)
+                    }
+                    for index, distance in zip(row_indices.tolist(), row_distances.tolist())
+                ]
+                for row_indices, row_distances in zip(indices, distances)
+            ]
+
+        REQUESTS_TOTAL.inc(labels={"endpoint": "match_embeddings", "status": "200"})
+        return json_response({"model": PRIMARY_MODEL, "threshold": MATCH_THRESHOLD, "matches": matches})
+
     except Exception as e:
-        logger.error(f"Database connection error: {str(e)}")
-        raise
+        error_traceback = traceback.format_exc()
+        logger.error(f"Error in match_embeddings_endpoint: {str(e)}")
+        logger.error(f"Traceback: {error_traceback}")
+        REQUESTS_TOTAL.inc(labels={"endpoint": "match_embeddings", "status": "500"})
+        return jsonify({"error": str(e)}), 500
 
 
 @app.route("/recognize_faces/", methods=['POST'])
+@profiled
 def recognize_faces_endpoint():
-    print("\n=== New Request Received ===", flush=True)
+    start_request()
+    request_start = time.perf_counter()
     try:
         if 'file' not in request.files:
-            print(" No file in request", flush=True)
+            REQUESTS_TOTAL.inc(labels={"endpoint": "recognize_faces", "status": "400"})
             return jsonify({"error": "No file provided"}), 400
-            
+
+        profile = request.form.get('profile') or None
+        profile_error = unknown_profile_error(profile)
+        if profile_error:
+            REQUESTS_TOTAL.inc(labels={"endpoint": "recognize_faces", "status": "400"})
+            return jsonify({"error": profile_error}), 400
+        course_id = request.form.get('course_id', type=int)
+        course_error = unknown_course_error(course_id)
+        if course_error:
+            REQUESTS_TOTAL.inc(labels={"endpoint": "recognize_faces", "status": "404"})
+            return jsonify({"error": course_error}), 404
+
         file = request.files['file']
-        print(f" Received file: {file.filename}", flush=True)
-        
-        # Read the file contents
-        file_bytes = file.read()
-        np_img = np.frombuffer(file_bytes, np.uint8)
-        img = cv2.imdecode(np_img, cv2.IMREAD_COLOR)
-        img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
-        filename = "temp.jpg"
-        cv2.imwrite(filename, img)
-        
+        logger.debug("Received file: %s", file.filename)
+
+        file_bytes, img = read_uploaded_image(file)
         if img is None:
-            print(" Failed to decode image", flush=True)
+            REQUESTS_TOTAL.inc(labels={"endpoint": "recognize_faces", "status": "400"})
             return jsonify({"error": "Failed to decode image"}), 400
+        logger.debug("Image decoded successfully. Shape: %s", img.shape)
 
-        print(f" Image decoded successfully. Shape: {img.shape}", flush=True)
-
-        # Convert to RGB
-        rgb_img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
-        print(" Starting face recognition...", flush=True)
-        
-
-        
-        #results = recognize_facesAPI(filename)
-        results = recognize_faces_deepface_parralelisation(filename)
-        print(f" Face recognition results: {results}", flush=True)
-        
-        # Convert dictionary to array
-        faces_array = []
-        for name, face_data in results.items():
-            face_data['name'] = name  # Add name to the face data
-            faces_array.append(face_data)
+        response = run_recognition(
+            file_bytes,
+            img,
+            request_start,
+            course_id=course_id,
+            session_id=request.form.get('session_id'),
+            params=dict(request.form),
+            profile=profile,
+            camera_id=request.form.get('camera_id')
+        )
 
-        print(f" Returning {len(faces_array)} faces", flush=True)
-        print(f" Response data: {{'faces': faces_array}}", flush=True)
-        return jsonify({"faces": faces_array})
+        logger.debug("Returning %d faces", len(response["faces"]))
+        REQUESTS_TOTAL.inc(labels={"endpoint": "recognize_faces", "status": "200"})
+        return json_response(response)
 
     except Exception as e:
         error_traceback = traceback.format_exc()
-        print(f" Error in recognize_faces_endpoint: {str(e)}", flush=True)
-        print(f" Traceback: {error_traceback}", flush=True)
+        logger.error(f"Error in recognize_faces_endpoint: {str(e)}")
+        logger.error(f"Traceback: {error_traceback}")
+        REQUESTS_TOTAL.inc(labels={"endpoint": "recognize_faces", "status": "500"})
         return jsonify({"error": str(e), "traceback": error_traceback}), 500
 
+@app.route("/metrics", methods=['GET'])
+def metrics_endpoint():
+    """Per-stage latency histograms and counters in the Prometheus text format"""
+    return Response(render_prometheus(), mimetype="text/plain; version=0.0.4")
+
+@app.route("/profiles/<profile_id>", methods=['GET'])
+def get_profile(profile_id):
+    """Get a stored request profile, requires the same admin token as profiling"""
+    if not PROFILING_ENABLED or not PROFILE_TOKEN or request.headers.get("X-Profile") != PROFILE_TOKEN:
+        return jsonify({"error": "Profiling is not enabled"}), 403
+    profile = load_profile(profile_id)
+    if profile is None:
+        return jsonify({"error": "Profile not found"}), 404
+    if request.args.get('format') == 'collapsed':
+        return Response(profile.get('collapsed', ''), mimetype="text/plain")
+    return jsonify(profile)
+
 @app.route("/add_face/", methods=['POST'])
 def add_face_endpoint():
-    time.sleep(5)
+    """
+    Validate the upload and queue the enrollment on the background worker pool.
+    Returns 202 with an enrollment ID to poll on /add_face/<enrollment_id>.
+    """
     if 'file' not in request.files or 'name' not in request.form:
         return jsonify({"error": "File and name are required"}), 400
 
     file = request.files['file']
-    name = request.form['name']
+    name = request.form['name'].strip()
+    if not name:
+        return jsonify({"error": "Name must be a non-empty string"}), 400
 
-    # Temporarily save uploaded image
-    with tempfile.NamedTemporaryFile(delete=False, suffix='.jpg') as tmp_file:
-        file.save(tmp_file.name)
-        temp_image_path = tmp_file.name
+    file_bytes = file.read()
+    if not file_bytes:
+        return jsonify({"error": "Uploaded file is empty"}), 400
 
-    try:
-        # Load existing names from database
-        _, known_names = load_known_faces()
+    # Decode at 1/8 scale in grayscale: enough to reject non-images cheaply
+    if cv2.imdecode(np.frombuffer(file_bytes, np.uint8), cv2.IMREAD_REDUCED_GRAYSCALE_8) is None:
+        return jsonify({"error": "Failed to decode image"}), 400
 
-        if name in known_names:
-            os.unlink(temp_image_path)
+    try:
+        if name in get_gallery().names or is_enrollment_in_progress(name):
             return jsonify({"error": f"The name '{name}' already exists in the database."}), 400
 
-        # Add face to database
-        success = add_face_to_db(temp_image_path, name)
+        # Temporarily save uploaded image, the worker removes it when done
+        with tempfile.NamedTemporaryFile(delete=False, suffix='.jpg') as tmp_file:
+            tmp_file.write(file_bytes)
+            temp_image_path = tmp_file.name
 
-        # Remove temporary file
-        os.unlink(temp_image_path)
-
-        if success:
-            return jsonify({"message": f"Successfully added '{name}' to the database."}), 201
-        else:
-            return jsonify({"error": "Failed to add face to database."}), 500
+        enrollment_id = submit_enrollment(temp_image_path, name)
+        return jsonify({
+            "message": f"Enrollment of '{name}' has been queued.",
+            "enrollment_id": enrollment_id,
+            "status": "pending",
+            "status_url": f"/add_face/{enrollment_id}"
+        }), 202
 
     except Exception as e:
-        if os.path.exists(temp_image_path):
-            os.unlink(temp_image_path)
+        error_traceback = traceback.format_exc()
+        logger.error(f"Error in add_face_endpoint: {str(e)}")
+        logger.error(f"Traceback: {error_traceback}")
         return jsonify({"error": str(e)}), 500
 
+@app.route("/add_face/<enrollment_id>", methods=['GET'])
+def get_add_face_status(enrollment_id):
+    """Get the status of a queued face enrollment"""
+    job = get_enrollment(enrollment_id)
+    if not job:
+        return jsonify({"error": "Enrollment not found"}), 404
+    return jsonify(job)
+
+STUDENTS_QUERY = "SELECT studentid, name FROM student"
+COURSES_QUERY = """
+    SELECT c.courseid, c.subject, c.teacherid,
+           t.name as teacher_name, t.username as teacher_username
+    FROM course c
+    JOIN teacher t ON c.teacherid = t.teacherid
+"""
+
+
+def paginated_listing(key, query, key_columns, key_fields):
+    """
+    Serve a list endpoint page by page or as a stream, depending on the query string:
+    ?limit=N[&after=<cursor>] returns one keyset page and the cursor of the next one,
+    ?format=ndjson streams every row as newline-delimited JSON.
+    Returns None when neither is requested.
+    """
+    if request.args.get('format') == 'ndjson':
+        rows = iter_rows(query + f" ORDER BY {', '.join(key_columns)}")
+        return Response(stream_with_context(iter_ndjson(rows)), mimetype='application/x-ndjson')
+
+    try:
+        limit = parse_page_size(request.args.get('limit'))
+        if limit is None:
+            return None
+        rows, next_cursor = fetch_page(query, key_columns, key_fields, limit, request.args.get('after'))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify({key: rows, "next_cursor": next_cursor})
+
+
 @app.route("/students/", methods=['GET'])
 def get_all_students():
-    """Get all students from the database"""
+    """Get all students from the database, optionally paginated or streamed"""
     try:
+        response = paginated_listing("students", STUDENTS_QUERY, ("name", "studentid"), ("name", "studentid"))
+        if response is not None:
+            return response
+
         conn = get_db_connection()
         cursor = conn.cursor(cursor_factory=RealDictCursor)
         
@@ -156,6 +581,7 @@ def get_all_students():
         return jsonify({"error": str(e)}), 500
 
 @app.route("/students/<int:student_id>", methods=['GET'])
+@cached_response("students", "courses")
 def get_student_detail(student_id):
     """Get detailed information about a specific student, including courses"""
     try:
@@ -232,19 +658,18 @@ def get_students_by_ids():
         return jsonify({"error": str(e)}), 500
 
 @app.route("/courses/", methods=['GET'])
+@cached_response("courses")
 def get_all_courses():
-    """Get all courses with their teacher information"""
+    """Get all courses with their teacher information, optionally paginated or streamed"""
     try:
+        response = paginated_listing("courses", COURSES_QUERY, ("c.subject", "c.courseid"), ("subject", "courseid"))
+        if response is not None:
+            return response
+
         conn = get_db_connection()
         cursor = conn.cursor(cursor_factory=RealDictCursor)
         
-        cursor.execute("""
-            SELECT c.courseid, c.subject, c.teacherid, 
-                   t.name as teacher_name, t.username as teacher_username
-            FROM course c
-            JOIN teacher t ON c.teacherid = t.teacherid
-            ORDER BY c.subject
-        """)
+        cursor.execute(COURSES_QUERY + " ORDER BY c.subject")
         courses = cursor.fetchall()
         
         cursor.close()
@@ -258,6 +683,7 @@ def get_all_courses():
         return jsonify({"error": str(e)}), 500
 
 @app.route("/courses/<int:course_id>", methods=['GET'])
+@cached_response("courses", "students")
 def get_course_detail(course_id):
     """Get detailed information about a course, including students enrolled"""
     try:
@@ -302,7 +728,135 @@ def get_course_detail(course_id):
         logger.error(f"Traceback: {error_traceback}")
         return jsonify({"error": str(e)}), 500
 
+@app.route("/courses/<int:course_id>/attendance", methods=['POST'])
+def check_course_attendance(course_id):
+    """
+    Recognize the faces of a classroom photo against a course roster.
+    Returns the present, absent and unexpected students in a single call.
+    """
+    if 'file' not in request.files:
+        return jsonify({"error": "No file provided"}), 400
+    profile = request.form.get('profile') or None
+    profile_error = unknown_profile_error(profile)
+    if profile_error:
+        return jsonify({"error": profile_error}), 400
+    try:
+        require_student_ids()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    start_request()
+    try:
+        roster = get_course_roster(course_id)
+        if roster is None:
+            return jsonify({"error": "Course not found"}), 404
+        roster_ids = {student['studentid'] for student in roster}
+
+        _, img = read_uploaded_image(request.files['file'])
+        if img is None:
+            return jsonify({"error": "Failed to decode image"}), 400
+
+        # Search the enrolled students first, the full gallery only for the
+        # remaining faces so students from other courses are still named
+        with stage_timer("gallery_load"):
+            course_gallery = get_course_gallery(course_id, roster_ids)
+            full_gallery = get_gallery()
+        skipped = []
+        results = recognize(
+            img,
+            profile=profile,
+            gallery=course_gallery,
+            fallback_gallery=full_gallery,
+            skipped=skipped,
+            roi=get_roi(course_id, request.form.get('camera_id'))
+        )
+
+        faces = faces_to_array(results)
+        recognized = {face['student_id']: face for face in faces if face.get('student_id') is not None}
+        recognized_ids = set(recognized)
+
+        session_id = request.form.get('session_id') or default_session_id(course_id)
+        attendance_buffer.record_faces(
+            course_id,
+            session_id,
+            [recognized[student_id] for student_id in recognized_ids & roster_ids]
+        )
+
+        return json_response({
+            "courseid": course_id,
+            "session_id": session_id,
+            "present": [
+                dict(student, **recognized[student['studentid']])
+                for student in roster if student['studentid'] in recognized_ids
+            ],
+            "absent": [student for student in roster if student['studentid'] not in recognized_ids],
+            "unexpected": [recognized[student_id] for student_id in recognized_ids - roster_ids],
+            "strangers": [face for face in faces if face.get('student_id') is None],
+            "skipped_faces": skipped,
+            "student_count": len(roster)
+        })
+    except Exception as e:
+        error_traceback = traceback.format_exc()
+        logger.error(f"Error in check_course_attendance: {str(e)}")
+        logger.error(f"Traceback: {error_traceback}")
+        return jsonify({"error": str(e)}), 500
+
+@app.route("/courses/<int:course_id>/attendance", methods=['GET'])
+def get_course_attendance(course_id):
+    """Get the recorded attendance of a course, optionally filtered by session_id"""
+    try:
+        records = get_attendance(course_id, request.args.get('session_id'))
+        return jsonify({"courseid": course_id, "attendance": records})
+    except Exception as e:
+        error_traceback = traceback.format_exc()
+        logger.error(f"Error in get_course_attendance: {str(e)}")
+        logger.error(f"Traceback: {error_traceback}")
+        return jsonify({"error": str(e)}), 500
+
+def roi_endpoint(scope):
+    """
+    GET, PUT or DELETE the ROI mask of a scope. PUT expects
+    {"polygons": [[[x, y], ...], ...]} with x and y relative to the frame size.
+    """
+    try:
+        if request.method == 'GET':
+            polygons = load_roi(scope)
+            if polygons is None:
+                return jsonify({"error": "No ROI mask"}), 404
+            return jsonify({"scope": scope, "polygons": polygons})
+
+        if request.method == 'DELETE':
+            if not delete_roi(scope):
+                return jsonify({"error": "No ROI mask"}), 404
+            return jsonify({"message": f"ROI mask of {scope} removed"})
+
+        data = request.get_json(silent=True)
+        if not data or 'polygons' not in data:
+            return jsonify({"error": "No polygons provided"}), 400
+        try:
+            polygons = validate_polygons(data['polygons'])
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        save_roi(scope, polygons)
+        return jsonify({"scope": scope, "polygons": polygons})
+    except Exception as e:
+        error_traceback = traceback.format_exc()
+        logger.error(f"Error in roi_endpoint: {str(e)}")
+        logger.error(f"Traceback: {error_traceback}")
+        return jsonify({"error": str(e)}), 500
+
+@app.route("/courses/<int:course_id>/roi", methods=['GET', 'PUT', 'DELETE'])
+def course_roi(course_id):
+    """ROI mask used for the photos of a course taken by a camera without its own mask"""
+    return roi_endpoint(roi_scope(course_id=course_id))
+
+@app.route("/cameras/<camera_id>/roi", methods=['GET', 'PUT', 'DELETE'])
+def camera_roi(camera_id):
+    """ROI mask of a fixed camera, sent as the camera_id form field of a recognition"""
+    return roi_endpoint(roi_scope(camera_id=camera_id))
+
 @app.route("/teachers/", methods=['GET'])
+@cached_response("courses", "teachers")
 def get_all_teachers():
     """Get all teachers with their courses"""
     try:
@@ -335,6 +889,11 @@ def get_all_teachers():
         logger.error(f"Traceback: {error_traceback}")
         return jsonify({"error": str(e)}), 500
 
+@app.route("/cache/stats", methods=['GET'])
+def get_cache_stats():
+    """Hit-rate counters of the response cache"""
+    return jsonify(cache_stats())
+
 @app.route("/teachers/login", methods=['POST'])
 def teacher_login():
     """Authenticate a teacher with username and password"""
@@ -408,6 +967,8 @@ def update_course_students(course_id):
         conn.commit()
         cursor.close()
         conn.close()
+        invalidate_course_roster(course_id)
+        bump_version("courses", "students")
 
         return jsonify({"message": f"Course {course_id} updated successfully."}), 200
 
@@ -463,6 +1024,8 @@ def create_course():
                 conn.rollback() # Rollback the current student enrollment attempt
 
         conn.commit()
+        invalidate_course_roster(new_course_id)
+        bump_version("courses")
         return jsonify({"message": "Course created successfully", "courseid": new_course_id}), 201
 
     except psycopg2.Error as e:
@@ -486,7 +1049,8 @@ def create_course():
 
 
 if __name__ == '__main__':
-    # Force stdout to flush immediately
-    sys.stdout.reconfigure(line_buffering=True)
-    print(" Starting Flask server...", flush=True)
-    app.run(debug=True, port=8000)
+    # Only when Flask serves directly: under uvicorn (asgi.py) the server owns
+    # SIGTERM, and the lifespan shutdown flushes the attendance buffer
+    install_shutdown_handler()
+    logger.info("Starting Flask server...")
+    app.run(debug=os.getenv("FLASK_DEBUG", "1") == "1", port=int(os.getenv("API_PORT", "8000")))
@@ -0,0 +1,419 @@
+"""
+ASGI entry point of the API, served by serve.py.
+
+The database reads used by the frontend (students, courses, teachers, login)
+are native async endpoints on an asyncpg pool, so they never wait behind a
+recognition. /recognize_faces/ decodes and recognizes on a bounded thread
+pool, off the event loop, and so does the detection-only /count_faces/,
+sharing the same resident engine. Every other route falls through to the Flask app
+of apiBack, mounted as a WSGI application.
+"""
+import os
+import json
+import time
+import asyncio
+import logging
+import traceback
+import concurrent.futures
+from contextlib import asynccontextmanager
+from functools import wraps
+from typing import Any, Dict, Tuple
+
+import cv2
+import numpy as np
+from fastapi import FastAPI, Request
+from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.wsgi import WSGIMiddleware
+from fastapi.responses import Response, StreamingResponse
+
+import async_db
+from attendance import attendance_buffer
+from engines import get_engine
+from apiBack import (
+    app as flask_app, run_recognition, run_count, parse_max_side, unknown_profile_error, unknown_course_error,
+    STUDENTS_QUERY, COURSES_QUERY
+)
+from metrics import stage_timer, start_request, REQUESTS_TOTAL
+from pagination import parse_page_size, fetch_page_async
+from response_cache import lookup_response, store_response, count_lookup
+
+logger = logging.getLogger(__name__)
+
+# Recognitions running at once per worker process, the others queue here
+RECOGNITION_WORKERS = int(os.getenv("RECOGNITION_WORKERS", "2"))
+# Import the configured engine before the worker accepts requests, not on the first one
+ENGINE_PRELOAD = os.getenv("ENGINE_PRELOAD", "1") == "1"
+_recognition_executor = concurrent.futures.ThreadPoolExecutor(
+    max_workers=RECOGNITION_WORKERS,
+    thread_name_prefix="recognition"
+)
+
+
+@asynccontextmanager
+async def lifespan(_):
+    await async_db.open_pool()
+    if ENGINE_PRELOAD:
+        await asyncio.get_running_loop().run_in_executor(_recognition_executor, get_engine)
+    yield
+    # uvicorn has drained the requests by now: persist the attendance they recorded
+    await asyncio.get_running_loop().run_in_executor(None, attendance_buffer.close)
+    await async_db.close_pool()
+
+
+api = FastAPI(title="Attendance API", lifespan=lifespan)
+api.add_middleware(CORSMiddleware, allow_origins=["*"], allow_methods=["*"], allow_headers=["*"])
+
+
+def json_response(payload: Any, status: int = 200) -> Response:
+    # default=str turns dates and decimals into strings, like jsonify
+    return Response(json.dumps(payload, default=str), status_code=status, media_type="application/json")
+
+
+def error_response(where: str, e: Exception) -> Response:
+    logger.error(f"Error in {where}: {str(e)}")
+    logger.error(f"Traceback: {traceback.format_exc()}")
+    return json_response({"error": str(e)}, 500)
+
+
+def _etag_matches(request: Request, etag: str) -> bool:
+    candidates = request.headers.get("if-none-match", "")
+    return any(
+        candidate.strip().removeprefix("W/").strip('"') in (etag, "*")
+        for candidate in candidates.split(",") if candidate.strip()
+    )
+
+
+def cached_response(*resources: str):
+    """
+    response_cache.cached_response for async endpoints: the endpoint takes
+    the request and returns the JSON payload, or a Response that is not cached.
+    """
+    def decorator(endpoint):
+        @wraps(endpoint)
+        async def wrapper(request: Request, *args, **kwargs):
+            key = f"asgi:{request.url.path}?{request.url.query}"
+            versions, entry = lookup_response(key, resources)
+            if entry is not None:
+                etag, body = entry
+                if _etag_matches(request, etag):
+                    count_lookup("not_modified")
+                    return Response(status_code=304, headers={"ETag": f'"{etag}"'})
+                count_lookup("hits")
+                return Response(body, media_type="application/json", headers={"ETag": f'"{etag}"'})
+
+            count_lookup("misses")
+            result = await endpoint(request, *args, **kwargs)
+            if isinstance(result, Response):
+                return result
+            body = json.dumps(result, default=str).encode()
+            etag = store_response(key, resources, versions, body)
+            if _etag_matches(request, etag):
+                return Response(status_code=304, headers={"ETag": f'"{etag}"'})
+            return Response(body, media_type="application/json", headers={"ETag": f'"{etag}"'})
+        return wrapper
+    return decorator
+
+
+async def _ndjson(query: str):
+    async for row in async_db.stream(query):
+        yield json.dumps(row, default=str) + "\n"
+
+
+async def paginated_listing(request: Request, key: str, query: str, key_columns, key_fields):
+    """Async version of apiBack.paginated_listing, None when the full list is requested."""
+    if request.query_params.get('format') == 'ndjson':
+        return StreamingResponse(
+            _ndjson(query + f" ORDER BY {', '.join(key_columns)}"),
+            media_type='application/x-ndjson'
+        )
+    try:
+        limit = parse_page_size(request.query_params.get('limit'))
+        if limit is None:
+            return None
+        rows, next_cursor = await fetch_page_async(
+            query, key_columns, key_fields, limit, request.query_params.get('after')
+        )
+    except ValueError as e:
+        return json_response({"error": str(e)}, 400)
+    return {key: rows, "next_cursor": next_cursor}
+
+
+@api.get("/students/")
+async def get_all_students(request: Request):
+    """Get all students from the database, optionally paginated or streamed"""
+    try:
+        response = await paginated_listing(request, "students", STUDENTS_QUERY, ("name", "studentid"), ("name", "studentid"))
+        if response is not None:
+            return response if isinstance(response, Response) else json_response(response)
+        return json_response({"students": await async_db.fetch("SELECT * FROM student ORDER BY name")})
+    except Exception as e:
+        return error_response("get_all_students", e)
+
+
+@api.get("/students/{student_id}")
+@cached_response("students", "courses")
+async def get_student_detail(request: Request, student_id: int):
+    """Get detailed information about a specific student, including courses"""
+    try:
+        student = await async_db.fetchrow("SELECT * FROM student WHERE studentid = %s", student_id)
+        if not student:
+            return json_response({"error": "Student not found"}, 404)
+
+        courses, face_encoding = await asyncio.gather(
+            async_db.fetch("""
+                SELECT c.courseid, c.subject, t.name as teacher_name
+                FROM course c
+                JOIN studentcourses sc ON c.courseid = sc.courseid
+                JOIN teacher t ON c.teacherid = t.teacherid
+                WHERE sc.studentid = %s
+            """, student_id),
+            async_db.fetchrow("SELECT studentid FROM faceencoding WHERE studentid = %s", student_id)
+        )
+        return {
+            "student": student,
+            "courses": courses,
+            "has_face_encoding": face_encoding is not None
+        }
+    except Exception as e:
+        return error_response("get_student_detail", e)
+
+
+@api.post("/students/batch")
+async def get_students_by_ids(request: Request):
+    """Get multiple students by their IDs"""
+    try:
+        try:
+            data = await request.json()
+        except ValueError:
+            data = None
+        if not data or 'student_ids' not in data:
+            return json_response({"error": "No student IDs provided"}, 400)
+
+        student_ids = data['student_ids']
+        if not isinstance(student_ids, list):
+            return json_response({"error": "student_ids must be an array"}, 400)
+        if not student_ids:
+            return json_response({"students": []})
+
+        ids_string = ','.join(['%s'] * len(student_ids))
+        students = await async_db.fetch(
+            f"SELECT * FROM student WHERE studentid IN ({ids_string}) ORDER BY name",
+            *student_ids
+        )
+        return json_response({"students": students})
+    except Exception as e:
+        return error_response("get_students_by_ids", e)
+
+
+@api.get("/courses/")
+@cached_response("courses")
+async def get_all_courses(request: Request):
+    """Get all courses with their teacher information, optionally paginated or streamed"""
+    try:
+        response = await paginated_listing(request, "courses", COURSES_QUERY, ("c.subject", "c.courseid"), ("subject", "courseid"))
+        if response is not None:
+            return response
+        return {"courses": await async_db.fetch(COURSES_QUERY + " ORDER BY c.subject")}
+    except Exception as e:
+        return error_response("get_all_courses", e)
+
+
+@api.get("/courses/{course_id}")
+@cached_response("courses", "students")
+async def get_course_detail(request: Request, course_id: int):
+    """Get detailed information about a course, including students enrolled"""
+    try:
+        course, students = await asyncio.gather(
+            async_db.fetchrow("""
+                SELECT c.*, t.name as teacher_name, t.username as teacher_username
+                FROM course c
+                JOIN teacher t ON c.teacherid = t.teacherid
+                WHERE c.courseid = %s
+            """, course_id),
+            async_db.fetch("""
+                SELECT s.studentid, s.name
+                FROM student s
+                JOIN studentcourses sc ON s.studentid = sc.studentid
+                WHERE sc.courseid = %s
+                ORDER BY s.name
+            """, course_id)
+        )
+        if not course:
+            return json_response({"error": "Course not found"}, 404)
+        return {
+            "course": course,
+            "enrolled_students": students,
+            "student_count": len(students)
+        }
+    except Exception as e:
+        return error_response("get_course_detail", e)
+
+
+@api.get("/teachers/")
+@cached_response("courses", "teachers")
+async def get_all_teachers(request: Request):
+    """Get all teachers with their courses"""
+    try:
+        teachers, courses = await asyncio.gather(
+            async_db.fetch("SELECT teacherid, name, username FROM teacher ORDER BY name"),
+            async_db.fetch("SELECT courseid, subject, teacherid FROM course")
+        )
+        # One query for every course instead of one per teacher
+        by_teacher: Dict[int, list] = {}
+        for course in courses:
+            by_teacher.setdefault(course.pop('teacherid'), []).append(course)
+        for teacher in teachers:
+            teacher['courses'] = by_teacher.get(teacher['teacherid'], [])
+        return {"teachers": teachers}
+    except Exception as e:
+        return error_response("get_all_teachers", e)
+
+
+@api.post("/teachers/login")
+async def teacher_login(request: Request):
+    """Authenticate a teacher with username and password"""
+    try:
+        try:
+            data = await request.json()
+        except ValueError:
+            data = None
+        if not data or 'username' not in data or 'password' not in data:
+            return json_response({"error": "Username and password required"}, 400)
+
+        teacher = await async_db.fetchrow("""
+            SELECT teacherid, name, username
+            FROM teacher
+            WHERE username = %s AND password = %s
+        """, data['username'], data['password'])
+        if not teacher:
+            return json_response({"error": "Invalid credentials"}, 401)
+        return json_response({"message": "Login successful", "teacher": teacher})
+    except Exception as e:
+        return error_response("teacher_login", e)
+
+
+def _recognize(file_bytes: bytes, params: Dict[str, str]) -> Tuple[int, Dict[str, Any]]:
+    """Decode and recognize an upload on a recognition thread, returns (status, body)."""
+    start_request()
+    request_start = time.perf_counter()
+    try:
+        try:
+            course_id = int(params['course_id']) if params.get('course_id') else None
+        except ValueError:
+            course_id = None
+        # On the recognition thread, the roster cache may read the database
+        course_error = unknown_course_error(course_id)
+        if course_error:
+            REQUESTS_TOTAL.inc(labels={"endpoint": "recognize_faces", "status": "404"})
+            return 404, {"error": course_error}
+
+        with stage_timer("decode"):
+            img = cv2.imdecode(np.frombuffer(file_bytes, np.uint8), cv2.IMREAD_COLOR)
+        if img is None:
+            REQUESTS_TOTAL.inc(labels={"endpoint": "recognize_faces", "status": "400"})
+            return 400, {"error": "Failed to decode image"}
+
+        response = run_recognition(
+            file_bytes,
+            img,
+            request_start,
+            course_id=course_id,
+            session_id=params.get('session_id'),
+            params=params,
+            profile=params.get('profile') or None,
+            camera_id=params.get('camera_id') or None
+        )
+        REQUESTS_TOTAL.inc(labels={"endpoint": "recognize_faces", "status": "200"})
+        return 200, response
+    except Exception as e:
+        error_traceback = traceback.format_exc()
+        logger.error(f"Error in recognize_faces: {str(e)}")
+        logger.error(f"Traceback: {error_traceback}")
+        REQUESTS_TOTAL.inc(labels={"endpoint": "recognize_faces", "status": "500"})
+        return 500, {"error": str(e), "traceback": error_traceback}
+
+
+@api.post("/recognize_faces/")
+async def recognize_faces(request: Request):
+    """
+    Same contract as the Flask endpoint. Per-request profiling (X-Profile)
+    is only available when serving the Flask app directly.
+    """
+    form = await request.form()
+    upload = form.get('file')
+    if upload is None or isinstance(upload, str):
+        REQUESTS_TOTAL.inc(labels={"endpoint": "recognize_faces", "status": "400"})
+        return json_response({"error": "No file provided"}, 400)
+
+    params = {key: value for key, value in form.items() if isinstance(value, str)}
+    profile_error = unknown_profile_error(params.get('profile') or None)
+    if profile_error:
+        REQUESTS_TOTAL.inc(labels={"endpoint": "recognize_faces", "status": "400"})
+        return json_response({"error": profile_error}, 400)
+
+    file_bytes = await upload.read()
+    status, payload = await asyncio.get_running_loop().run_in_executor(
+        _recognition_executor, _recognize, file_bytes, params
+    )
+    return json_response(payload, status)
+
+
+def _count(file_bytes: bytes, params: Dict[str, str], max_side) -> Tuple[int, Dict[str, Any]]:
+    """Decode an upload and count its faces on a recognition thread, returns (status, body)."""
+    start_request()
+    try:
+        with stage_timer("decode"):
+            img = cv2.imdecode(np.frombuffer(file_bytes, np.uint8), cv2.IMREAD_COLOR)
+        if img is None:
+            REQUESTS_TOTAL.inc(labels={"endpoint": "count_faces", "status": "400"})
+            return 400, {"error": "Failed to decode image"}
+
+        try:
+            course_id = int(params['course_id']) if params.get('course_id') else None
+        except ValueError:
+            course_id = None
+        response = run_count(
+            img,
+            profile=params.get('profile') or None,
+            max_side=max_side,
+            course_id=course_id,
+            camera_id=params.get('camera_id') or None
+        )
+        REQUESTS_TOTAL.inc(labels={"endpoint": "count_faces", "status": "200"})
+        return 200, response
+    except Exception as e:
+        logger.error(f"Error in count_faces: {str(e)}")
+        logger.error(f"Traceback: {traceback.format_exc()}")
+        REQUESTS_TOTAL.inc(labels={"endpoint": "count_faces", "status": "500"})
+        return 500, {"error": str(e)}
+
+
+@api.post("/count_faces/")
+async def count_faces(request: Request):
+    """Same contract as the Flask endpoint"""
+    form = await request.form()
+    upload = form.get('file')
+    if upload is None or isinstance(upload, str):
+        REQUESTS_TOTAL.inc(labels={"endpoint": "count_faces", "status": "400"})
+        return json_response({"error": "No file provided"}, 400)
+
+    params = {key: value for key, value in form.items() if isinstance(value, str)}
+    error = unknown_profile_error(params.get('profile') or None)
+    max_side = None
+    try:
+        max_side = parse_max_side(params.get('max_side'))
+    except ValueError as e:
+        error = error or str(e)
+    if error:
+        REQUESTS_TOTAL.inc(labels={"endpoint": "count_faces", "status": "400"})
+        return json_response({"error": error}, 400)
+
+    file_bytes = await upload.read()
+    status, payload = await asyncio.get_running_loop().run_in_executor(
+        _recognition_executor, _count, file_bytes, params, max_side
+    )
+    return json_response(payload, status)
+
+
+# Writes, enrollment, attendance, metrics and profiles are served by Flask
+api.mount("/", WSGIMiddleware(flask_app))
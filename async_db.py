@@ -0,0 +1,99 @@
+import os
+import re
+import asyncio
+import logging
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+from db import DB_BACKEND, get_db_connection
+
+logger = logging.getLogger(__name__)
+
+ASYNC_DB_MIN_SIZE = int(os.getenv("ASYNC_DB_MIN_SIZE", "2"))
+ASYNC_DB_MAX_SIZE = int(os.getenv("ASYNC_DB_MAX_SIZE", "20"))
+
+# Queries are shared with the psycopg2 code and use %s, asyncpg wants $1, $2...
+_PLACEHOLDER = re.compile(r"%s")
+
+_pool = None
+
+
+async def open_pool() -> None:
+    """Open the asyncpg connection pool of the process, a no-op on the local stand-in."""
+    global _pool
+    if DB_BACKEND == "local" or _pool is not None:
+        return
+    import asyncpg
+    _pool = await asyncpg.create_pool(
+        host=os.getenv("DB_HOST"),
+        user=os.getenv("DB_USER"),
+        password=os.getenv("DB_PASSWORD"),
+        database=os.getenv("DB_NAME"),
+        port=os.getenv("DB_PORT"),
+        min_size=ASYNC_DB_MIN_SIZE,
+        max_size=ASYNC_DB_MAX_SIZE
+    )
+    logger.info(f"Opened async database pool ({ASYNC_DB_MIN_SIZE}-{ASYNC_DB_MAX_SIZE} connections)")
+
+
+async def close_pool() -> None:
+    global _pool
+    if _pool is not None:
+        await _pool.close()
+        _pool = None
+
+
+def _fetch_local(query: str, args: tuple) -> List[Dict[str, Any]]:
+    conn = get_db_connection()
+    cursor = conn.cursor(cursor_factory=dict)
+    try:
+        cursor.execute(query, args)
+        return cursor.fetchall()
+    finally:
+        cursor.close()
+        conn.close()
+
+
+def _numbered(query: str) -> str:
+    counter = iter(range(1, query.count("%s") + 1))
+    return _PLACEHOLDER.sub(lambda _: f"${next(counter)}", query)
+
+
+async def fetch(query: str, *args: Any) -> List[Dict[str, Any]]:
+    """
+    Rows of a query as dicts, like a RealDictCursor
+
+    Args:
+        query (str): SQL with psycopg2-style %s placeholders
+    """
+    if _pool is None:
+        if DB_BACKEND != "local":
+            raise RuntimeError("The async database pool is not open")
+        return await asyncio.to_thread(_fetch_local, query, args)
+    async with _pool.acquire() as conn:
+        return [dict(row) for row in await conn.fetch(_numbered(query), *args)]
+
+
+async def fetchrow(query: str, *args: Any) -> Optional[Dict[str, Any]]:
+    """First row of a query as a dict, None if there is none"""
+    if _pool is None:
+        rows = await fetch(query, *args)
+        return rows[0] if rows else None
+    async with _pool.acquire() as conn:
+        row = await conn.fetchrow(_numbered(query), *args)
+        return dict(row) if row is not None else None
+
+
+async def stream(query: str, *args: Any, prefetch: int = 2000) -> AsyncIterator[Dict[str, Any]]:
+    """
+    Iterate over a query through a server-side cursor, `prefetch` rows per round trip.
+    The local stand-in reads the whole result at once.
+    """
+    if _pool is None:
+        for row in await fetch(query, *args):
+            yield row
+        return
+    async with _pool.acquire() as conn:
+        # asyncpg cursors only live inside a transaction
+        async with conn.transaction():
+            async for row in conn.cursor(_numbered(query), *args, prefetch=prefetch):
+                yield dict(row)
@@ -0,0 +1,279 @@
+import os
+import json
+import atexit
+import signal
+import logging
+import threading
+from datetime import datetime, date
+from typing import Dict, Any, List, Optional, Tuple
+
+import psycopg2
+
+from db import get_db_connection, execute_values
+from metrics import stage_timer, ATTENDANCE_REJECTED_TOTAL
+
+logger = logging.getLogger(__name__)
+
+ATTENDANCE_BATCH_SIZE = int(os.getenv("ATTENDANCE_BATCH_SIZE", "200"))
+ATTENDANCE_FLUSH_INTERVAL = float(os.getenv("ATTENDANCE_FLUSH_INTERVAL", "2.0"))
+# Upper bound on rows kept in memory while the database is unreachable
+ATTENDANCE_MAX_BUFFER = int(os.getenv("ATTENDANCE_MAX_BUFFER", "50000"))
+
+CREATE_ATTENDANCE_TABLE = """
+    CREATE TABLE IF NOT EXISTS attendance (
+        attendanceid SERIAL PRIMARY KEY,
+        courseid INTEGER NOT NULL REFERENCES course(courseid),
+        studentid INTEGER NOT NULL REFERENCES student(studentid),
+        sessionid TEXT NOT NULL,
+        seen_at TIMESTAMP NOT NULL,
+        confidence REAL NOT NULL,
+        bbox TEXT,
+        UNIQUE (sessionid, studentid)
+    );
+"""
+
+# A student seen several times in a session keeps a single row, holding the
+# most confident sighting. Replaying the same batch leaves the table unchanged.
+UPSERT_ATTENDANCE = """
+    INSERT INTO attendance (courseid, studentid, sessionid, seen_at, confidence, bbox)
+    VALUES %s
+    ON CONFLICT (sessionid, studentid) DO UPDATE SET
+        seen_at = EXCLUDED.seen_at,
+        confidence = EXCLUDED.confidence,
+        bbox = EXCLUDED.bbox
+    WHERE EXCLUDED.confidence > attendance.confidence
+"""
+
+
+def default_session_id(course_id: int, day: Optional[date] = None) -> str:
+    """Session used when the client does not send one: one per course and day."""
+    return f"{course_id}-{(day or date.today()).isoformat()}"
+
+
+class AttendanceBuffer:
+    """
+    Write-behind buffer for attendance rows.
+
+    record() only appends to an in-memory list; a background thread writes
+    the rows in batches once ATTENDANCE_BATCH_SIZE rows are waiting or every
+    ATTENDANCE_FLUSH_INTERVAL seconds, so recognition never waits on the database.
+    """
+
+    def __init__(
+        self,
+        batch_size: int = ATTENDANCE_BATCH_SIZE,
+        flush_interval: float = ATTENDANCE_FLUSH_INTERVAL,
+        max_buffer: int = ATTENDANCE_MAX_BUFFER
+    ):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_buffer = max_buffer
+        self._rows: List[Tuple] = []
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._table_ready = False
+        self._thread = threading.Thread(target=self._run, name="attendance-writer", daemon=True)
+        self._thread.start()
+
+    def record(
+        self,
+        course_id: int,
+        student_id: int,
+        session_id: str,
+        confidence: float,
+        bounding_box: Optional[Tuple[int, int, int, int]] = None,
+        seen_at: Optional[datetime] = None
+    ) -> None:
+        """Queue one sighting of a student for the given course session."""
+        row = (
+            course_id,
+            student_id,
+            session_id,
+            seen_at or datetime.now(),
+            float(confidence),
+            json.dumps([int(v) for v in bounding_box]) if bounding_box is not None else None
+        )
+        with self._lock:
+            if len(self._rows) >= self.max_buffer:
+                logger.warning("Attendance buffer full, dropping oldest row")
+                self._rows.pop(0)
+            self._rows.append(row)
+            pending = len(self._rows)
+        if pending >= self.batch_size:
+            self._wakeup.set()
+
+    def record_faces(self, course_id: int, session_id: str, faces: List[Dict[str, Any]]) -> int:
+        """
+        Queue every recognized student of a recognition result
+
+        Returns:
+            int: Number of rows queued (strangers are skipped)
+        """
+        count = 0
+        for face in faces:
+            if face.get('student_id') is None:
+                continue
+            self.record(course_id, face['student_id'], session_id, face['confidence'], face.get('bounding_box'))
+            count += 1
+        return count
+
+    def pending(self) -> int:
+        with self._lock:
+            return len(self._rows)
+
+    def _ensure_table(self, conn, cursor) -> None:
+        # Postgres rolls back DDL with the transaction, so the table only counts as created once committed
+        if not self._table_ready:
+            cursor.execute(CREATE_ATTENDANCE_TABLE)
+            conn.commit()
+            self._table_ready = True
+
+    def _write_rows(self, conn, cursor, rows: List[Tuple]) -> int:
+        """
+        Upsert rows one by one after their batch hit a constraint, dropping the
+        rows that violate one (unknown course, deleted student) so they do not
+        block the others forever
+
+        Returns:
+            int: Number of rows written
+        """
+        written = 0
+        for row in rows:
+            try:
+                execute_values(cursor, UPSERT_ATTENDANCE, [row])
+                conn.commit()
+                written += 1
+            except psycopg2.IntegrityError as e:
+                conn.rollback()
+                ATTENDANCE_REJECTED_TOTAL.inc()
+                logger.error(
+                    f"Dropping attendance of student {row[1]} in course {row[0]}, session {row[2]}: {str(e).strip()}"
+                )
+        return written
+
+    def flush(self) -> int:
+        """
+        Write every buffered row to the database
+
+        Returns:
+            int: Number of rows written
+        """
+        with self._flush_lock:
+            with self._lock:
+                rows, self._rows = self._rows, []
+            if not rows:
+                return 0
+
+            # Collapse the batch to one row per (session, student) before the upsert,
+            # Postgres refuses to update the same row twice in one statement
+            best = {}
+            for row in rows:
+                key = (row[2], row[1])
+                if key not in best or row[4] > best[key][4]:
+                    best[key] = row
+            batch = list(best.values())
+
+            conn = None
+            try:
+                conn = get_db_connection()
+                cursor = conn.cursor()
+                self._ensure_table(conn, cursor)
+                with stage_timer("db_io"):
+                    try:
+                        execute_values(cursor, UPSERT_ATTENDANCE, batch, page_size=self.batch_size)
+                        conn.commit()
+                        written = len(batch)
+                    except psycopg2.IntegrityError:
+                        conn.rollback()
+                        written = self._write_rows(conn, cursor, batch)
+                cursor.close()
+                logger.info(f"Flushed {written} attendance rows")
+                return written
+            except Exception as e:
+                if conn:
+                    conn.rollback()
+                # Rows already written by _write_rows are requeued too, replaying them is a no-op
+                logger.error(f"Error flushing attendance rows, will retry: {str(e)}")
+                with self._lock:
+                    self._rows = (batch + self._rows)[-self.max_buffer:]
+                return 0
+            finally:
+                if conn:
+                    conn.close()
+
+    def _run(self) -> None:
+        while not self._stopped.is_set():
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            self.flush()
+
+    def close(self) -> None:
+        """Stop the background writer and persist whatever is still buffered."""
+        if self._stopped.is_set():
+            return
+        self._stopped.set()
+        self._wakeup.set()
+        self._thread.join(timeout=self.flush_interval + 5)
+        self.flush()
+        remaining = self.pending()
+        if remaining:
+            logger.error(f"{remaining} attendance rows could not be persisted on shutdown")
+
+
+attendance_buffer = AttendanceBuffer()
+atexit.register(attendance_buffer.close)
+
+
+def install_shutdown_handler() -> None:
+    """
+    Turn SIGTERM into a normal interpreter exit so the atexit flush runs.
+    Only possible from the main thread, and only for the Flask server: under
+    uvicorn it would replace the server's own graceful shutdown, so asgi.py
+    closes the buffer from its lifespan instead.
+    """
+    def _handle_sigterm(signum, frame):
+        raise SystemExit(0)
+
+    try:
+        signal.signal(signal.SIGTERM, _handle_sigterm)
+    except ValueError:
+        logger.warning("Not in the main thread, SIGTERM will not flush the attendance buffer")
+
+
+def get_attendance(course_id: int, session_id: Optional[str] = None) -> List[Dict[str, Any]]:
+    """
+    Read recorded attendance for a course, optionally for a single session
+    """
+    # Make rows still waiting in the buffer visible to the report
+    attendance_buffer.flush()
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        attendance_buffer._ensure_table(conn, cursor)
+        query = """
+            SELECT a.sessionid, a.studentid, s.name, a.seen_at, a.confidence, a.bbox
+            FROM attendance a
+            JOIN student s ON s.studentid = a.studentid
+            WHERE a.courseid = %s
+        """
+        params: Tuple = (course_id,)
+        if session_id:
+            query += " AND a.sessionid = %s"
+            params += (session_id,)
+        cursor.execute(query + " ORDER BY a.sessionid, s.name", params)
+        return [
+            {
+                'session_id': session,
+                'student_id': student_id,
+                'name': name,
+                'seen_at': seen_at.isoformat() if hasattr(seen_at, 'isoformat') else seen_at,
+                'confidence': confidence,
+                'bounding_box': json.loads(bbox) if bbox else None
+            }
+            for session, student_id, name, seen_at, confidence, bbox in cursor.fetchall()
+        ]
+    finally:
+        cursor.close()
+        conn.close()
@@ -0,0 +1,123 @@
+import os
+import csv
+import hashlib
+from typing import Dict, Any, List, Optional, Set, Tuple
+
+STORE_PATH = "face_recognition_benchmark_detailed.csv"
+
+COLUMNS = [
+    "timestamp",
+    "model",
+    "detector",
+    "image_type",
+    "image_path",
+    "code_version",
+    "similarity_score",
+    "computation_time",
+    "detection_time",
+    "embedding_length",
+    "faces_detected",
+    "time_per_face"
+]
+NUMERIC_COLUMNS = {
+    "similarity_score": float,
+    "computation_time": float,
+    "detection_time": float,
+    "embedding_length": int,
+    "faces_detected": int,
+    "time_per_face": float
+}
+
+# Results written before the store existed: face_recognition ran its own YOLO detection
+LEGACY_CODE_VERSION = "legacy"
+
+
+def source_version(*paths: str) -> str:
+    """Short hash of the benchmark source files, changes whenever the code does."""
+    digest = hashlib.sha1()
+    for path in paths:
+        with open(path, "rb") as f:
+            digest.update(f.read())
+    return digest.hexdigest()[:12]
+
+
+def _legacy_detector(model: str) -> str:
+    return "yolov8" if model == "face_recognition" else "retinaface"
+
+
+class BenchmarkStore:
+    """
+    Append-only CSV of benchmark results, one row per (model, detector, image, code version).
+
+    Every row is flushed and fsynced as soon as it is appended, so a crash
+    loses at most the model being evaluated, and a rerun skips what is done.
+    """
+
+    def __init__(self, path: str = STORE_PATH):
+        self.path = path
+        self._migrate()
+
+    def _migrate(self) -> None:
+        """Add the key columns to a results file written by the old benchmark."""
+        if not os.path.exists(self.path) or os.path.getsize(self.path) == 0:
+            with open(self.path, "w", newline="") as f:
+                csv.writer(f).writerow(COLUMNS)
+            return
+        with open(self.path, newline="") as f:
+            reader = csv.DictReader(f)
+            if reader.fieldnames == COLUMNS:
+                return
+            rows = list(reader)
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=COLUMNS)
+            writer.writeheader()
+            for row in rows:
+                row.setdefault("detector", _legacy_detector(row.get("model", "")))
+                row.setdefault("code_version", LEGACY_CODE_VERSION)
+                row.setdefault("detection_time", "")
+                writer.writerow({column: row.get(column, "") for column in COLUMNS})
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+
+    def completed_keys(self, code_version: str) -> Set[Tuple[str, str, str]]:
+        """(model, detector, image_path) already computed with this code version."""
+        return {
+            (row["model"], row["detector"], row["image_path"])
+            for row in self.read(columns=["model", "detector", "image_path", "code_version"])
+            if row["code_version"] == code_version
+        }
+
+    def append(self, row: Dict[str, Any]) -> None:
+        with open(self.path, "a", newline="") as f:
+            csv.DictWriter(f, fieldnames=COLUMNS).writerow({column: row.get(column, "") for column in COLUMNS})
+            f.flush()
+            os.fsync(f.fileno())
+
+    def latest_code_version(self) -> Optional[str]:
+        """
+        Code version of the most recently appended row, ignoring the legacy
+        rows unless there is nothing else. None for an empty store.
+        """
+        latest = None
+        for row in self.read(columns=["code_version"]):
+            if row["code_version"] != LEGACY_CODE_VERSION or latest is None:
+                latest = row["code_version"]
+        return latest
+
+    def read(self, columns: List[str] = None, code_version: str = None) -> List[Dict[str, Any]]:
+        """
+        Rows of the store, restricted to `columns` and optionally to one code version
+        """
+        rows = []
+        with open(self.path, newline="") as f:
+            for row in csv.DictReader(f):
+                if code_version is not None and row["code_version"] != code_version:
+                    continue
+                selected = {column: row[column] for column in (columns or COLUMNS)}
+                for column, cast in NUMERIC_COLUMNS.items():
+                    if column in selected and selected[column] != "":
+                        selected[column] = cast(float(selected[column]))
+                rows.append(selected)
+        return rows
@@ -75,6 +75,20 @@ export default function AddFace() {
         headers: { 'Content-Type': 'multipart/form-data' },
       });
       setMessage(res.data.message || 'Face added successfully!');
+
+      // Enrollment runs in the background, poll until the worker is done
+      let status = res.data.status;
+      while (res.status === 202 && (status === 'pending' || status === 'processing')) {
+        await new Promise((resolve) => setTimeout(resolve, 1000));
+        const statusRes = await axios.get(`http://localhost:8000/add_face/${res.data.enrollment_id}`);
+        status = statusRes.data.status;
+        if (status === 'failed') {
+          throw { response: { data: { error: statusRes.data.error } } };
+        }
+      }
+      if (status === 'succeeded') {
+        setMessage(`Successfully added '${name}' to the database.`);
+      }
       setSelectedFile(null);
       setName('');
       // Clear preview after successful upload
@@ -0,0 +1,395 @@
+"""
+Serve many classroom cameras from one process and one resident model.
+
+Each camera is read on its own thread that only keeps the latest frame,
+like a live stream nobody waits for. A single scheduler thread hands the
+frames to a shared pool of recognition workers: cameras are visited in
+round-robin, each at most at its own frame rate and with at most one frame
+in flight, so a busy camera cannot starve the others. When frames come out
+later than their rate allows, the camera's rate is halved (down to
+--min-fps); while they keep up, it creeps back up to --max-fps.
+
+    python camera_scheduler.py --camera room101=rtsp://10.0.0.5/stream --camera room102=lecture.mp4 \\
+        --course room101=3 --workers 2 --max-fps 1 --metrics-port 9108
+
+With --metrics-port, the per-camera rate, lag and schedule delay gauges are
+served at http://<host>:<port>/metrics for Prometheus to scrape.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import logging
+import threading
+import concurrent.futures
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import cv2
+import numpy as np
+
+from metrics import (
+    start_metrics_server, CAMERA_FRAMES_TOTAL, CAMERA_TARGET_FPS, CAMERA_LAG_SECONDS, CAMERA_SCHEDULE_DELAY_SECONDS
+)
+
+logger = logging.getLogger(__name__)
+
+CAMERA_MAX_FPS = float(os.getenv("CAMERA_MAX_FPS", "1.0"))
+CAMERA_MIN_FPS = float(os.getenv("CAMERA_MIN_FPS", "0.05"))
+# Lag from capture to result over which a camera is slowed down
+CAMERA_MAX_LAG = float(os.getenv("CAMERA_MAX_LAG", "3.0"))
+# Frame-rate increase per frame delivered on time, and factor applied when late
+CAMERA_FPS_STEP = 0.05
+CAMERA_FPS_BACKOFF = 0.5
+
+
+class CameraSource:
+    """
+    Latest frame of a camera, read on a background thread. Stream URIs and
+    device indices are read as fast as they deliver; video files stand in
+    for a live camera and are paced at their own frame rate (realtime=True).
+    """
+
+    def __init__(self, camera_id: str, uri: str, realtime: Optional[bool] = None):
+        self.camera_id = camera_id
+        self.uri = uri
+        self._capture = cv2.VideoCapture(int(uri) if uri.isdigit() else uri)
+        if not self._capture.isOpened():
+            raise ValueError(f"Cannot open camera {camera_id}: {uri}")
+        self.realtime = os.path.isfile(uri) if realtime is None else realtime
+        self._fps = self._capture.get(cv2.CAP_PROP_FPS) or 25.0
+        self._lock = threading.Lock()
+        self._latest: Optional[Tuple[int, float, np.ndarray]] = None
+        self._sequence = 0
+        self._stop = threading.Event()
+        self.finished = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=f"camera-{camera_id}", daemon=True)
+
+    def start(self) -> "CameraSource":
+        self._thread.start()
+        return self
+
+    def _run(self) -> None:
+        start = time.monotonic()
+        try:
+            while not self._stop.is_set():
+                if not self._capture.grab():
+                    break
+                if self.realtime:
+                    # Frame n of a file is "captured" n / fps seconds after the start
+                    wait = start + self._sequence / self._fps - time.monotonic()
+                    if wait > 0:
+                        time.sleep(wait)
+                ok, frame = self._capture.retrieve()
+                if not ok:
+                    continue
+                with self._lock:
+                    self._sequence += 1
+                    self._latest = (self._sequence, time.monotonic(), frame)
+        except Exception as e:
+            logger.error(f"Camera {self.camera_id} stopped: {str(e)}")
+        finally:
+            self._capture.release()
+            self.finished.set()
+
+    def latest(self) -> Optional[Tuple[int, float, np.ndarray]]:
+        """(sequence number, monotonic capture time, BGR frame) of the newest frame, None before the first"""
+        with self._lock:
+            return self._latest
+
+    def stop(self) -> None:
+        self._stop.set()
+
+
+class CameraState:
+    """Scheduling state of one camera, only touched by the scheduler thread and the camera's own job"""
+
+    def __init__(self, source: CameraSource, max_fps: float, options: Dict[str, Any]):
+        self.source = source
+        self.options = options
+        self.fps = max_fps
+        self.next_due = 0.0
+        self.last_sequence = 0
+        self.in_flight = False
+        self.processed = 0
+        self.errors = 0
+        self.lag = 0.0
+        self.delay = 0.0
+
+
+class CameraScheduler:
+    """
+    Fair, rate-limited scheduling of camera frames on a shared pool of
+    recognition workers, with additive-increase / multiplicative-decrease
+    of each camera's frame rate.
+
+    Args:
+        process (callable): process(camera_id, frame, capture_time, options) -> result,
+            called on a worker thread
+        on_result (callable): on_result(camera_id, capture_time, result), called on the worker thread
+    """
+
+    def __init__(
+        self,
+        process: Callable[[str, np.ndarray, float, Dict[str, Any]], Any],
+        workers: int = 2,
+        max_fps: float = CAMERA_MAX_FPS,
+        min_fps: float = CAMERA_MIN_FPS,
+        max_lag: float = CAMERA_MAX_LAG,
+        on_result: Optional[Callable[[str, float, Any], None]] = None
+    ):
+        self.process = process
+        self.on_result = on_result
+        self.workers = workers
+        self.max_fps = max_fps
+        self.min_fps = min_fps
+        self.max_lag = max_lag
+        self.cameras: Dict[str, CameraState] = {}
+        self._order: List[str] = []
+        self._next = 0
+        self._busy = 0
+        self._changed = threading.Condition()
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers, thread_name_prefix="recognition")
+
+    def add_camera(self, source: CameraSource, **options: Any) -> None:
+        """Schedule a camera; options are passed to process() with each of its frames"""
+        self.cameras[source.camera_id] = CameraState(source, self.max_fps, options)
+        self._order.append(source.camera_id)
+        CAMERA_TARGET_FPS.set(self.max_fps, {"camera": source.camera_id})
+
+    def _pick(self, now: float) -> Tuple[Optional[CameraState], Optional[float]]:
+        """
+        Next camera to serve, in round-robin from the one after the last
+        served: idle, due, and with a frame it has not seen yet.
+
+        Returns:
+            tuple: (camera or None, earliest due time among the idle cameras)
+        """
+        earliest = None
+        for offset in range(len(self._order)):
+            state = self.cameras[self._order[(self._next + offset) % len(self._order)]]
+            if state.in_flight:
+                continue
+            latest = state.source.latest()
+            if latest is None or latest[0] == state.last_sequence:
+                continue
+            if state.next_due <= now:
+                self._next = (self._next + offset + 1) % len(self._order)
+                return state, None
+            earliest = state.next_due if earliest is None else min(earliest, state.next_due)
+        return None, earliest
+
+    def _submit(self, state: CameraState, now: float) -> None:
+        sequence, captured, frame = state.source.latest()
+        state.last_sequence = sequence
+        state.in_flight = True
+        # How long a frame waited for the pool past the camera's due time. A frame
+        # captured after that time only counts from its capture: waiting for a slow
+        # camera to deliver is not a scheduling delay.
+        state.delay = max(0.0, now - max(state.next_due, captured)) if state.next_due else 0.0
+        state.next_due = now + 1.0 / state.fps
+        self._busy += 1
+        self._executor.submit(self._run_job, state, frame, captured)
+
+    def _run_job(self, state: CameraState, frame: np.ndarray, captured: float) -> None:
+        camera_id = state.source.camera_id
+        try:
+            result = self.process(camera_id, frame, captured, state.options)
+            state.processed += 1
+            CAMERA_FRAMES_TOTAL.inc(labels={"camera": camera_id, "result": "processed"})
+            if self.on_result is not None:
+                self.on_result(camera_id, captured, result)
+        except Exception as e:
+            state.errors += 1
+            CAMERA_FRAMES_TOTAL.inc(labels={"camera": camera_id, "result": "error"})
+            logger.error(f"Frame of camera {camera_id} failed: {str(e)}")
+        finally:
+            state.lag = time.monotonic() - captured
+            self._adapt(state)
+            with self._changed:
+                state.in_flight = False
+                self._busy -= 1
+                self._changed.notify()
+
+    def _adapt(self, state: CameraState) -> None:
+        """Halve the rate of a camera that falls behind, raise it slowly while it keeps up"""
+        interval = 1.0 / state.fps
+        if state.lag > self.max_lag or state.delay > interval:
+            state.fps = max(self.min_fps, state.fps * CAMERA_FPS_BACKOFF)
+        else:
+            state.fps = min(self.max_fps, state.fps + CAMERA_FPS_STEP)
+        labels = {"camera": state.source.camera_id}
+        CAMERA_TARGET_FPS.set(state.fps, labels)
+        CAMERA_LAG_SECONDS.set(state.lag, labels)
+        CAMERA_SCHEDULE_DELAY_SECONDS.set(state.delay, labels)
+
+    @staticmethod
+    def _exhausted(state: CameraState) -> bool:
+        """Whether a camera's source has ended and its last frame was processed"""
+        if not state.source.finished.is_set():
+            return False
+        latest = state.source.latest()
+        return latest is None or latest[0] == state.last_sequence
+
+    def run(self, duration: Optional[float] = None) -> None:
+        """Schedule frames until every source has ended, or for `duration` seconds"""
+        for state in self.cameras.values():
+            state.source.start()
+        deadline = time.monotonic() + duration if duration else None
+        try:
+            with self._changed:
+                while deadline is None or time.monotonic() < deadline:
+                    if self._busy == 0 and all(self._exhausted(state) for state in self.cameras.values()):
+                        break
+                    now = time.monotonic()
+                    state, earliest = (None, None) if self._busy >= self.workers else self._pick(now)
+                    if state is not None:
+                        self._submit(state, now)
+                        continue
+                    # Woken by a finished job, else when the next camera is due or a frame may have arrived
+                    timeout = 0.05 if earliest is None else min(max(earliest - now, 0.001), 0.05)
+                    self._changed.wait(timeout)
+        finally:
+            for state in self.cameras.values():
+                state.source.stop()
+            self._executor.shutdown(wait=True)
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        return {
+            camera_id: {
+                "processed": state.processed,
+                "errors": state.errors,
+                "fps": round(state.fps, 3),
+                "lag_seconds": round(state.lag, 3),
+                "schedule_delay_seconds": round(state.delay, 3)
+            }
+            for camera_id, state in self.cameras.items()
+        }
+
+
+def recognize_camera_frame(camera_id: str, frame: np.ndarray, captured: float, options: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    process() of the scheduler: the recognition of /courses/<id>/attendance,
+    with the camera's ROI mask and face tracker
+
+    Options:
+        course_id (int): Match the course roster first
+        profile (str): Speed profile
+        tracker (FaceTracker): Tracks of this camera, deepface engine only
+    """
+    from engines import recognize
+    from gallery import get_gallery, get_course_gallery
+    from roster import get_course_roster
+    from roi import get_roi
+
+    course_id = options.get("course_id")
+    gallery, fallback_gallery = get_gallery(), None
+    if course_id is not None:
+        roster = get_course_roster(course_id) or []
+        gallery, fallback_gallery = get_course_gallery(course_id, [student['studentid'] for student in roster]), gallery
+    tracking = {"tracker": options["tracker"], "timestamp": captured} if options.get("tracker") else {}
+    return recognize(
+        frame,
+        profile=options.get("profile"),
+        gallery=gallery,
+        fallback_gallery=fallback_gallery,
+        roi=get_roi(course_id, camera_id),
+        **tracking
+    )
+
+
+def parse_pairs(items: List[str], flag: str) -> Dict[str, str]:
+    pairs = {}
+    for item in items:
+        key, sep, value = item.partition("=")
+        if not sep or not key or not value:
+            raise ValueError(f"{flag} expects CAMERA=VALUE, got {item}")
+        pairs[key] = value
+    return pairs
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Recognize many cameras on one shared recognition pool")
+    parser.add_argument("--camera", action="append", default=[], metavar="ID=URI", required=True,
+                        help="Stream URI, device index or video file of a camera")
+    parser.add_argument("--course", action="append", default=[], metavar="ID=COURSE_ID",
+                        help="Course filmed by a camera, for its roster and ROI mask")
+    parser.add_argument("--profile", choices=["fast", "balanced", "accurate"])
+    parser.add_argument("--workers", type=int, default=int(os.getenv("RECOGNITION_WORKERS", "2")))
+    parser.add_argument("--max-fps", type=float, default=CAMERA_MAX_FPS, help="Frame rate of a camera when the pool keeps up")
+    parser.add_argument("--min-fps", type=float, default=CAMERA_MIN_FPS, help="Frame rate a camera is never slowed below")
+    parser.add_argument("--max-lag", type=float, default=CAMERA_MAX_LAG, help="Capture-to-result lag that slows a camera down")
+    parser.add_argument("--duration", type=float, help="Stop after this many seconds, default when every source ends")
+    parser.add_argument("--no-track", action="store_true", help="Embed every face of every frame")
+    parser.add_argument("--output", help="Write the per-camera statistics and sightings as JSON")
+    parser.add_argument("--metrics-port", type=int, default=int(os.getenv("CAMERA_METRICS_PORT", "0")) or None,
+                        help="Serve the Prometheus metrics of the run on this port")
+    args = parser.parse_args()
+    logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO").upper(), format='%(asctime)s - %(levelname)s - %(message)s')
+
+    try:
+        cameras = parse_pairs(args.camera, "--camera")
+        courses = {camera_id: int(course_id) for camera_id, course_id in parse_pairs(args.course, "--course").items()}
+    except ValueError as e:
+        parser.error(str(e))
+
+    from engines import get_engine, require_student_ids, RECOGNITION_ENGINE
+    from face_tracker import FaceTracker
+    from video_attendance import SightingAggregator
+
+    # Sightings are aggregated per student_id
+    try:
+        require_student_ids()
+    except ValueError as e:
+        parser.error(str(e))
+
+    # One resident engine for every camera, loaded before the first frame
+    get_engine()
+    aggregators = {camera_id: SightingAggregator() for camera_id in cameras}
+    aggregators_lock = threading.Lock()
+    started = time.monotonic()
+
+    def on_result(camera_id: str, captured: float, faces: Dict[str, Any]) -> None:
+        # Sightings are timed in seconds since the start of the run
+        with aggregators_lock:
+            aggregators[camera_id].add(aggregators[camera_id].frames, captured - started, faces, None)
+
+    scheduler = CameraScheduler(
+        recognize_camera_frame,
+        workers=args.workers,
+        max_fps=args.max_fps,
+        min_fps=args.min_fps,
+        max_lag=args.max_lag,
+        on_result=on_result
+    )
+    for camera_id, uri in cameras.items():
+        tracker = FaceTracker() if not args.no_track and RECOGNITION_ENGINE == "deepface" else None
+        scheduler.add_camera(CameraSource(camera_id, uri), course_id=courses.get(camera_id), profile=args.profile, tracker=tracker)
+
+    metrics_server = start_metrics_server(args.metrics_port) if args.metrics_port else None
+    if metrics_server is not None:
+        logger.info(f"Serving metrics on port {args.metrics_port}")
+    try:
+        scheduler.run(args.duration)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if metrics_server is not None:
+            metrics_server.shutdown()
+
+    stats = scheduler.stats()
+    for camera_id, camera_stats in stats.items():
+        print(
+            f"{camera_id}: {camera_stats['processed']} frame(s), {camera_stats['errors']} error(s), "
+            f"{camera_stats['fps']} fps, lag {camera_stats['lag_seconds']}s, "
+            f"{len(aggregators[camera_id].students)} student(s) seen"
+        )
+    if args.output:
+        report = {
+            camera_id: dict(camera_stats, students=aggregators[camera_id].sightings())
+            for camera_id, camera_stats in stats.items()
+        }
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2, default=str)
+        print(f"Report saved to {args.output}")
+    sys.exit(0 if any(camera_stats['processed'] for camera_stats in stats.values()) else 1)
@@ -0,0 +1,114 @@
+import os
+import json
+import uuid
+import random
+import hashlib
+import logging
+import concurrent.futures
+from datetime import datetime
+from typing import Dict, Any, List, Optional
+
+import numpy as np
+
+from gallery import Gallery
+
+logger = logging.getLogger(__name__)
+
+# Capture is off unless CAPTURE_DIR is set
+CAPTURE_DIR = os.getenv("CAPTURE_DIR")
+CAPTURE_SAMPLE_RATE = float(os.getenv("CAPTURE_SAMPLE_RATE", "0.1"))
+
+# Writes happen off the request thread, one at a time
+_writer = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="capture")
+_saved_galleries = set()
+
+
+def should_capture() -> bool:
+    return bool(CAPTURE_DIR) and random.random() < CAPTURE_SAMPLE_RATE
+
+
+def _gallery_path(capture_dir: str, fingerprint: str) -> str:
+    return os.path.join(capture_dir, "galleries", f"{fingerprint}.npz")
+
+
+def _save_gallery(capture_dir: str, gallery: Gallery) -> None:
+    """Snapshot a gallery once per content, so replays use the exact same known faces."""
+    fingerprint = gallery.fingerprint()
+    path = _gallery_path(capture_dir, fingerprint)
+    if fingerprint in _saved_galleries or os.path.exists(path):
+        _saved_galleries.add(fingerprint)
+        return
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    student_ids, names, embeddings = gallery.live_rows()
+    np.savez_compressed(
+        path,
+        student_ids=np.array(student_ids),
+        names=np.array(names),
+        embeddings=embeddings
+    )
+    _saved_galleries.add(fingerprint)
+
+
+def _write_capture(
+    capture_dir: str,
+    image_bytes: bytes,
+    record: Dict[str, Any],
+    gallery: Optional[Gallery]
+) -> None:
+    try:
+        path = os.path.join(capture_dir, record['capture_id'])
+        os.makedirs(path, exist_ok=True)
+        with open(os.path.join(path, "image.bin"), "wb") as f:
+            f.write(image_bytes)
+        with open(os.path.join(path, "capture.json"), "w") as f:
+            json.dump(record, f, indent=2, default=str)
+        if gallery is not None:
+            _save_gallery(capture_dir, gallery)
+    except Exception as e:
+        logger.error(f"Error writing capture {record['capture_id']}: {str(e)}")
+
+
+def capture_request(
+    endpoint: str,
+    image_bytes: bytes,
+    params: Dict[str, Any],
+    faces: List[Dict[str, Any]],
+    stages: Dict[str, float],
+    total_seconds: float,
+    gallery: Optional[Gallery]
+) -> str:
+    """
+    Store a recognition request for later replay, without blocking the caller
+
+    Returns:
+        str: Capture ID (also the directory name under CAPTURE_DIR)
+    """
+    capture_id = f"{datetime.now().strftime('%Y%m%dT%H%M%S')}_{uuid.uuid4().hex[:8]}"
+    record = {
+        'capture_id': capture_id,
+        'timestamp': datetime.now().isoformat(),
+        'endpoint': endpoint,
+        'params': params,
+        'image_sha1': hashlib.sha1(image_bytes).hexdigest(),
+        'image_bytes': len(image_bytes),
+        'gallery_version': gallery.version if gallery is not None else None,
+        'gallery_fingerprint': gallery.fingerprint() if gallery is not None else None,
+        'stages': stages,
+        'total_seconds': total_seconds,
+        'faces': faces
+    }
+    _writer.submit(_write_capture, CAPTURE_DIR, image_bytes, record, gallery)
+    return capture_id
+
+
+def load_capture_gallery(capture_dir: str, fingerprint: str) -> Optional[Gallery]:
+    """Gallery snapshot stored alongside the captures, None if it was not saved."""
+    path = _gallery_path(capture_dir, fingerprint)
+    if not os.path.exists(path):
+        return None
+    snapshot = np.load(path)
+    return Gallery(
+        snapshot['student_ids'].tolist(),
+        snapshot['names'].tolist(),
+        snapshot['embeddings']
+    )
@@ -0,0 +1,45 @@
+import os
+import logging
+
+import psycopg2
+from psycopg2 import extras
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# "local" swaps PostgreSQL for the SQLite stand-in of local_db.py
+DB_BACKEND = os.getenv("DB_BACKEND", "postgres")
+
+
+def get_db_connection():
+    """
+    Open a new connection to the PostgreSQL database configured in .env
+
+    Returns:
+        psycopg2 connection (or local_db.LocalConnection when DB_BACKEND=local)
+    """
+    if DB_BACKEND == "local":
+        import local_db
+        return local_db.connect()
+    try:
+        conn = psycopg2.connect(
+            host=os.getenv("DB_HOST"),
+            user=os.getenv("DB_USER"),
+            password=os.getenv("DB_PASSWORD"),
+            dbname=os.getenv("DB_NAME"),
+            port=os.getenv("DB_PORT")
+        )
+        return conn
+    except Exception as e:
+        logger.error(f"Database connection error: {str(e)}")
+        raise
+
+
+def execute_values(cursor, query: str, rows, page_size: int = 100) -> None:
+    """psycopg2.extras.execute_values that also works on the local stand-in."""
+    if hasattr(cursor, "execute_values"):
+        cursor.execute_values(query, rows, page_size=page_size)
+    else:
+        extras.execute_values(cursor, query, rows, page_size=page_size)
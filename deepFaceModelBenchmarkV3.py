@@ -7,7 +7,9 @@ import time
 from mpl_toolkits.mplot3d import Axes3D
 from typing import Dict, List
 from datetime import datetime
-from face_lookalike import detect_faces
+import concurrent.futures
+import multiprocessing
+from benchmark_store import BenchmarkStore, source_version
 import face_recognition
 import cv2
 
@@ -34,72 +36,125 @@ NON_MATTEO_IMAGES = [
 ]
 
 
-def get_face_recognition_embedding(image_path: str) -> tuple[List[np.ndarray], float, Dict]:
-    """Get face embedding using face_recognition library."""
-    try:
-        start_time = time.time()
-        
-        # Detect faces using YOLOv8
-        image = cv2.imread(image_path)
-        image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
-        print(1)
-        face_locations = detect_faces(image)
-        print(2)
-        
-        if not face_locations:
-            raise ValueError("No face detected")
-        
-        # Generate encodings
-        face_encodings = face_recognition.face_encodings(image, face_locations, num_jitters=2, model="large")
-        elapsed_time = time.time() - start_time
-        
-        if not face_encodings:
-            raise ValueError("Could not generate encodings for detected faces")
-        
-        return face_encodings, elapsed_time, {
-            "faces_detected": len(face_encodings),
-            "time_per_face": elapsed_time / len(face_encodings)
-        }
-        
-    except Exception as e:
-        print(f"Error processing image with face_recognition: {str(e)}")
-        return [], 0.0, {"faces_detected": 0, "time_per_face": 0.0}
+REFERENCE_IMAGE = "imgTest/matteoOG.jpg"
+DETECTOR_BACKEND = "retinaface"
 
-def get_embedding(image_path: str, model_name: str) -> tuple[List[np.ndarray], float, Dict]:
-    """Get face embedding for a single image."""
-    if model_name == "face_recognition":
-        return get_face_recognition_embedding(image_path)
-    
+
+def benchmark_images() -> List[tuple[str, str]]:
+    """(image_type, image_path) of every image used by the benchmark."""
+    images = [("reference", REFERENCE_IMAGE)]
+    for i in range(1, 12):
+        test_path = f"imgTest/matteo{i}.jpg"
+        if not os.path.exists(test_path):
+            print(f"Warning: {test_path} not found")
+            continue
+        images.append(("test_matteo", test_path))
+    images.extend(("non_matteo", path) for path in NON_MATTEO_IMAGES)
+    return images
+
+
+def detect_and_align(image_path: str) -> tuple[List[np.ndarray], float]:
+    """
+    Detect and align every face of an image once, shared by all models.
+
+    Returns:
+        tuple: (aligned BGR uint8 crops, detection time in seconds)
+    """
     try:
         start_time = time.time()
-        embedding_objs = DeepFace.represent(
+        faces = DeepFace.extract_faces(
             img_path=image_path,
-            model_name=model_name,
-            detector_backend="retinaface",
+            detector_backend=DETECTOR_BACKEND,
             enforce_detection=True,
             align=True
         )
         elapsed_time = time.time() - start_time
-        
-        if not embedding_objs:
-            raise ValueError("No face detected")
-            
-        return [np.array(obj["embedding"]) for obj in embedding_objs], elapsed_time, {
-            "faces_detected": len(embedding_objs),
-            "time_per_face": elapsed_time / len(embedding_objs)
+        crops = [(face["face"][:, :, ::-1] * 255).clip(0, 255).astype(np.uint8) for face in faces]
+        return crops, elapsed_time
+    except Exception as e:
+        print(f"Error detecting faces in {image_path}: {str(e)}")
+        return [], 0.0
+
+
+def get_face_recognition_embedding(crops: List[np.ndarray]) -> List[np.ndarray]:
+    """Get face embeddings of pre-aligned crops using the face_recognition library."""
+    encodings = []
+    for crop in crops:
+        rgb_crop = cv2.cvtColor(crop, cv2.COLOR_BGR2RGB)
+        height, width, _ = rgb_crop.shape
+        # The whole crop is the face, in (top, right, bottom, left) order
+        encodings.extend(face_recognition.face_encodings(rgb_crop, [(0, width, height, 0)], num_jitters=2, model="large"))
+    return encodings
+
+
+def get_embedding(crops: List[np.ndarray], model_name: str) -> tuple[List[np.ndarray], float, Dict]:
+    """Get the embeddings of the pre-aligned face crops of one image."""
+    if not crops:
+        return [], 0.0, {"faces_detected": 0, "time_per_face": 0.0}
+    try:
+        start_time = time.time()
+        if model_name == "face_recognition":
+            embeddings = get_face_recognition_embedding(crops)
+        else:
+            embeddings = [
+                np.array(DeepFace.represent(
+                    img_path=crop,
+                    model_name=model_name,
+                    detector_backend="skip",
+                    enforce_detection=False,
+                    align=False
+                )[0]["embedding"])
+                for crop in crops
+            ]
+        elapsed_time = time.time() - start_time
+
+        if not embeddings:
+            raise ValueError("No face embedded")
+
+        return embeddings, elapsed_time, {
+            "faces_detected": len(embeddings),
+            "time_per_face": elapsed_time / len(embeddings)
         }
-        
+
     except Exception as e:
-        print(f"Error getting embedding for {image_path} with model {model_name}: {str(e)}")
+        print(f"Error getting embedding with model {model_name}: {str(e)}")
         return [], 0.0, {"faces_detected": 0, "time_per_face": 0.0}
 
+
+def embed_all_images(model_name: str, crops_by_image: Dict[str, List[np.ndarray]]) -> Dict[str, tuple]:
+    """Process pool task: embed the crops of every image with one model."""
+    print(f"\n=== Evaluating {model_name} ===")
+    # The first call loads the model weights, keep it out of the timings
+    first_crops = next((crops for crops in crops_by_image.values() if crops), None)
+    if first_crops:
+        get_embedding(first_crops[:1], model_name)
+    return {image_path: get_embedding(crops, model_name) for image_path, crops in crops_by_image.items()}
+
+
 def calculate_similarity(emb1: np.ndarray, emb2: np.ndarray) -> float:
     """Calculate cosine similarity between two embeddings."""
     return np.dot(emb1, emb2) / (np.linalg.norm(emb1) * np.linalg.norm(emb2))
 
-def evaluate_models() -> tuple[Dict[str, Dict[str, List]], List[Dict]]:
-    """Evaluate all models and return their metrics."""
-    original_path = "imgTest/matteoOG.jpg"
+def benchmark_row(model: str, image_type: str, image_path: str, similarity: float, embedding_length: int,
+                  time_taken: float, detection_time: float, metrics: Dict, code_version: str) -> Dict:
+    return {
+        "timestamp": datetime.now().isoformat(),
+        "model": model,
+        "detector": DETECTOR_BACKEND,
+        "image_type": image_type,
+        "image_path": image_path,
+        "code_version": code_version,
+        "similarity_score": similarity,
+        "computation_time": time_taken,
+        "detection_time": detection_time,
+        "embedding_length": embedding_length,
+        "faces_detected": metrics["faces_detected"],
+        "time_per_face": metrics["time_per_face"]
+    }
+
+
+def results_from_rows(benchmark_results: List[Dict]) -> Dict[str, Dict[str, List]]:
+    """Per-model metric lists used by the plots, rebuilt from stored rows."""
     results = {model: {
         "scores": [], 
         "times": [], 
@@ -108,103 +163,103 @@ def evaluate_models() -> tuple[Dict[str, Dict[str, List]], List[Dict]]:
         "faces_detected": [],
         "time_per_face": []
     } for model in MODELS}
-    
-    # List to store all results for CSV
-    benchmark_results = []
-    
-    for model in MODELS:
-        print(f"\n=== Evaluating {model} ===")
-        try:
-            # Get embeddings for reference image
-                
+    image_order = {path: i for i, (_, path) in enumerate(benchmark_images())}
+    for row in sorted(benchmark_results, key=lambda row: image_order.get(row["image_path"], len(image_order))):
+        if row["model"] not in results:
+            continue
+        model_results = results[row["model"]]
+        if row["image_type"] == "test_matteo":
+            model_results["scores"].append(row["similarity_score"])
+            model_results["times"].append(row["computation_time"])
+            model_results["embedding_lengths"].append(row["embedding_length"])
+            model_results["faces_detected"].append(row["faces_detected"])
+            model_results["time_per_face"].append(row["time_per_face"])
+        elif row["image_type"] == "non_matteo":
+            model_results["misidentification_scores"].append(row["similarity_score"])
+    return results
+
+
+def evaluate_models(workers: int = 4, store: BenchmarkStore = None) -> tuple[Dict[str, Dict[str, List]], List[Dict]]:
+    """
+    Evaluate all models and return their metrics.
+
+    Every image is detected and aligned once, then each model embeds the
+    cached crops in its own worker process. computation_time is the embedding
+    time of the model only, detection_time the shared detection time.
+
+    Rows are appended to the store as soon as a model finishes; (model, image)
+    pairs already stored for the current code version are not recomputed.
+    """
+    store = store or BenchmarkStore()
+    code_version = source_version(__file__)
+    completed = store.completed_keys(code_version)
+
+    images = benchmark_images()
+    pending = {
+        model: [(image_type, path) for image_type, path in images if (model, DETECTOR_BACKEND, path) not in completed]
+        for model in MODELS
+    }
+    pending = {model: model_images for model, model_images in pending.items() if model_images}
+    skipped = len(MODELS) * len(images) - sum(len(model_images) for model_images in pending.values())
+    print(f"{skipped} (model, image) pairs already computed for code version {code_version}")
+
+    # The reference embedding is needed to score any pending image
+    needed_paths = {REFERENCE_IMAGE} | {path for model_images in pending.values() for _, path in model_images}
+    if pending:
+        print(f"Detecting faces in {len(needed_paths)} images with {DETECTOR_BACKEND}...")
+    crops_by_image, detection_times = {}, {}
+    for _, image_path in images:
+        if image_path in needed_paths:
+            crops_by_image[image_path], detection_times[image_path] = detect_and_align(image_path)
 
-            original_embeddings, time_taken, metrics = get_embedding(original_path, model)
+    # Detection has initialised TensorFlow in this process, which does not survive a fork:
+    # workers are spawned fresh and re-import the module instead
+    with concurrent.futures.ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=multiprocessing.get_context("spawn")
+    ) as executor:
+        futures = {}
+        for model, model_images in pending.items():
+            model_paths = {REFERENCE_IMAGE} | {path for _, path in model_images}
+            model_crops = {path: crops_by_image[path] for path in model_paths}
+            futures[executor.submit(embed_all_images, model, model_crops)] = model
+
+        for future in concurrent.futures.as_completed(futures):
+            model = futures[future]
+            try:
+                model_embeddings = future.result()
+            except Exception as e:
+                print(f"Error processing model {model}: {str(e)}")
+                continue
+
+            original_embeddings, _, _ = model_embeddings[REFERENCE_IMAGE]
             if not original_embeddings:
                 print(f"Skipping {model} - couldn't get original embedding")
                 continue
-            
             original_embedding = original_embeddings[0]
             embedding_length = len(original_embedding)
-            
-            # Store reference image metrics
-            benchmark_results.append({
-                "timestamp": datetime.now().isoformat(),
-                "model": model,
-                "image_type": "reference",
-                "image_path": original_path,
-                "similarity_score": 1.0,  # Self-similarity
-                "computation_time": time_taken,
-                "embedding_length": embedding_length,
-                "faces_detected": metrics["faces_detected"],
-                "time_per_face": metrics["time_per_face"]
-            })
-            
-            # Process Matteo test images
-            for i in range(1, 12):
-                test_path = f"imgTest/matteo{i}.jpg"
-                if not os.path.exists(test_path):
-                    print(f"Warning: {test_path} not found")
-                    continue
-                
-                test_embeddings, time_taken, metrics = get_embedding(test_path, model)
-                
-                if not test_embeddings:
-                    print(f"No faces found in {test_path}")
-                    similarity = 0.0
-                else:
-                    similarities = [calculate_similarity(original_embedding, test_emb) for test_emb in test_embeddings]
-                    similarity = max(similarities)
-                
-                results[model]["scores"].append(similarity)
-                results[model]["times"].append(time_taken)
-                results[model]["embedding_lengths"].append(embedding_length)
-                results[model]["faces_detected"].append(metrics["faces_detected"])
-                results[model]["time_per_face"].append(metrics["time_per_face"])
-                
-                benchmark_results.append({
-                    "timestamp": datetime.now().isoformat(),
-                    "model": model,
-                    "image_type": "test_matteo",
-                    "image_path": test_path,
-                    "similarity_score": similarity,
-                    "computation_time": time_taken,
-                    "embedding_length": embedding_length,
-                    "faces_detected": metrics["faces_detected"],
-                    "time_per_face": metrics["time_per_face"]
-                })
-                
-                print(f"Image {i}: Similarity = {similarity:.3f}, Time = {time_taken:.3f}s")
-            
-            # Process non-Matteo images
-            for non_matteo in NON_MATTEO_IMAGES:
-                test_embeddings, time_taken, metrics = get_embedding(non_matteo, model)
-                
-                if not test_embeddings:
+
+            for image_type, image_path in pending[model]:
+                test_embeddings, time_taken, metrics = model_embeddings[image_path]
+                if image_type == "reference":
+                    similarity = 1.0  # Self-similarity
+                elif not test_embeddings:
+                    print(f"No faces found in {image_path}")
                     similarity = 0.0
                 else:
-                    similarities = [calculate_similarity(original_embedding, test_emb) for test_emb in test_embeddings]
-                    similarity = max(similarities)
-                
-                results[model]["misidentification_scores"].append(similarity)
-                
-                benchmark_results.append({
-                    "timestamp": datetime.now().isoformat(),
-                    "model": model,
-                    "image_type": "non_matteo",
-                    "image_path": non_matteo,
-                    "similarity_score": similarity,
-                    "computation_time": time_taken,
-                    "embedding_length": embedding_length,
-                    "faces_detected": metrics["faces_detected"],
-                    "time_per_face": metrics["time_per_face"]
-                })
-                
-                print(f"Non-Matteo Image {non_matteo}: Similarity = {similarity:.3f}")
-                
-        except Exception as e:
-            print(f"Error processing model {model}: {str(e)}")
-    
-    return results, benchmark_results
+                    similarity = max(calculate_similarity(original_embedding, test_emb) for test_emb in test_embeddings)
+
+                store.append(benchmark_row(
+                    model, image_type, image_path, float(similarity), embedding_length,
+                    time_taken, detection_times[image_path], metrics, code_version
+                ))
+                print(f"{model} - {image_path}: Similarity = {similarity:.3f}, Embedding time = {time_taken:.3f}s")
+
+    benchmark_results = [
+        row for row in store.read(code_version=code_version)
+        if row["detector"] == DETECTOR_BACKEND
+    ]
+    return results_from_rows(benchmark_results), benchmark_results
 
 def plot_additional_results(results: Dict[str, Dict[str, List]]):
     """Plot misidentification rates."""
@@ -223,27 +278,31 @@ def plot_additional_results(results: Dict[str, Dict[str, List]]):
     plt.close()
 
 def save_benchmark_results(benchmark_results: List[Dict]):
-    """Save comprehensive benchmark results to CSV."""
+    """Save summary statistics of the benchmark results to CSV, detailed rows are already in the store."""
     df = pd.DataFrame(benchmark_results)
     
     # Calculate and add summary statistics
     summary_stats = df.groupby('model').agg({
         'computation_time': ['mean', 'std', 'min', 'max'],
         'time_per_face': ['mean', 'std', 'min', 'max'],
+        'detection_time': ['mean', 'sum'],
         'similarity_score': ['mean', 'std', 'min', 'max'],
         'embedding_length': 'first',
         'faces_detected': ['sum', 'mean']
     }).round(4)
     
-    # Save detailed results
-    df.to_csv('face_recognition_benchmark_detailed.csv', index=False)
-    
     # Save summary statistics
     summary_stats.to_csv('face_recognition_benchmark_summary.csv')
 
 if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Benchmark face recognition models")
+    parser.add_argument("--workers", type=int, default=min(4, os.cpu_count() or 1),
+                        help="Worker processes embedding models in parallel")
+    args = parser.parse_args()
+
     print("Starting model evaluation...")
-    results, benchmark_results = evaluate_models()
+    results, benchmark_results = evaluate_models(args.workers)
     
     print("\nGenerating plots and saving results...")
     plot_additional_results(results)
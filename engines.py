@@ -0,0 +1,226 @@
+"""
+Recognition engines, imported on first use.
+
+Each engine is a module exposing recognize_image(image, gallery=None,
+fallback_gallery=None, scale=1.0, **options) that returns the results
+keyed by name: {'bounding_box': (top, right, bottom, left), 'name',
+'confidence'} per face, strangers named 'stranger_N'. Only the engines of STUDENT_ID_ENGINES match
+against the galleries they are given and add 'student_id'; course attendance
+and sighting reports need one of them (see require_student_ids).
+It also exposes detect_image(image, **detection options) that only runs
+the detector and returns [{'bounding_box', 'confidence'}].
+Importing this module loads neither TensorFlow nor dlib/torch: a process
+only pays for the engine it actually serves, chosen with RECOGNITION_ENGINE.
+
+Speed profiles map to the options of each engine and to the resolution the
+image is downscaled to before detection. RECOGNITION_PROFILE sets the
+default of a deployment, requests can override it.
+"""
+import os
+import time
+import logging
+import importlib
+import threading
+from types import ModuleType
+from typing import Any, Dict, List, Optional, Tuple
+
+import cv2
+
+from roi import crop_to_roi, inside_roi
+
+logger = logging.getLogger(__name__)
+
+RECOGNITION_ENGINE = os.getenv("RECOGNITION_ENGINE", "deepface")
+
+# Engine name -> module implementing recognize_image
+ENGINES: Dict[str, str] = {
+    "deepface": "face_lookalike_deepface",
+    "dlib": "face_lookalike",
+}
+
+RECOGNITION_PROFILE = os.getenv("RECOGNITION_PROFILE", "accurate")
+
+# Profile -> engine -> options. max_side is the longest side the image is
+# downscaled to before detection, None keeps the full resolution. The
+# deepface model is not part of the profiles: the gallery only holds
+# Facenet512 embeddings. The cascade embeds with a cheap model first and
+# only falls back to Facenet512 for ambiguous faces.
+PROFILES: Dict[str, Dict[str, Dict[str, Any]]] = {
+    "fast": {
+        "deepface": {"detector_backend": "opencv", "cascade": True, "max_side": 640},
+        "dlib": {"num_jitters": 1, "model": "small", "max_side": 640},
+    },
+    "balanced": {
+        "deepface": {"detector_backend": "retinaface", "cascade": True, "max_side": 1280},
+        "dlib": {"num_jitters": 1, "model": "large", "max_side": 1280},
+    },
+    "accurate": {
+        "deepface": {"detector_backend": "retinaface", "cascade": False, "max_side": None},
+        "dlib": {"num_jitters": 2, "model": "large", "max_side": None},
+    },
+}
+
+# Options of a profile that detect_image takes, the others only concern embedding
+DETECTION_OPTIONS: Dict[str, Tuple[str, ...]] = {
+    "deepface": ("detector_backend",),
+    "dlib": (),
+}
+
+# Engines that match against the gallery they are passed and return student_id.
+# The dlib engine matches 128-d encodings from its own CSV, keyed by name only.
+STUDENT_ID_ENGINES: Tuple[str, ...] = ("deepface",)
+
+_loaded: Dict[str, ModuleType] = {}
+_lock = threading.Lock()
+
+
+def get_engine(name: Optional[str] = None) -> ModuleType:
+    """
+    Engine module, imported the first time it is asked for
+
+    Raises:
+        ValueError: If the engine is unknown
+    """
+    name = name or RECOGNITION_ENGINE
+    if name not in ENGINES:
+        raise ValueError(f"Unknown recognition engine: {name}")
+    engine = _loaded.get(name)
+    if engine is None:
+        with _lock:
+            if name not in _loaded:
+                start = time.perf_counter()
+                _loaded[name] = importlib.import_module(ENGINES[name])
+                logger.info(f"Loaded recognition engine '{name}' in {time.perf_counter() - start:.2f}s")
+            engine = _loaded[name]
+    return engine
+
+
+def require_student_ids(engine: Optional[str] = None) -> None:
+    """
+    Check that an engine identifies students, for course-scoped recognition
+
+    Raises:
+        ValueError: If its results carry no student_id
+    """
+    engine = engine or RECOGNITION_ENGINE
+    if engine not in STUDENT_ID_ENGINES:
+        raise ValueError(
+            f"The '{engine}' engine does not identify students, course attendance needs "
+            f"RECOGNITION_ENGINE set to one of: {', '.join(STUDENT_ID_ENGINES)}"
+        )
+
+
+def profile_options(engine: Optional[str] = None, profile: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Options of a speed profile for an engine, defaults to the deployment's
+
+    Raises:
+        ValueError: If the profile is unknown
+    """
+    profile = profile or RECOGNITION_PROFILE
+    if profile not in PROFILES:
+        raise ValueError(f"Unknown recognition profile: {profile}")
+    return dict(PROFILES[profile][engine or RECOGNITION_ENGINE])
+
+
+def downscale(image: Any, max_side: Optional[int]) -> Tuple[Any, float]:
+    """
+    Shrink a BGR image so its longest side is at most max_side
+
+    Returns:
+        tuple: (image, scale factor applied, 1.0 if unchanged)
+    """
+    height, width = image.shape[:2]
+    if not max_side or max(height, width) <= max_side:
+        return image, 1.0
+    scale = max_side / max(height, width)
+    return cv2.resize(image, (round(width * scale), round(height * scale)), interpolation=cv2.INTER_AREA), scale
+
+
+def _prepare(image: Any, roi: Optional[List[List[List[float]]]], max_side: Optional[int]) -> Tuple[Any, float, Tuple[int, int], Any]:
+    """Crop a frame to its ROI mask, then downscale it: (image, scale, offset, pixel polygons)"""
+    offset, pixel_polygons = (0, 0), None
+    if roi:
+        image, offset, pixel_polygons = crop_to_roi(image, roi)
+    # max_side applies to the crop, a small seating area keeps its resolution
+    image, scale = downscale(image, max_side)
+    return image, scale, offset, pixel_polygons
+
+
+def _to_frame(faces: List[Dict[str, Any]], scale: float, offset: Tuple[int, int]) -> None:
+    """Move the bounding boxes of faces found in a prepared image back to the coordinates of the frame"""
+    offset_x, offset_y = offset
+    if scale == 1.0 and not offset_x and not offset_y:
+        return
+    for face in faces:
+        top, right, bottom, left = (int(round(value / scale)) for value in face['bounding_box'])
+        face['bounding_box'] = (top + offset_y, right + offset_x, bottom + offset_y, left + offset_x)
+
+
+def recognize(
+    image: Any,
+    engine: Optional[str] = None,
+    profile: Optional[str] = None,
+    skipped: Optional[List[Dict[str, Any]]] = None,
+    roi: Optional[List[List[List[float]]]] = None,
+    **kwargs: Any
+) -> Dict[str, Any]:
+    """
+    Recognize the faces of a BGR image with the configured (or the given)
+    engine and speed profile. Bounding boxes are in the coordinates of the
+    original image, whatever resolution the profile detects at.
+
+    Args:
+        skipped (list): Receives the faces dropped by the engine's quality filter
+        roi (list): Mask of relative polygons (see roi.py), only the faces
+            centered inside it are returned
+    """
+    engine = engine or RECOGNITION_ENGINE
+    options = profile_options(engine, profile)
+    image, scale, offset, pixel_polygons = _prepare(image, roi, options.pop("max_side", None))
+    engine_skipped: List[Dict[str, Any]] = []
+    # The scale lets the quality filter judge face sizes in pixels of the original frame
+    results = get_engine(engine).recognize_image(image, skipped=engine_skipped, scale=scale, **options, **kwargs)
+    _to_frame(list(results.values()) + engine_skipped, scale, offset)
+    if pixel_polygons is not None:
+        results = {
+            name: face for name, face in results.items()
+            if inside_roi(face['bounding_box'], pixel_polygons)
+        }
+        engine_skipped = [face for face in engine_skipped if inside_roi(face['bounding_box'], pixel_polygons)]
+    if skipped is not None:
+        skipped.extend(engine_skipped)
+    return results
+
+
+def detect(
+    image: Any,
+    engine: Optional[str] = None,
+    profile: Optional[str] = None,
+    max_side: Optional[int] = None,
+    roi: Optional[List[List[List[float]]]] = None
+) -> List[Dict[str, Any]]:
+    """
+    Detect the faces of a BGR image without embedding them, with the
+    detector of the engine and profile.
+
+    Args:
+        max_side (int): Detect at this resolution instead of the profile's,
+            a headcount rarely needs the full frame
+
+    Returns:
+        list: [{'bounding_box': (top, right, bottom, left), 'confidence'}] in frame coordinates
+    """
+    engine = engine or RECOGNITION_ENGINE
+    options = profile_options(engine, profile)
+    max_side = max_side or options.get("max_side")
+    image, scale, offset, pixel_polygons = _prepare(image, roi, max_side)
+    faces = get_engine(engine).detect_image(image, **{name: options[name] for name in DETECTION_OPTIONS[engine]})
+    _to_frame(faces, scale, offset)
+    if pixel_polygons is not None:
+        faces = [face for face in faces if inside_roi(face['bounding_box'], pixel_polygons)]
+    return faces
+
+
+def loaded_engines() -> List[str]:
+    return sorted(_loaded)
@@ -0,0 +1,112 @@
+import os
+import time
+import uuid
+import logging
+import threading
+import concurrent.futures
+from typing import Dict, Any, Optional
+
+from engines import get_engine
+from gallery import invalidate_gallery
+from response_cache import bump_version
+
+logger = logging.getLogger(__name__)
+
+ENROLLMENT_WORKERS = int(os.getenv("ENROLLMENT_WORKERS", "2"))
+# Finished jobs are kept this long so clients can still poll their status
+ENROLLMENT_RETENTION_SECONDS = int(os.getenv("ENROLLMENT_RETENTION_SECONDS", "3600"))
+
+PENDING = "pending"
+PROCESSING = "processing"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+
+_executor = concurrent.futures.ThreadPoolExecutor(
+    max_workers=ENROLLMENT_WORKERS,
+    thread_name_prefix="enrollment"
+)
+_jobs: Dict[str, Dict[str, Any]] = {}
+_jobs_lock = threading.Lock()
+
+
+def _prune_finished_jobs() -> None:
+    cutoff = time.time() - ENROLLMENT_RETENTION_SECONDS
+    with _jobs_lock:
+        for enrollment_id in [
+            job_id for job_id, job in _jobs.items()
+            if job['finished_at'] is not None and job['finished_at'] < cutoff
+        ]:
+            del _jobs[enrollment_id]
+
+
+def is_enrollment_in_progress(name: str) -> bool:
+    """Check whether a face for this name is already queued or being processed."""
+    with _jobs_lock:
+        return any(
+            job['name'] == name and job['status'] in (PENDING, PROCESSING)
+            for job in _jobs.values()
+        )
+
+
+def submit_enrollment(image_path: str, name: str) -> str:
+    """
+    Queue a face enrollment on the background worker pool
+
+    Args:
+        image_path (str): Path to the uploaded image, deleted once processed
+        name (str): Name of the student to enroll
+
+    Returns:
+        str: Enrollment ID used to poll the job status
+    """
+    _prune_finished_jobs()
+    enrollment_id = uuid.uuid4().hex
+    with _jobs_lock:
+        _jobs[enrollment_id] = {
+            'enrollment_id': enrollment_id,
+            'name': name,
+            'status': PENDING,
+            'error': None,
+            'submitted_at': time.time(),
+            'finished_at': None
+        }
+    _executor.submit(_run_enrollment, enrollment_id, image_path, name)
+    return enrollment_id
+
+
+def get_enrollment(enrollment_id: str) -> Optional[Dict[str, Any]]:
+    """Return a copy of the enrollment job status, or None if unknown."""
+    with _jobs_lock:
+        job = _jobs.get(enrollment_id)
+        return dict(job) if job else None
+
+
+def _update_job(enrollment_id: str, **fields) -> None:
+    with _jobs_lock:
+        _jobs[enrollment_id].update(fields)
+
+
+def _run_enrollment(enrollment_id: str, image_path: str, name: str) -> None:
+    _update_job(enrollment_id, status=PROCESSING)
+    try:
+        # Enrollment always fills the Facenet512 gallery of the database,
+        # whichever engine serves recognition
+        success = get_engine("deepface").add_face_to_db(image_path, name)
+        if success:
+            invalidate_gallery()
+            bump_version("students")
+            _update_job(enrollment_id, status=SUCCEEDED, finished_at=time.time())
+            logger.info(f"Enrollment {enrollment_id} for '{name}' succeeded")
+        else:
+            _update_job(
+                enrollment_id,
+                status=FAILED,
+                error="Failed to add face to database.",
+                finished_at=time.time()
+            )
+    except Exception as e:
+        logger.error(f"Enrollment {enrollment_id} for '{name}' failed: {str(e)}")
+        _update_job(enrollment_id, status=FAILED, error=str(e), finished_at=time.time())
+    finally:
+        if os.path.exists(image_path):
+            os.unlink(image_path)
@@ -6,7 +6,15 @@ import pandas as pd
 from huggingface_hub import hf_hub_download
 from ultralytics import YOLO
 from supervision import Detections
+import logging
+from functools import lru_cache
 
+from metrics import stage_timer
+
+logger = logging.getLogger(__name__)
+
+# The dlib engine matches against its own CSV of 128-d encodings
+DLIB_DATABASE_PATH = os.getenv("DLIB_DATABASE_PATH", "facesEncoding.csv")
 
 
 def process_image(known_image_path, test_image_path, known_face_name="Matteo"):
@@ -73,13 +81,19 @@ def process_image(known_image_path, test_image_path, known_face_name="Matteo"):
     cv2.waitKey(0)
     cv2.destroyAllWindows()
 
+@lru_cache(maxsize=1)
+def load_face_model():
+    """YOLOv8 face detector, downloaded and loaded once per process"""
+    model_path = hf_hub_download(repo_id="arnabdhar/YOLOv8-Face-Detection", filename="model.pt")
+    return YOLO(model_path)
+
+
 def detect_faces(image, window_size=(500,500), step_size=250):
     """
     Detect faces in an image using YOLOv8 and convert coordinates to face_recognition format
     Returns coordinates in (top, right, bottom, left) format as required by face_recognition
     """
-    model_path = hf_hub_download(repo_id="arnabdhar/YOLOv8-Face-Detection", filename="model.pt")
-    face_model = YOLO(model_path)
+    face_model = load_face_model()
     height, width, _ = image.shape
     detections = []
 
@@ -95,7 +109,7 @@ def detect_faces(image, window_size=(500,500), step_size=250):
         left = int(x_min)
         detections.append((top, right, bottom, left))
 
-    print(f"Detected {len(detections)} faces with coordinates: {detections}", flush=True)
+    logger.debug("Detected %d faces with coordinates: %s", len(detections), detections)
     return detections
 
 
@@ -192,78 +206,75 @@ def load_known_faces(database_path="facesEncoding.csv"):
 
     
 
-def recognize_facesAPI(image_path, database_path="facesEncoding.csv", tolerance=0.62):
+def recognize_facesAPI(image_path, database_path="facesEncoding.csv", tolerance=0.62, num_jitters=2, model="large"):
     """
     Process an image and identify all faces by comparing them with the database
     
     Args:
-        image_path (str): Path to the image to analyze
+        image_path (str or np.ndarray): Path to the image to analyze, or the decoded BGR image
         database_path (str): Path to the CSV database file
         tolerance (float): Face recognition tolerance (lower = more strict)
+        num_jitters (int): Times each face is resampled when encoding (higher = slower, more stable)
+        model (str): dlib landmark model, "large" (68 points) or "small" (5 points)
     
     Returns:
-        dict: Dictionary with bounding box, name, and confidence for each recognized face
+        dict: Dictionary with bounding box, name (or 'stranger_N'), and confidence for each face
     """
     results = {}  # Initialize results dictionary
-    print("\n=== Starting Face Recognition ===", flush=True)
+    logger.debug("Starting face recognition")
     
     try:
         # Load known faces
-        print(f"📚 Loading known faces from {database_path}...", flush=True)
-        known_encodings, known_names = load_known_faces(database_path)
-        print(f"✅ Loaded {len(known_names)} known faces: {known_names}", flush=True)
+        with stage_timer("gallery_load"):
+            known_encodings, known_names = load_known_faces(database_path)
+        logger.debug("Loaded %d known faces from %s", len(known_names), database_path)
           
         if not known_encodings:
-            print("❌ No known faces found in database", flush=True)
+            logger.info("No known faces found in database")
             return results
 
 
-        image = cv2.imread(image_path)
-        image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
-        # Note: image should already be in RGB format from the API endpoint
-        print("🔍 Detecting faces in image...", flush=True)
-        face_locations = detect_faces(image)
-        print(f"✅ Number of detected faces: {len(face_locations)}", flush=True)
-
-
-
-        print(f"🔍 Original image shape: {image.shape}, dtype: {image.dtype}", flush=True)
+        with stage_timer("decode"):
+            image = cv2.imread(image_path) if isinstance(image_path, str) else image_path
+            image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+        with stage_timer("detection"):
+            face_locations = detect_faces(image)
+        logger.debug("Number of detected faces: %d, image shape: %s", len(face_locations), image.shape)
 
 
         # Get encodings for all detected faces
-        print("🧬 Generating face encodings...", flush=True)
-        face_encodings = face_recognition.face_encodings(image, face_locations, num_jitters=2, model="large")
-        print(f"✅ Generated encodings for {len(face_encodings)} faces", flush=True)
+        with stage_timer("embedding"):
+            face_encodings = face_recognition.face_encodings(image, face_locations, num_jitters=num_jitters, model=model)
         
         confidence_dict = {}
+        strangers = []
         # Process each detected face
-        print("🔄 Comparing faces with known faces...", flush=True)
-        for i, ((top, right, bottom, left), face_encoding) in enumerate(zip(face_locations, face_encodings)):
-            print(f"\n👤 Processing face {i+1}:", flush=True)
-            # Compare with all known faces
-            matches = face_recognition.compare_faces(known_encodings, face_encoding, tolerance=tolerance)
-            print(f"  - Match results: {matches}", flush=True)
-            
-            # Calculate face distances for each known face
-            face_distances = face_recognition.face_distance(known_encodings, face_encoding)
-            print(f"  - Face distances: {face_distances}", flush=True)
-            
-            # If there's a match, use the closest one
-            if True in matches:
-                best_match_index = np.argmin(face_distances)
-                if matches[best_match_index]:
-                    confidence = 1 - face_distances[best_match_index]
-                    matched_name = known_names[best_match_index]
-                    print(f"  ✅ Matched with {matched_name} (confidence: {confidence:.2%})", flush=True)
-                    
-                    # Store the highest confidence for each name
-                    if matched_name not in confidence_dict or confidence > confidence_dict[matched_name][0]:
-                        confidence_dict[matched_name] = (confidence, (top, right, bottom, left))
-            else:
-                print("  ❌ No match found", flush=True)
+        with stage_timer("matching"):
+            for i, ((top, right, bottom, left), face_encoding) in enumerate(zip(face_locations, face_encodings)):
+                # Compare with all known faces
+                matches = face_recognition.compare_faces(known_encodings, face_encoding, tolerance=tolerance)
+
+                # Calculate face distances for each known face
+                face_distances = face_recognition.face_distance(known_encodings, face_encoding)
+                if logger.isEnabledFor(logging.DEBUG):
+                    logger.debug("Face %d - match results: %s, distances: %s", i + 1, matches, face_distances)
+
+                # If there's a match, use the closest one
+                if True in matches:
+                    best_match_index = np.argmin(face_distances)
+                    if matches[best_match_index]:
+                        confidence = 1 - face_distances[best_match_index]
+                        matched_name = known_names[best_match_index]
+                        logger.debug("Face %d matched with %s (confidence: %.2f)", i + 1, matched_name, confidence)
+
+                        # Store the highest confidence for each name
+                        if matched_name not in confidence_dict or confidence > confidence_dict[matched_name][0]:
+                            confidence_dict[matched_name] = (confidence, (top, right, bottom, left))
+                else:
+                    strangers.append((1 - float(np.min(face_distances)), (top, right, bottom, left)))
+                    logger.debug("Face %d: no match found", i + 1)
 
         # Create results dictionary with face data
-        print("\n📝 Creating results...", flush=True)
         for name, (confidence, (top, right, bottom, left)) in confidence_dict.items():
             face_data = {
                 'bounding_box': (top, right, bottom, left),
@@ -271,17 +282,45 @@ def recognize_facesAPI(image_path, database_path="facesEncoding.csv", tolerance=
                 'confidence': float(confidence)  # Convert numpy float to Python float
             }
             results[name] = face_data
-            print(f"✅ Added face: {name} with confidence: {confidence:.2%}", flush=True)
+        # Same placeholder names as the deepface engine
+        for i, (confidence, bounding_box) in enumerate(strangers, start=1):
+            results[f"stranger_{i}"] = {
+                'bounding_box': bounding_box,
+                'name': f"stranger_{i}",
+                'confidence': confidence
+            }
 
     except Exception as e:
-        print(f"❌ Error in recognize_facesAPI: {str(e)}", flush=True)
+        logger.error(f"Error in recognize_facesAPI: {str(e)}")
         import traceback
-        print(f"❌ Traceback: {traceback.format_exc()}", flush=True)
+        logger.debug("Traceback: %s", traceback.format_exc())
         return results  # Return empty results dict on error
 
-    print(f"\n✅ Recognition complete. Found {len(results)} faces.", flush=True)
+    logger.debug("Recognition complete. Found %d faces.", len(results))
     return results
 
+
+def recognize_image(image, gallery=None, fallback_gallery=None, num_jitters=2, model="large", skipped=None, scale=1.0):
+    """
+    Entry point of the dlib engine, see engines.py. The galleries hold
+    Facenet512 embeddings and are ignored, faces are matched by name against
+    DLIB_DATABASE_PATH instead, so results carry no student_id and
+    course-scoped callers refuse this engine (engines.require_student_ids).
+    No quality filter: `skipped` stays empty and `scale` is unused.
+    """
+    return recognize_facesAPI(image, database_path=DLIB_DATABASE_PATH, num_jitters=num_jitters, model=model)
+
+
+def detect_image(image):
+    """Entry point of detection-only requests, see engines.detect. YOLOv8 only, no dlib encoding."""
+    with stage_timer("detection"):
+        output = load_face_model()(image)
+    detections = Detections.from_ultralytics(output[0])
+    return [
+        {'bounding_box': (int(y_min), int(x_max), int(y_max), int(x_min)), 'confidence': float(confidence)}
+        for (x_min, y_min, x_max, y_max), confidence in zip(detections.xyxy, detections.confidence)
+    ]
+
 # Usage example
 test_image_path = "imgTest/lilian.jpg"
 
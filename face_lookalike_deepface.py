@@ -2,17 +2,25 @@ from deepface import DeepFace
 import os
 import pandas as pd
 import numpy as np
+import cv2
 
 import psycopg2
-from typing import Dict, Any, Tuple, List
+from typing import Dict, Any, Tuple, List, Optional, Union
 import logging
 from dotenv import load_dotenv
 load_dotenv()
 import json
 import time
-import concurrent.futures
+import traceback
 from psycopg2.extras import RealDictCursor
 
+from db import get_db_connection
+from engines import PROFILES, RECOGNITION_PROFILE
+from gallery import Gallery, get_gallery, save_model_embedding, record_gallery_change, MATCH_THRESHOLD
+from metrics import stage_timer, STAGE_SECONDS, FACES_TOTAL, CASCADE_FACES_TOTAL
+from face_quality import filter_faces, assess_crop, FACE_QUALITY_FILTER
+from face_tracker import FaceTracker, appearance_signature
+
 models = [
   "VGG-Face", 
   "Facenet", 
@@ -26,7 +34,26 @@ models = [
   "GhostFaceNet"
 ]
 MODEL = "Facenet512"
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# Cheap model embedding every face first in cascade mode, see match_cascade_stage_one
+CASCADE_MODEL = os.getenv("CASCADE_MODEL", "SFace")
+# Cosine distance under which a cheap-model match can be accepted (DeepFace's verification thresholds)
+CASCADE_THRESHOLDS = {
+    "SFace": 0.593,
+    "OpenFace": 0.10,
+    "ArcFace": 0.68,
+    "Facenet": 0.40,
+    "GhostFaceNet": 0.65
+}
+# Minimum gap between the best and the runner-up distance for a cheap-model match to be trusted
+CASCADE_MARGIN = float(os.getenv("CASCADE_MARGIN", "0.10"))
+# Models whose embedding is stored next to MODEL's at enrollment, so the cascade knows new
+# students. Defaults to CASCADE_MODEL only when the deployment's profile runs the cascade.
+_CASCADE_PROFILE = PROFILES.get(RECOGNITION_PROFILE, {}).get("deepface", {}).get("cascade", False)
+GALLERY_EXTRA_MODELS = [
+    model for model in os.getenv("GALLERY_EXTRA_MODELS", CASCADE_MODEL if _CASCADE_PROFILE else "").split(",") if model
+]
+logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO").upper(), format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
 def add_known_faces():
@@ -46,20 +73,6 @@ def add_known_faces():
 
     add_face_to_deepface_db("imgTest/remi.jpg", "Rémi")
 
-def get_db_connection():
-    try:
-        conn = psycopg2.connect(
-            host=os.getenv("DB_HOST"),
-            user=os.getenv("DB_USER"),
-            password=os.getenv("DB_PASSWORD"),
-            dbname=os.getenv("DB_NAME"),
-            port=os.getenv("DB_PORT")
-        )
-        return conn
-    except Exception as e:
-        logger.error(f"Database connection error: {str(e)}")
-        raise
-
 def get_face_embedding(
     image_path: str,
     model_name: str = MODEL,
@@ -118,15 +131,10 @@ def add_face_to_db(
             print(f"Error: Image file '{image_path}' not found")
             return False
         
-        # Get face embedding
+        # Detect and align once, every model embeds the same crop
         try:
-            embedding = get_face_embedding(
-                image_path,
-                model_name=model_name,
-                detector_backend=detector_backend
-            )
-            if isinstance(embedding, np.ndarray):
-                embedding = embedding.tolist()  # Convert NumPy array to list for JSON serialization
+            crop = detect_single_face(image_path, detector_backend)
+            embedding = embed_face_crops([crop], model_name)[0].tolist()  # List for JSON serialization
         except Exception as e:
             print(f"Error extracting face embedding: {str(e)}")
             return False
@@ -155,6 +163,14 @@ def add_face_to_db(
             VALUES (%s, %s) 
             ON CONFLICT (studentID) DO UPDATE SET faceEncoding = EXCLUDED.faceEncoding;
         """, (student_id, face_encoding_json))
+        record_gallery_change(cursor, student_id)
+
+        for extra_model in GALLERY_EXTRA_MODELS:
+            try:
+                save_model_embedding(cursor, student_id, extra_model, embed_face_crops([crop], extra_model)[0])
+            except Exception as e:
+                # The student is still recognized, by the primary model only
+                logger.warning(f"No {extra_model} embedding for {name}: {str(e)}")
         
         # Commit changes
         conn.commit()
@@ -218,50 +234,34 @@ def recognize_faces_deepface(
         dict: Dictionary with bounding box, name, and confidence for each recognized face
     """
     results = {}
-    print("\n=== Starting DeepFace Recognition ===")
+    logger.debug("Starting DeepFace recognition")
     
     try:
         # Load known faces
-        print("📚 Loading known faces from database...")
-        known_embeddings, known_names = load_known_faces(database_path)
+        with stage_timer("gallery_load"):
+            known_embeddings, known_names = load_known_faces(database_path)
         if not known_embeddings:
-            print("No known faces found in database")
+            logger.info("No known faces found in database")
             return results
-        print(f"✅ Loaded {len(known_names)} known faces")
+        logger.debug("Loaded %d known faces", len(known_names))
         
         # Detect and get information about faces in the image
-        print("🔍 Detecting faces in image...")
-
-        startTime = time.time()
-
-        faces = DeepFace.extract_faces(
-            img_path=image_path,
-            enforce_detection=True,
-            detector_backend=detector_backend
-        )
-        endTime = time.time()
-        timePassed = endTime-startTime
-        print("Time passed = "+str(timePassed))
-        print(f"✅ Found {len(faces)} faces")
+        faces = detect_faces_deepface(image_path, detector_backend)
+        logger.debug("Found %d faces", len(faces))
         
-        startTime = time.time()
         # Get embeddings for all faces in the image
-        embeddings = DeepFace.represent(
-            img_path=image_path,
-            model_name=model_name,
-            detector_backend=detector_backend,
-            enforce_detection=True,
-            align=True
-        )
-        endTime = time.time()
-        timePassed = endTime-startTime
-        print("Time passed for embeddings = "+str(timePassed)) 
-        
+        with stage_timer("embedding"):
+            embeddings = DeepFace.represent(
+                img_path=image_path,
+                model_name=model_name,
+                detector_backend=detector_backend,
+                enforce_detection=True,
+                align=True
+            )
 
-        startTime = time.time()
+        matching_start = time.perf_counter()
         # Process each detected face
         for i, (face_data, embedding_obj) in enumerate(zip(faces, embeddings)):
-            print(f"\n👤 Processing face {i+1}")
             
             try:
                 facial_area = face_data['facial_area']
@@ -303,7 +303,7 @@ def recognize_faces_deepface(
                     # Update results
                     if best_match_name not in results or confidence > results[best_match_name]['confidence']:
                         results[best_match_name] = face_data
-                        print(f"✅ Matched with {best_match_name} (confidence: {confidence:.2%})")
+                        logger.debug("Matched with %s (confidence: %.2f)", best_match_name, confidence)
                 else:
                     # Assign a placeholder name for strangers
                     stranger_id = f"stranger_{len([k for k in results if k.startswith('stranger_')]) + 1}"
@@ -318,21 +318,18 @@ def recognize_faces_deepface(
                         'confidence': float(confidence)
                     }
                     results[stranger_id] = face_data
-                    print(f"❓ Stranger detected: {stranger_id} (confidence: {confidence:.2%})")
+                    logger.debug("Stranger detected: %s (confidence: %.2f)", stranger_id, confidence)
                     
             except Exception as e:
-                print(f"Error processing face {i+1}: {str(e)}")
+                logger.warning(f"Error processing face {i+1}: {str(e)}")
                 continue
 
-        endTime = time.time()
-        timePassed = endTime-startTime
-        print("Time passed for processing= "+str(timePassed)) 
+        STAGE_SECONDS.observe(time.perf_counter() - matching_start, {"stage": "matching"})
     except Exception as e:
-        print(f"Error in recognize_faces_deepface: {str(e)}")
-        import traceback
-        print(f"Traceback: {traceback.format_exc()}")
+        logger.error(f"Error in recognize_faces_deepface: {str(e)}")
+        logger.debug("Traceback: %s", traceback.format_exc())
         
-    print(f"\n✅ Recognition complete. Found {len(results)} matches.")
+    logger.debug("Recognition complete. Found %d matches.", len(results))
     return results
 
 
@@ -392,145 +389,494 @@ def load_known_faces_from_db() -> Tuple[Dict[Tuple[float, ...], str]]:
             conn.close()
     return known_faces
 
-def recognize_faces_deepface_parralelisation(
-    image_path: str,
-    model_name: str = MODEL,
-    detector_backend: str = "retinaface",
-    distance_metric: str = "cosine",
-    threshold: float = 0.60
-) -> Dict[str, Any]:
+def detect_faces_deepface(
+    image: Union[str, np.ndarray],
+    detector_backend: str = "retinaface"
+) -> List[Dict[str, Any]]:
     """
-    Recognize faces in an image using DeepFace, fetching known faces and names from the database.
+    Detect and align every face of an image
 
     Args:
-        image_path (str): Path to the image to analyze
-        model_name (str): Face recognition model to use
+        image (str or np.ndarray): Image path or BGR image
         detector_backend (str): Face detection model to use
-        distance_metric (str): Distance metric for face comparison
-        threshold (float): Recognition threshold (lower = more strict)
 
     Returns:
-        dict: Dictionary with bounding box, name (student name or 'stranger'),
-              and confidence for each recognized face.
+        list: DeepFace face objects ('face' aligned RGB crop in [0, 1], 'facial_area', 'confidence')
     """
-    results = {}
-    print("\n=== Starting DeepFace Recognition (Database with Names) ===")
+    with stage_timer("detection"):
+        return DeepFace.extract_faces(
+            img_path=image,
+            enforce_detection=True,
+            detector_backend=detector_backend,
+            align=True
+        )
 
-    try:
-        # Load known faces and names from the database
-        print("📚 Loading known faces and names from database...")
-        known_faces = load_known_faces_from_db()
-        if not known_faces:
-            print("No known faces found in the database.")
-            return results
-        print(f"✅ Loaded {len(known_faces)} known faces.")
 
-        known_embeddings = list(known_faces.keys())
-        known_names = list(known_faces.values())
+def face_crop_to_bgr(face_obj: Dict[str, Any]) -> np.ndarray:
+    """Convert an extracted face (RGB floats in [0, 1]) back to the BGR uint8 image DeepFace expects."""
+    return (face_obj['face'][:, :, ::-1] * 255).clip(0, 255).astype(np.uint8)
 
-        # Detect and get information about faces in the image
-        print("🔍 Detecting faces in image...")
-        startTime = time.time()
 
-        with concurrent.futures.ThreadPoolExecutor() as executor:
-            face_future = executor.submit(
-                DeepFace.extract_faces,
-                img_path=image_path,
-                enforce_detection=True,
-                detector_backend=detector_backend
-            )
+def detect_single_face(image: Union[str, np.ndarray], detector_backend: str = "retinaface") -> np.ndarray:
+    """
+    Aligned BGR crop of the only face of an enrollment photo
 
-            embedding_future = executor.submit(
-                DeepFace.represent,
-                img_path=image_path,
+    Raises:
+        ValueError: If the image has no face or several
+    """
+    faces = detect_faces_deepface(image, detector_backend)
+    if not faces:
+        raise ValueError("No face detected in the image")
+    if len(faces) > 1:
+        raise ValueError("Multiple faces detected in the image")
+    return face_crop_to_bgr(faces[0])
+
+
+def embed_face_crops(
+    crops: List[np.ndarray],
+    model_name: str = MODEL,
+    stage: str = "embedding"
+) -> List[np.ndarray]:
+    """
+    Embed already detected and aligned face crops, skipping detection
+
+    Args:
+        crops (list): BGR uint8 face crops
+        model_name (str): Face recognition model to use
+        stage (str): Stage the time is recorded under
+
+    Returns:
+        list: One embedding per crop
+    """
+    with stage_timer(stage):
+        return [
+            np.array(DeepFace.represent(
+                img_path=crop,
                 model_name=model_name,
-                detector_backend=detector_backend,
-                enforce_detection=True,
-                align=True
-            )
+                detector_backend="skip",
+                enforce_detection=False,
+                align=False
+            )[0]["embedding"], dtype=np.float32)
+            for crop in crops
+        ]
 
-        faces = face_future.result()
-        embeddings = embedding_future.result()
-        endTime = time.time()
-        timePassed = endTime - startTime
-        print(f"Time passed for detection and representation: {timePassed:.4f} seconds")
 
-        startTime = time.time()
-        # Process each detected face
-        for i, (face_data, embedding_obj) in enumerate(zip(faces, embeddings)):
-            print(f"\n👤 Processing face {i+1}")
+def align_crop(crop: np.ndarray, left_eye: Tuple[float, float], right_eye: Tuple[float, float]) -> np.ndarray:
+    """
+    Rotate a face crop around the middle of the eyes so they are level, as
+    DeepFace aligns the faces it detects
 
-            try:
-                facial_area = face_data['facial_area']
-                embedding = np.array(embedding_obj["embedding"])
+    Args:
+        crop (np.ndarray): BGR face crop
+        left_eye, right_eye: (x, y) eye positions in the crop, in any order
+    """
+    (x1, y1), (x2, y2) = sorted([tuple(left_eye), tuple(right_eye)])
+    angle = float(np.degrees(np.arctan2(y2 - y1, x2 - x1)))
+    if abs(angle) < 1:
+        return crop
+    rotation = cv2.getRotationMatrix2D(((x1 + x2) / 2, (y1 + y2) / 2), angle, 1.0)
+    return cv2.warpAffine(crop, rotation, (crop.shape[1], crop.shape[0]), flags=cv2.INTER_LINEAR, borderMode=cv2.BORDER_REPLICATE)
+
+
+def bounding_box(facial_area: Dict[str, int]) -> Tuple[int, int, int, int]:
+    """DeepFace facial area as a (top, right, bottom, left) box."""
+    return (
+        facial_area['y'],
+        facial_area['x'] + facial_area['w'],
+        facial_area['y'] + facial_area['h'],
+        facial_area['x']
+    )
 
-                # Compare with known embeddings
-                best_match_name = None
-                best_match_distance = float('inf')
 
-                for db_embedding, name in zip(known_embeddings, known_names):
-                    if distance_metric == "cosine":
-                        distance = 1 - np.dot(embedding, db_embedding) / (
-                            np.linalg.norm(embedding) * np.linalg.norm(db_embedding)
-                        )
-                    elif distance_metric == "euclidean":
-                        distance = np.linalg.norm(embedding - db_embedding)
-                    else:
-                        raise ValueError(f"Unsupported distance metric: {distance_metric}")
+def match_cascade_stage_one(
+    crops: List[np.ndarray],
+    cascade_model: str,
+    galleries: List[Optional[Gallery]]
+) -> Dict[int, Tuple[Gallery, int, float]]:
+    """
+    First stage of the model cascade: embed every crop with the cheap model
+    and keep the matches that are clearly safe, a distance under the model's
+    threshold and CASCADE_MARGIN ahead of the runner-up. The other faces are
+    left to the primary model, strangers included since the cheap gallery
+    may miss students.
 
-                    if distance < best_match_distance:
-                        best_match_distance = distance
-                        best_match_name = name
+    Args:
+        crops (list): BGR uint8 face crops
+        cascade_model (str): Cheap embedding model
+        galleries (list): Galleries of the request, a match must belong to one of them
+
+    Returns:
+        dict: Face index -> (cheap-model gallery, index in it, distance) for the resolved faces
+    """
+    threshold = CASCADE_THRESHOLDS.get(cascade_model)
+    if threshold is None:
+        raise ValueError(f"No cascade threshold for model: {cascade_model}")
+    cheap_gallery = get_gallery(cascade_model)
+    if not len(cheap_gallery) or not crops:
+        return {}
+
+    embeddings = embed_face_crops(crops, cascade_model, stage="embedding_stage1")
+    resolved = {}
+    with stage_timer("matching"):
+        for i, embedding in enumerate(embeddings):
+            index, best, second = cheap_gallery.top_two(embedding, "cosine")
+            if index is None or best > threshold or second - best < CASCADE_MARGIN:
+                continue
+            student_id = cheap_gallery.student_ids[index]
+            if any(gallery is not None and student_id in gallery for gallery in galleries):
+                resolved[i] = (cheap_gallery, index, best)
+    return resolved
+
+
+def match_face_crops(
+    crops: List[np.ndarray],
+    faces_info: List[Dict[str, Any]],
+    gallery: Gallery,
+    fallback_gallery: Optional[Gallery] = None,
+    model_name: str = MODEL,
+    distance_metric: str = "cosine",
+    threshold: float = MATCH_THRESHOLD,
+    cascade_model: Optional[str] = None
+) -> Dict[str, Any]:
+    """
+    Embed aligned face crops and match them against the galleries
+
+    Args:
+        crops (list): BGR uint8 face crops
+        faces_info (list): Fields copied into the result of each crop, such as its 'bounding_box'
+        gallery (Gallery): Known faces to search
+        fallback_gallery (Gallery): Searched only for faces that match nobody in `gallery`
+        cascade_model (str): Cheap model of the first cascade stage, None disables the cascade
+
+    Returns:
+        dict: Results keyed by student name, strangers named 'stranger_N'
+    """
+    results = {}
+
+    # Cheap-model thresholds are cosine distances
+    resolved = {}
+    if cascade_model and distance_metric == "cosine":
+        resolved = match_cascade_stage_one(crops, cascade_model, [gallery, fallback_gallery])
+        CASCADE_FACES_TOTAL.inc(len(resolved), {"stage": "1"})
+        CASCADE_FACES_TOTAL.inc(len(crops) - len(resolved), {"stage": "2"})
+    pending = [i for i in range(len(crops)) if i not in resolved]
+    embeddings = dict(zip(pending, embed_face_crops([crops[i] for i in pending], model_name)))
+
+    with stage_timer("matching"):
+        for i, info in enumerate(faces_info):
+            try:
+                if i in resolved:
+                    matched_gallery, best_index, best_match_distance = resolved[i]
+                else:
+                    # Compare with every known embedding at once
+                    matched_gallery = gallery
+                    best_index, best_match_distance = gallery.best_match(embeddings[i], distance_metric)
+                    if best_match_distance > threshold and fallback_gallery is not None:
+                        matched_gallery = fallback_gallery
+                        best_index, best_match_distance = fallback_gallery.best_match(embeddings[i], distance_metric)
 
                 # Convert distance to confidence
                 confidence = 1 - best_match_distance
 
-                if confidence >= (1 - threshold):
-                    face_data = {
-                        'bounding_box': (
-                            facial_area['y'],
-                            facial_area['x'] + facial_area['w'],
-                            facial_area['y'] + facial_area['h'],
-                            facial_area['x']
-                        ),
-                        'name': best_match_name,
-                        'confidence': float(confidence)
-                    }
+                # Stage-one matches already passed the cheap model's own threshold
+                if i in resolved or confidence >= (1 - threshold):
+                    best_match_name = matched_gallery.names[best_index]
+                    face_data = dict(
+                        info,
+                        name=best_match_name,
+                        student_id=matched_gallery.student_ids[best_index],
+                        confidence=float(confidence)
+                    )
 
                     # Update results
                     if best_match_name not in results or confidence > results[best_match_name]['confidence']:
                         results[best_match_name] = face_data
-                        print(f"✅ Matched with Student {best_match_name} (confidence: {confidence:.2%})")
+                        logger.debug("Face %d matched with %s (confidence: %.2f)", i + 1, best_match_name, confidence)
                 else:
                     # Assign a placeholder name for strangers
                     stranger_id = f"stranger_{len([k for k in results if k.startswith('stranger_')]) + 1}"
-                    face_data = {
-                        'bounding_box': (
-                            facial_area['y'],
-                            facial_area['x'] + facial_area['w'],
-                            facial_area['y'] + facial_area['h'],
-                            facial_area['x']
-                        ),
-                        'name': stranger_id,
-                        'confidence': float(confidence)
-                    }
-                    results[stranger_id] = face_data
-                    print(f"❓ Stranger detected: {stranger_id} (confidence: {confidence:.2%})")
+                    results[stranger_id] = dict(info, name=stranger_id, confidence=float(confidence))
+                    logger.debug("Face %d is a stranger: %s (confidence: %.2f)", i + 1, stranger_id, confidence)
 
             except Exception as e:
-                print(f"Error processing face {i+1}: {str(e)}")
+                logger.warning(f"Error processing face {i+1}: {str(e)}")
                 continue
 
-        endTime = time.time()
-        timePassed = endTime - startTime
-        print(f"Time passed for recognition: {timePassed:.4f} seconds")
+    FACES_TOTAL.inc(sum(1 for face in results.values() if 'student_id' in face), {"result": "matched"})
+    FACES_TOTAL.inc(sum(1 for face in results.values() if 'student_id' not in face), {"result": "stranger"})
+    return results
+
+
+def match_tracked_faces(
+    crops: List[np.ndarray],
+    boxes: List[Tuple[int, int, int, int]],
+    tracker: FaceTracker,
+    timestamp: float,
+    gallery: Gallery,
+    fallback_gallery: Optional[Gallery] = None,
+    **match_options: Any
+) -> Dict[str, Any]:
+    """
+    match_face_crops for consecutive frames of one source: only the faces
+    the tracker cannot vouch for are embedded, the others keep the identity
+    of their track. Results carry their 'track_id'.
+    """
+    tracks = tracker.match(boxes, timestamp)
+    signatures = [appearance_signature(crop) if tracker.min_similarity else None for crop in crops]
+    pending = [i for i, track in enumerate(tracks) if tracker.needs_embedding(track, boxes[i], timestamp, signatures[i])]
+    matched = match_face_crops(
+        [crops[i] for i in pending],
+        [{'bounding_box': boxes[i], 'face_index': i} for i in pending],
+        gallery,
+        fallback_gallery,
+        **match_options
+    )
+    identities = {face.pop('face_index'): face for face in matched.values()}
+    FACES_TOTAL.inc(len(crops) - len(pending), {"result": "tracked"})
+
+    faces = []
+    for i, track in enumerate(tracks):
+        if i in identities:
+            identity = {key: value for key, value in identities[i].items() if key != 'bounding_box'}
+            track = tracker.update(track, boxes[i], timestamp, identity=identity, signature=signatures[i])
+            faces.append(dict(identities[i], track_id=track.track_id))
+            continue
+        track = tracker.update(track, boxes[i], timestamp)
+        # An embedded face without a result lost to a more confident face of
+        # the same student, it keeps whatever identity its track had
+        if track.identity is not None:
+            faces.append(dict(track.identity, bounding_box=boxes[i], track_id=track.track_id))
+
+    results = {}
+    strangers = 0
+    for face in faces:
+        if face.get('student_id') is None:
+            strangers += 1
+            face['name'] = f"stranger_{strangers}"
+            results[face['name']] = face
+        elif face['name'] not in results or face['confidence'] > results[face['name']]['confidence']:
+            results[face['name']] = face
+    return results
+
+
+def recognize_faces_deepface_parralelisation(
+    image_path: Union[str, np.ndarray],
+    model_name: str = MODEL,
+    detector_backend: str = "retinaface",
+    distance_metric: str = "cosine",
+    threshold: float = MATCH_THRESHOLD,
+    gallery: Optional[Gallery] = None,
+    fallback_gallery: Optional[Gallery] = None,
+    cascade_model: Optional[str] = None,
+    quality_filter: bool = FACE_QUALITY_FILTER,
+    skipped: Optional[List[Dict[str, Any]]] = None,
+    tracker: Optional[FaceTracker] = None,
+    timestamp: Optional[float] = None,
+    scale: float = 1.0
+) -> Dict[str, Any]:
+    """
+    Recognize faces in an image using DeepFace, fetching known faces and names from the database.
+
+    Faces are detected and aligned once, then the aligned crops are embedded
+    directly. Each stage is timed in metrics.STAGE_SECONDS.
+
+    With a cascade model, every face is embedded with that cheap model first
+    and only the faces it cannot safely match are embedded with model_name.
+
+    The quality filter drops tiny, unsure, blurred and profile detections
+    before embedding, they are appended to `skipped` instead of being
+    reported as strangers.
+
+    Args:
+        image_path (str or np.ndarray): Path to the image to analyze, or the decoded BGR image
+        model_name (str): Face recognition model to use
+        detector_backend (str): Face detection model to use
+        distance_metric (str): Distance metric for face comparison
+        threshold (float): Recognition threshold (lower = more strict)
+        gallery (Gallery): Known faces to search, defaults to the full cached gallery
+        fallback_gallery (Gallery): Searched only for faces that match nobody in `gallery`
+        cascade_model (str): Cheap model of the first cascade stage, None disables the cascade
+        quality_filter (bool): Skip low-quality faces before embedding, see face_quality.py
+        skipped (list): Receives {'bounding_box', 'reasons', scores...} for every skipped face
+        tracker (FaceTracker): Tracks of the video source the image is a frame of, see
+            match_tracked_faces; None recognizes the image on its own
+        timestamp (float): Time of the frame in seconds, defaults to now
+        scale (float): Factor the image was downscaled by from the camera frame,
+            so the quality filter judges face sizes in frame pixels
+
+    Returns:
+        dict: Dictionary with bounding box, name (student name or 'stranger'),
+              and confidence for each recognized face.
+    """
+    results = {}
+    logger.debug("Starting DeepFace recognition")
+
+    try:
+        # Load known faces and names from the cached gallery
+        if gallery is None:
+            with stage_timer("gallery_load"):
+                gallery = get_gallery()
+        if not len(gallery) and not (fallback_gallery is not None and len(fallback_gallery)):
+            logger.info("No known faces found in the database.")
+            return results
+        logger.debug("Searching %d known faces", len(gallery))
+
+        faces = detect_faces_deepface(image_path, detector_backend)
+        detected = len(faces)
+        logger.debug("Found %d faces", detected)
+
+        if quality_filter:
+            with stage_timer("quality"):
+                kept, rejected = filter_faces(faces, scale)
+            if skipped is not None:
+                skipped.extend(
+                    dict(scores, bounding_box=bounding_box(faces[i]['facial_area']), reasons=reasons)
+                    for i, reasons, scores in rejected
+                )
+            FACES_TOTAL.inc(len(rejected), {"result": "skipped"})
+            faces = [faces[i] for i in kept]
+
+        with stage_timer("alignment"):
+            crops = [face_crop_to_bgr(face) for face in faces]
+
+        match_options = dict(
+            model_name=model_name,
+            distance_metric=distance_metric,
+            threshold=threshold,
+            cascade_model=cascade_model
+        )
+        boxes = [bounding_box(face['facial_area']) for face in faces]
+        if tracker is not None:
+            results = match_tracked_faces(
+                crops,
+                boxes,
+                tracker,
+                time.monotonic() if timestamp is None else timestamp,
+                gallery,
+                fallback_gallery,
+                **match_options
+            )
+        else:
+            results = match_face_crops(crops, [{'bounding_box': box} for box in boxes], gallery, fallback_gallery, **match_options)
+        FACES_TOTAL.inc(detected, {"result": "detected"})
 
     except Exception as e:
-        print(f"Error in recognize_faces_deepface: {str(e)}")
-        import traceback
-        print(f"Traceback: {traceback.format_exc()}")
+        logger.error(f"Error in recognize_faces_deepface_parralelisation: {str(e)}")
+        logger.debug("Traceback: %s", traceback.format_exc())
 
-    print(f"\n✅ Recognition complete. Found {len(results)} matches.")
+    logger.debug("Recognition complete. Found %d matches.", len(results))
     return results
+
+
+def recognize_image(
+    image: np.ndarray,
+    gallery: Optional[Gallery] = None,
+    fallback_gallery: Optional[Gallery] = None,
+    detector_backend: str = "retinaface",
+    cascade: bool = False,
+    skipped: Optional[List[Dict[str, Any]]] = None,
+    tracker: Optional[FaceTracker] = None,
+    timestamp: Optional[float] = None,
+    scale: float = 1.0
+) -> Dict[str, Any]:
+    """
+    Entry point of the deepface engine, see engines.py. The model stays
+    MODEL whatever the profile: the gallery only holds its embeddings,
+    the cascade only skips it for faces CASCADE_MODEL matches safely.
+    A tracker, for frames of a video source, skips the faces it already knows.
+    """
+    return recognize_faces_deepface_parralelisation(
+        image,
+        detector_backend=detector_backend,
+        gallery=gallery,
+        fallback_gallery=fallback_gallery,
+        cascade_model=CASCADE_MODEL if cascade else None,
+        skipped=skipped,
+        tracker=tracker,
+        timestamp=timestamp,
+        scale=scale
+    )
+
+
+def detect_image(image: np.ndarray, detector_backend: str = "retinaface") -> List[Dict[str, Any]]:
+    """
+    Entry point of detection-only requests, see engines.detect. Faces are
+    neither aligned nor embedded.
+    """
+    with stage_timer("detection"):
+        try:
+            faces = DeepFace.extract_faces(
+                img_path=image,
+                enforce_detection=True,
+                detector_backend=detector_backend,
+                align=False
+            )
+        except ValueError:
+            # DeepFace raises when the image has no face
+            return []
+    return [
+        {'bounding_box': bounding_box(face['facial_area']), 'confidence': float(face.get('confidence') or 0)}
+        for face in faces
+    ]
+
+
+def recognize_crops(
+    crops: List[np.ndarray],
+    gallery: Gallery,
+    fallback_gallery: Optional[Gallery] = None,
+    landmarks: Optional[List[Optional[Dict[str, Any]]]] = None,
+    boxes: Optional[List[Optional[Tuple[int, int, int, int]]]] = None,
+    cascade: bool = False,
+    quality_filter: bool = FACE_QUALITY_FILTER,
+    skipped: Optional[List[Dict[str, Any]]] = None
+) -> Dict[str, Any]:
+    """
+    Recognize faces already detected and cropped by the client, without
+    running a detector. Results carry the 'crop_index' of their crop, and
+    the 'bounding_box' the client sent for it, if any.
+
+    Args:
+        crops (list): BGR uint8 face crops
+        landmarks (list): Per crop, None if the crop is already aligned or
+            {'left_eye': (x, y), 'right_eye': (x, y)} in crop coordinates to align it
+        boxes (list): Per crop, its (top, right, bottom, left) box in the client's frame
+        cascade (bool): Run the CASCADE_MODEL stage first, as the fast profiles do
+        skipped (list): Receives {'crop_index', 'reasons', scores...} for every skipped crop
+    """
+    infos = []
+    for i in range(len(crops)):
+        info = {'crop_index': i}
+        if boxes and boxes[i] is not None:
+            info['bounding_box'] = tuple(boxes[i])
+        infos.append(info)
+
+    if landmarks:
+        with stage_timer("alignment"):
+            crops = [
+                align_crop(crop, points['left_eye'], points['right_eye']) if points else crop
+                for crop, points in zip(crops, landmarks)
+            ]
+    FACES_TOTAL.inc(len(crops), {"result": "detected"})
+
+    if quality_filter:
+        with stage_timer("quality"):
+            assessed = [assess_crop(crop) for crop in crops]
+        rejected = [i for i, (reasons, _) in enumerate(assessed) if reasons]
+        if skipped is not None:
+            skipped.extend(dict(assessed[i][1], reasons=assessed[i][0], **infos[i]) for i in rejected)
+        FACES_TOTAL.inc(len(rejected), {"result": "skipped"})
+        kept = [i for i, (reasons, _) in enumerate(assessed) if not reasons]
+        crops, infos = [crops[i] for i in kept], [infos[i] for i in kept]
+
+    if not crops:
+        return {}
+    return match_face_crops(
+        crops,
+        infos,
+        gallery,
+        fallback_gallery,
+        cascade_model=CASCADE_MODEL if cascade else None
+    )
+
 #recognize_faces_deepface(image_path="imgTest/class.jpg")
 #recognize_faces_deepface_parralelisation(image_path="imgTest/class.jpg")
\ No newline at end of file
@@ -0,0 +1,154 @@
+"""
+Pre-embedding quality filter: detections too small, too unsure, too blurred
+or too far from frontal are skipped before they cost an embedding, and
+reported separately instead of as spurious strangers.
+"""
+import os
+import logging
+from typing import Dict, Any, List, Optional, Tuple
+
+import cv2
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+FACE_QUALITY_FILTER = os.getenv("FACE_QUALITY_FILTER", "1") == "1"
+# Shortest side of the detection box, in pixels of the original frame (before any profile downscale)
+FACE_MIN_SIZE = int(os.getenv("FACE_MIN_SIZE", "32"))
+# Detector confidence, ignored for detectors that report none (opencv)
+FACE_MIN_CONFIDENCE = float(os.getenv("FACE_MIN_CONFIDENCE", "0.80"))
+# Variance of the Laplacian of the crop resized to SHARPNESS_SIDE pixels
+FACE_MIN_SHARPNESS = float(os.getenv("FACE_MIN_SHARPNESS", "15"))
+# Horizontal asymmetry of the landmarks, 0 for a frontal face, 1 for a full profile
+FACE_MAX_YAW = float(os.getenv("FACE_MAX_YAW", "0.60"))
+
+# Crops are compared at the same size, so the blur score does not depend on the face size
+SHARPNESS_SIDE = 112
+
+
+def sharpness(face: np.ndarray) -> float:
+    """
+    Blur score of a face crop, higher is sharper
+
+    Args:
+        face (np.ndarray): Face crop, RGB floats in [0, 1] (DeepFace) or uint8
+    """
+    if face.dtype != np.uint8:
+        face = (face * 255).clip(0, 255).astype(np.uint8)
+    gray = cv2.cvtColor(face, cv2.COLOR_RGB2GRAY) if face.ndim == 3 else face
+    gray = cv2.resize(gray, (SHARPNESS_SIDE, SHARPNESS_SIDE), interpolation=cv2.INTER_AREA)
+    return float(cv2.Laplacian(gray, cv2.CV_64F).var())
+
+
+def _point(value: Any) -> Optional[Tuple[float, float]]:
+    if value is None:
+        return None
+    try:
+        return float(value[0]), float(value[1])
+    except (TypeError, IndexError, ValueError):
+        return None
+
+
+def estimate_yaw(facial_area: Dict[str, Any]) -> Optional[float]:
+    """
+    Yaw estimate from the detector landmarks, None if the detector gives none
+
+    With a nose landmark, the asymmetry of the nose-to-eye distances; with
+    the eyes only, how much narrower than frontal the eye distance is.
+
+    Returns:
+        float: 0 for a frontal face up to 1 for a full profile
+    """
+    left_eye, right_eye = _point(facial_area.get('left_eye')), _point(facial_area.get('right_eye'))
+    if left_eye is None or right_eye is None:
+        return None
+    nose = _point(facial_area.get('nose'))
+    if nose is not None:
+        to_left, to_right = abs(nose[0] - left_eye[0]), abs(nose[0] - right_eye[0])
+        if to_left + to_right == 0:
+            return 1.0
+        return abs(to_left - to_right) / (to_left + to_right)
+    width = facial_area.get('w') or 0
+    if not width:
+        return None
+    # Frontal faces have their eyes about 40% of the box width apart
+    return float(min(1.0, max(0.0, 1 - (abs(left_eye[0] - right_eye[0]) / width) / 0.4)))
+
+
+def assess_face(face_obj: Dict[str, Any], scale: float = 1.0) -> Tuple[List[str], Dict[str, float]]:
+    """
+    Quality checks of one DeepFace face object
+
+    Args:
+        scale (float): Factor the frame was downscaled by before detection,
+            the size is judged in pixels of the original frame
+
+    Returns:
+        tuple: (reasons the face fails, empty when it passes; measured scores)
+    """
+    area = face_obj['facial_area']
+    reasons = []
+    scores = {'size': float(min(area['w'], area['h'])) / scale}
+    if scores['size'] < FACE_MIN_SIZE:
+        reasons.append("too_small")
+
+    confidence = face_obj.get('confidence')
+    if confidence:
+        scores['detector_confidence'] = float(confidence)
+        if confidence < FACE_MIN_CONFIDENCE:
+            reasons.append("low_confidence")
+
+    # Cheap checks first, a tiny face is not worth a Laplacian
+    if not reasons:
+        scores['sharpness'] = sharpness(face_obj['face'])
+        if scores['sharpness'] < FACE_MIN_SHARPNESS:
+            reasons.append("blurred")
+        yaw = estimate_yaw(area)
+        if yaw is not None:
+            scores['yaw'] = yaw
+            if yaw > FACE_MAX_YAW:
+                reasons.append("profile")
+    return reasons, scores
+
+
+def assess_crop(crop: np.ndarray) -> Tuple[List[str], Dict[str, float]]:
+    """
+    Quality checks of a face cropped by the client: size and blur only,
+    there is no detector confidence nor landmarks to judge the pose from
+
+    Returns:
+        tuple: (reasons the face fails, empty when it passes; measured scores)
+    """
+    reasons = []
+    scores = {'size': float(min(crop.shape[:2]))}
+    if scores['size'] < FACE_MIN_SIZE:
+        reasons.append("too_small")
+    else:
+        # The channel order barely changes the gray level a blur score is computed on
+        scores['sharpness'] = sharpness(crop)
+        if scores['sharpness'] < FACE_MIN_SHARPNESS:
+            reasons.append("blurred")
+    return reasons, scores
+
+
+def filter_faces(
+    faces: List[Dict[str, Any]],
+    scale: float = 1.0
+) -> Tuple[List[int], List[Tuple[int, List[str], Dict[str, float]]]]:
+    """
+    Split detections into the ones worth embedding and the skipped ones,
+    `scale` being the downscale factor of the image they were detected in
+
+    Returns:
+        tuple: (indices kept, [(index, reasons, scores)] skipped)
+    """
+    kept, skipped = [], []
+    for i, face_obj in enumerate(faces):
+        reasons, scores = assess_face(face_obj, scale)
+        if reasons:
+            skipped.append((i, reasons, scores))
+        else:
+            kept.append(i)
+    if skipped:
+        logger.debug("Quality filter skipped %d of %d faces", len(skipped), len(faces))
+    return kept, skipped
@@ -0,0 +1,164 @@
+"""
+Cross-frame face tracking for video sources.
+
+Seated students stay at almost the same place from one frame to the next.
+A track follows a face by the overlap (IoU) of its boxes and keeps the
+identity it was given; the face is only embedded again when its track is
+new, when it moved away from where it was last embedded, when its
+appearance changed, or once the refresh interval has passed.
+"""
+import os
+import itertools
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import cv2
+import numpy as np
+
+# Minimum IoU between a detection and the last box of a track to continue it
+TRACK_MIN_IOU = float(os.getenv("TRACK_MIN_IOU", "0.3"))
+# Below this IoU with the box it was embedded at, a face has moved and is embedded again
+TRACK_MOVED_IOU = float(os.getenv("TRACK_MOVED_IOU", "0.6"))
+# Seconds of video after which a tracked face is embedded again anyway
+TRACK_REFRESH_SECONDS = float(os.getenv("TRACK_REFRESH_SECONDS", "10"))
+# Seconds a track survives without a matching detection
+TRACK_MAX_AGE_SECONDS = float(os.getenv("TRACK_MAX_AGE_SECONDS", "3"))
+# Correlation of the face thumbnails under which the appearance changed, 0 disables the check
+TRACK_MIN_SIMILARITY = float(os.getenv("TRACK_MIN_SIMILARITY", "0.5"))
+
+SIGNATURE_SIDE = 16
+
+Box = Tuple[int, int, int, int]
+
+
+def iou(a: Box, b: Box) -> float:
+    """Intersection over union of two (top, right, bottom, left) boxes"""
+    top, right = max(a[0], b[0]), min(a[1], b[1])
+    bottom, left = min(a[2], b[2]), max(a[3], b[3])
+    intersection = max(0, right - left) * max(0, bottom - top)
+    if not intersection:
+        return 0.0
+    area_a = (a[1] - a[3]) * (a[2] - a[0])
+    area_b = (b[1] - b[3]) * (b[2] - b[0])
+    return intersection / float(area_a + area_b - intersection)
+
+
+def appearance_signature(crop: np.ndarray) -> np.ndarray:
+    """Tiny zero-mean, unit-norm grayscale thumbnail of a BGR face crop, compared by dot product"""
+    gray = cv2.cvtColor(crop, cv2.COLOR_BGR2GRAY) if crop.ndim == 3 else crop
+    thumbnail = cv2.resize(gray, (SIGNATURE_SIDE, SIGNATURE_SIDE), interpolation=cv2.INTER_AREA).astype(np.float32).ravel()
+    thumbnail -= thumbnail.mean()
+    norm = np.linalg.norm(thumbnail)
+    return thumbnail / norm if norm else thumbnail
+
+
+class Track:
+    """One face followed across frames"""
+
+    def __init__(self, track_id: int, bounding_box: Box, last_seen: float):
+        self.track_id = track_id
+        self.bounding_box = bounding_box
+        self.last_seen = last_seen
+        # Result of the last embedding: name, confidence, student_id for a student
+        self.identity: Optional[Dict[str, Any]] = None
+        self.embedded_box: Optional[Box] = None
+        self.embedded_at = float('-inf')
+        self.signature: Optional[np.ndarray] = None
+
+
+class FaceTracker:
+    """
+    Tracks of one video source. Not thread-safe: use one tracker per camera.
+
+    Per frame: match() the detections to the live tracks, embed the faces
+    for which needs_embedding() is true, then update() every detection.
+    """
+
+    def __init__(
+        self,
+        min_iou: float = TRACK_MIN_IOU,
+        moved_iou: float = TRACK_MOVED_IOU,
+        refresh_seconds: float = TRACK_REFRESH_SECONDS,
+        max_age_seconds: float = TRACK_MAX_AGE_SECONDS,
+        min_similarity: float = TRACK_MIN_SIMILARITY
+    ):
+        self.min_iou = min_iou
+        self.moved_iou = moved_iou
+        self.refresh_seconds = refresh_seconds
+        self.max_age_seconds = max_age_seconds
+        self.min_similarity = min_similarity
+        self.tracks: Dict[int, Track] = {}
+        self._ids = itertools.count(1)
+
+    def match(self, boxes: Sequence[Box], timestamp: float) -> List[Optional[Track]]:
+        """
+        Continue the live tracks with the detections of a frame, greedily by
+        decreasing IoU; tracks unseen for max_age_seconds are dropped first
+
+        Returns:
+            list: The track of each detection, None for a new face
+        """
+        for track_id in [t.track_id for t in self.tracks.values() if timestamp - t.last_seen > self.max_age_seconds]:
+            del self.tracks[track_id]
+
+        pairs = sorted(
+            (
+                (overlap, i, track.track_id)
+                for i, box in enumerate(boxes)
+                for track in self.tracks.values()
+                for overlap in (iou(box, track.bounding_box),)
+                if overlap >= self.min_iou
+            ),
+            reverse=True
+        )
+        assigned: List[Optional[Track]] = [None] * len(boxes)
+        used = set()
+        for _, i, track_id in pairs:
+            if assigned[i] is None and track_id not in used:
+                assigned[i] = self.tracks[track_id]
+                used.add(track_id)
+        return assigned
+
+    def needs_embedding(
+        self,
+        track: Optional[Track],
+        box: Box,
+        timestamp: float,
+        signature: Optional[np.ndarray] = None
+    ) -> bool:
+        """Whether a detection has to be embedded rather than keep its track's identity"""
+        if track is None or track.identity is None or track.embedded_box is None:
+            return True
+        if timestamp - track.embedded_at >= self.refresh_seconds:
+            return True
+        if iou(box, track.embedded_box) < self.moved_iou:
+            return True
+        if self.min_similarity and signature is not None and track.signature is not None:
+            return float(signature @ track.signature) < self.min_similarity
+        return False
+
+    def update(
+        self,
+        track: Optional[Track],
+        box: Box,
+        timestamp: float,
+        identity: Optional[Dict[str, Any]] = None,
+        signature: Optional[np.ndarray] = None
+    ) -> Track:
+        """
+        Record a detection on its track, a new track when `track` is None.
+        Pass the identity only when the face was just embedded.
+        """
+        if track is None:
+            track = Track(next(self._ids), box, timestamp)
+            self.tracks[track.track_id] = track
+        track.bounding_box = box
+        track.last_seen = timestamp
+        if identity is not None:
+            track.identity = identity
+            track.embedded_box = box
+            track.embedded_at = timestamp
+            track.signature = signature
+        return track
+
+    def reset(self) -> None:
+        self.tracks.clear()
@@ -0,0 +1,549 @@
+import os
+import json
+import time
+import hashlib
+import logging
+import threading
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+from psycopg2.extras import RealDictCursor
+
+from db import get_db_connection
+from metrics import stage_timer, GALLERY_SYNC_TOTAL
+
+logger = logging.getLogger(__name__)
+
+# Model of the embeddings in the faceencoding table
+PRIMARY_MODEL = "Facenet512"
+# Cosine distance under which a PRIMARY_MODEL probe matches a gallery entry
+MATCH_THRESHOLD = 0.60
+
+# Embeddings of the students by other models, used by the model cascade
+CREATE_FACEENCODING_MODEL_TABLE = """
+    CREATE TABLE IF NOT EXISTS faceencoding_model (
+        studentid INTEGER NOT NULL REFERENCES student(studentid),
+        model TEXT NOT NULL,
+        faceencoding TEXT NOT NULL,
+        PRIMARY KEY (studentid, model)
+    )
+"""
+UPSERT_MODEL_EMBEDDING = """
+    INSERT INTO faceencoding_model (studentid, model, faceencoding)
+    VALUES (%s, %s, %s)
+    ON CONFLICT (studentid, model) DO UPDATE SET faceencoding = EXCLUDED.faceencoding
+"""
+
+# One row per write to faceencoding or faceencoding_model, so a cached
+# gallery re-reads only the students changed since it was loaded
+CREATE_FACEENCODING_CHANGE_TABLE = """
+    CREATE TABLE IF NOT EXISTS faceencoding_change (
+        changeid SERIAL PRIMARY KEY,
+        studentid INTEGER NOT NULL,
+        model TEXT NOT NULL,
+        changed_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+    )
+"""
+
+# Embedding size of the models a gallery can hold, so an empty gallery
+# still has the shape of the rows that will be appended to it
+EMBEDDING_DIMENSIONS = {
+    "Facenet512": 512,
+    "Facenet": 128,
+    "SFace": 128,
+    "ArcFace": 512,
+    "OpenFace": 128,
+    "GhostFaceNet": 512,
+    "VGG-Face": 4096,
+    "DeepFace": 4096,
+    "DeepID": 160,
+    "Dlib": 128
+}
+
+# Share of dead rows (removed or superseded students) over which a gallery is compacted
+GALLERY_MAX_FRAGMENTATION = float(os.getenv("GALLERY_MAX_FRAGMENTATION", "0.25"))
+# Seconds between two checks of the change log, so enrollments made by other
+# processes are picked up; 0 only syncs on invalidation
+GALLERY_SYNC_INTERVAL = float(os.getenv("GALLERY_SYNC_INTERVAL", "30"))
+# Change IDs are allocated before the writing transaction commits: each sync
+# re-reads this many already seen changes, in case one committed late
+CHANGE_LOOKBACK = 64
+
+
+class Gallery:
+    """
+    In-memory copy of the enrolled face encodings, stored as one matrix so a
+    probe embedding is compared against every student in a single operation.
+
+    Deltas (apply_changes) never modify the rows of an existing gallery:
+    removed and replaced students are marked dead, new embeddings are
+    appended to spare capacity of the matrix, and the result is a new
+    Gallery object. Dead rows are excluded from every match, and dropped by
+    compacted() once they make up GALLERY_MAX_FRAGMENTATION of the matrix.
+    """
+
+    def __init__(
+        self,
+        student_ids: List[int],
+        names: List[str],
+        embeddings: np.ndarray,
+        version: int = 0,
+        change_id: Optional[int] = None,
+        normalized: Optional[np.ndarray] = None
+    ):
+        self.student_ids = student_ids
+        self.names = names
+        self.embeddings = embeddings
+        self.version = version
+        # Last faceencoding_change row reflected in this gallery, None if unknown
+        self.change_id = change_id
+        self._fingerprint = None
+        self._id_set = None
+        if normalized is None:
+            norms = np.linalg.norm(embeddings, axis=1, keepdims=True) if len(embeddings) else None
+            normalized = embeddings / np.where(norms == 0, 1, norms) if norms is not None else embeddings
+        self._normalized = normalized
+        # Rows removed or superseded by a delta, None while there is none
+        self._dead: Optional[np.ndarray] = None
+        self._live = len(student_ids)
+        self._rows: Optional[Dict[int, int]] = None
+        # Matrices the rows are views of, rows past len(student_ids) are spare capacity
+        self._buffer = embeddings
+        self._normalized_buffer = normalized
+
+    def __len__(self) -> int:
+        return self._live
+
+    @property
+    def fragmentation(self) -> float:
+        """Share of the matrix rows that are dead"""
+        total = len(self.student_ids)
+        return (total - self._live) / total if total else 0.0
+
+    def live_rows(self) -> Tuple[List[int], List[str], np.ndarray]:
+        """(student IDs, names, embeddings) of the live rows only"""
+        if self._dead is None:
+            return self.student_ids, self.names, self.embeddings
+        keep = np.flatnonzero(~self._dead)
+        return [self.student_ids[i] for i in keep], [self.names[i] for i in keep], self.embeddings[keep]
+
+    def fingerprint(self) -> str:
+        """Content hash of the gallery, stable across processes and restarts."""
+        if self._fingerprint is None:
+            student_ids, names, embeddings = self.live_rows()
+            digest = hashlib.sha1()
+            digest.update(json.dumps([student_ids, names]).encode())
+            digest.update(np.ascontiguousarray(embeddings, dtype=np.float32).tobytes())
+            self._fingerprint = digest.hexdigest()[:16]
+        return self._fingerprint
+
+    def _row_index(self) -> Dict[int, int]:
+        if self._rows is None:
+            self._rows = {
+                student_id: i for i, student_id in enumerate(self.student_ids) if student_id is not None
+            }
+        return self._rows
+
+    def apply_changes(
+        self,
+        upserts: Dict[int, Tuple[str, np.ndarray]],
+        removed: Iterable[int],
+        version: int,
+        change_id: Optional[int]
+    ) -> "Gallery":
+        """
+        New gallery with students added or replaced (upserts: student ID ->
+        (name, embedding)) and removed, without touching this one's rows.
+        Upserts identical to the current row are no-ops.
+        """
+        rows = dict(self._row_index())
+        total = len(self.student_ids)
+        student_ids, names = list(self.student_ids), list(self.names)
+        dead = np.zeros(total, dtype=bool) if self._dead is None else self._dead.copy()
+
+        appended = []
+        for student_id, (name, embedding) in upserts.items():
+            i = rows.get(student_id)
+            if i is not None and names[i] == name and np.array_equal(self.embeddings[i], embedding):
+                continue
+            appended.append(student_id)
+        for student_id in set(removed) | set(appended):
+            i = rows.pop(student_id, None)
+            if i is not None:
+                dead[i] = True
+                student_ids[i] = names[i] = None
+
+        embeddings, normalized = self.embeddings, self._normalized
+        buffer, normalized_buffer = self._buffer, self._normalized_buffer
+        if appended:
+            vectors = np.vstack([upserts[student_id][1] for student_id in appended]).astype(np.float32)
+            if total and vectors.shape[1] != buffer.shape[1]:
+                raise ValueError(f"Embedding dimension {vectors.shape[1]} does not match the gallery's {buffer.shape[1]}")
+            end = total + len(vectors)
+            # An empty gallery may have been built without knowing the dimension
+            if end > len(buffer) or buffer.shape[1] != vectors.shape[1]:
+                # Grow geometrically, so a stream of enrollments copies the matrix O(log n) times
+                capacity = max(2 * total, end, 16)
+                buffer = np.empty((capacity, vectors.shape[1]), dtype=np.float32)
+                normalized_buffer = np.empty_like(buffer)
+                if total:
+                    buffer[:total], normalized_buffer[:total] = self.embeddings, self._normalized
+            norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+            buffer[total:end] = vectors
+            normalized_buffer[total:end] = vectors / np.where(norms == 0, 1, norms)
+            embeddings, normalized = buffer[:end], normalized_buffer[:end]
+            for offset, student_id in enumerate(appended):
+                rows[student_id] = total + offset
+                student_ids.append(student_id)
+                names.append(upserts[student_id][0])
+            dead = np.concatenate([dead, np.zeros(len(vectors), dtype=bool)])
+
+        gallery = Gallery(student_ids, names, embeddings, version, change_id, normalized=normalized)
+        gallery._dead = dead if dead.any() else None
+        gallery._live = len(rows)
+        gallery._rows = rows
+        gallery._buffer, gallery._normalized_buffer = buffer, normalized_buffer
+        return gallery
+
+    def compacted(self) -> "Gallery":
+        """Copy of the gallery holding its live rows only"""
+        student_ids, names, embeddings = self.live_rows()
+        if not len(student_ids):
+            embeddings = np.empty((0, self.embeddings.shape[1]), dtype=np.float32)
+        return Gallery(list(student_ids), list(names), np.array(embeddings, dtype=np.float32), self.version, self.change_id)
+
+    def distances(self, embedding: np.ndarray, distance_metric: str = "cosine") -> np.ndarray:
+        """
+        Distance between one probe embedding and every gallery entry
+
+        Args:
+            embedding (np.ndarray): Probe embedding
+            distance_metric (str): "cosine" or "euclidean"
+
+        Returns:
+            np.ndarray: One distance per gallery entry
+        """
+        embedding = np.asarray(embedding, dtype=np.float32)
+        if distance_metric == "cosine":
+            norm = np.linalg.norm(embedding)
+            distances = 1 - self._normalized @ (embedding / (norm if norm else 1))
+        elif distance_metric == "euclidean":
+            distances = np.linalg.norm(self.embeddings - embedding, axis=1)
+        else:
+            raise ValueError(f"Unsupported distance metric: {distance_metric}")
+        if self._dead is not None:
+            distances[self._dead] = np.inf
+        return distances
+
+    def best_match(self, embedding: np.ndarray, distance_metric: str = "cosine") -> Tuple[Optional[int], float]:
+        """
+        Closest gallery entry for a probe embedding
+
+        Returns:
+            tuple: (index of the best entry or None if the gallery is empty, distance)
+        """
+        if not len(self):
+            return None, float('inf')
+        distances = self.distances(embedding, distance_metric)
+        index = int(np.argmin(distances))
+        return index, float(distances[index])
+
+    def top_two(self, embedding: np.ndarray, distance_metric: str = "cosine") -> Tuple[Optional[int], float, float]:
+        """
+        Closest gallery entry and the distance to the runner-up, whose gap
+        tells how safe the match is
+
+        Returns:
+            tuple: (index of the best entry or None if empty, best distance, second best distance or inf)
+        """
+        if not len(self):
+            return None, float('inf'), float('inf')
+        distances = self.distances(embedding, distance_metric)
+        if len(distances) == 1:
+            return 0, float(distances[0]), float('inf')
+        first, second = np.argpartition(distances, 1)[:2]
+        if distances[second] < distances[first]:
+            first, second = second, first
+        return int(first), float(distances[first]), float(distances[second])
+
+    def top_k(self, probes: np.ndarray, k: int = 1, distance_metric: str = "cosine") -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Closest gallery entries of a batch of probes, in one matrix product
+
+        Args:
+            probes (np.ndarray): (n, dimension) probe embeddings
+            k (int): Entries returned per probe, capped at the gallery size
+
+        Returns:
+            tuple: ((n, k) gallery indices, (n, k) distances), closest first
+        """
+        probes = np.asarray(probes, dtype=np.float32)
+        k = min(k, len(self))
+        if not k:
+            return np.empty((len(probes), 0), dtype=np.int64), np.empty((len(probes), 0), dtype=np.float32)
+        if distance_metric == "cosine":
+            norms = np.linalg.norm(probes, axis=1, keepdims=True)
+            distances = 1 - (probes / np.where(norms == 0, 1, norms)) @ self._normalized.T
+        elif distance_metric == "euclidean":
+            # |p - g|^2 = |p|^2 + |g|^2 - 2 p.g, without an (n, m, dimension) difference tensor
+            squared = (
+                np.sum(probes ** 2, axis=1, keepdims=True)
+                + np.sum(self.embeddings ** 2, axis=1)
+                - 2 * probes @ self.embeddings.T
+            )
+            distances = np.sqrt(np.maximum(squared, 0))
+        else:
+            raise ValueError(f"Unsupported distance metric: {distance_metric}")
+        if self._dead is not None:
+            distances[:, self._dead] = np.inf
+        indices = np.argpartition(distances, k - 1, axis=1)[:, :k]
+        nearest = np.take_along_axis(distances, indices, axis=1)
+        order = np.argsort(nearest, axis=1)
+        return np.take_along_axis(indices, order, axis=1), np.take_along_axis(nearest, order, axis=1)
+
+    def __contains__(self, student_id: int) -> bool:
+        if self._id_set is None:
+            self._id_set = frozenset(self.student_ids)
+        return student_id in self._id_set
+
+    def subset(self, student_ids) -> "Gallery":
+        """Gallery restricted to the given student IDs, sharing this gallery's version. Dead rows have no ID and are left out."""
+        wanted = set(student_ids)
+        indices = [i for i, student_id in enumerate(self.student_ids) if student_id in wanted]
+        return Gallery(
+            [self.student_ids[i] for i in indices],
+            [self.names[i] for i in indices],
+            self.embeddings[indices] if indices else np.empty((0, self.embeddings.shape[1]), dtype=np.float32),
+            self.version
+        )
+
+
+def _read_embeddings(cursor, model: str, student_ids: Optional[List[int]] = None) -> List[Tuple[int, str, np.ndarray]]:
+    """
+    (student ID, name, embedding) of every student with an embedding by
+    `model`, or of the given students only. Unparsable encodings are skipped.
+    """
+    if model == PRIMARY_MODEL:
+        query = """
+            SELECT f.studentid, s.name, f.faceencoding
+            FROM faceencoding f
+            JOIN student s ON s.studentid = f.studentid
+            WHERE TRUE
+        """
+        params: Tuple = ()
+    else:
+        cursor.execute(CREATE_FACEENCODING_MODEL_TABLE)
+        query = """
+            SELECT f.studentid, s.name, f.faceencoding
+            FROM faceencoding_model f
+            JOIN student s ON s.studentid = f.studentid
+            WHERE f.model = %s
+        """
+        params = (model,)
+    if student_ids is not None:
+        query += f" AND f.studentid IN ({', '.join(['%s'] * len(student_ids))})"
+        params += tuple(student_ids)
+    cursor.execute(query, params)
+
+    rows = []
+    for row in cursor.fetchall():
+        try:
+            embedding = np.array(json.loads(row['faceencoding']), dtype=np.float32).flatten()
+        except (json.JSONDecodeError, TypeError, ValueError) as e:
+            logger.warning(f"Skipping face encoding of student {row['studentid']}: {e}")
+            continue
+        rows.append((row['studentid'], row['name'], embedding))
+    return rows
+
+
+def _last_change_id(cursor) -> int:
+    cursor.execute(CREATE_FACEENCODING_CHANGE_TABLE)
+    cursor.execute("SELECT MAX(changeid) AS last FROM faceencoding_change")
+    row = cursor.fetchone()
+    return (row['last'] if row else None) or 0
+
+
+def load_gallery_from_db(version: int = 0, model: str = PRIMARY_MODEL) -> Gallery:
+    """
+    Load every face encoding joined with its student name from the database.
+
+    Args:
+        version (int): Version number stamped on the returned gallery
+        model (str): Embedding model, PRIMARY_MODEL reads the faceencoding
+                     table, any other model the faceencoding_model table
+
+    Returns:
+        Gallery: Gallery holding one row per enrolled student
+    """
+    conn = get_db_connection()
+    cursor = conn.cursor(cursor_factory=RealDictCursor)
+    try:
+        with stage_timer("db_io"):
+            # Read before the rows: a change committed in between is applied again by the next sync
+            change_id = _last_change_id(cursor)
+            rows = _read_embeddings(cursor, model)
+        conn.commit()
+    finally:
+        cursor.close()
+        conn.close()
+
+    student_ids = [student_id for student_id, _, _ in rows]
+    names = [name for _, name, _ in rows]
+    if rows:
+        matrix = np.vstack([embedding for _, _, embedding in rows])
+    else:
+        matrix = np.empty((0, EMBEDDING_DIMENSIONS.get(model, 0)), dtype=np.float32)
+    return Gallery(student_ids, names, matrix, version, change_id)
+
+
+def load_gallery_changes(
+    model: str,
+    since: int
+) -> Tuple[int, Dict[int, Tuple[str, np.ndarray]], List[int]]:
+    """
+    Students whose `model` embedding changed after change `since`, read back
+    from the embedding tables
+
+    Returns:
+        tuple: (last change ID, {student ID: (name, embedding)} of the current
+            rows, IDs of the changed students that no longer have one)
+    """
+    conn = get_db_connection()
+    cursor = conn.cursor(cursor_factory=RealDictCursor)
+    try:
+        with stage_timer("db_io"):
+            change_id = _last_change_id(cursor)
+            if change_id <= since:
+                conn.commit()
+                return change_id, {}, []
+            cursor.execute(
+                "SELECT DISTINCT studentid FROM faceencoding_change WHERE model = %s AND changeid > %s",
+                (model, max(since - CHANGE_LOOKBACK, 0))
+            )
+            changed = [row['studentid'] for row in cursor.fetchall()]
+            rows = _read_embeddings(cursor, model, changed) if changed else []
+        conn.commit()
+    finally:
+        cursor.close()
+        conn.close()
+    upserts = {student_id: (name, embedding) for student_id, name, embedding in rows}
+    return change_id, upserts, [student_id for student_id in changed if student_id not in upserts]
+
+
+def record_gallery_change(cursor, student_id: int, model: str = PRIMARY_MODEL) -> None:
+    """Log that a student's embedding by `model` was written or deleted, commit left to the caller."""
+    cursor.execute(CREATE_FACEENCODING_CHANGE_TABLE)
+    cursor.execute("INSERT INTO faceencoding_change (studentid, model) VALUES (%s, %s)", (student_id, model))
+
+
+def save_model_embedding(cursor, student_id: int, model: str, embedding) -> None:
+    """Store (or replace) the embedding of a student by a model other than PRIMARY_MODEL, commit left to the caller."""
+    cursor.execute(CREATE_FACEENCODING_MODEL_TABLE)
+    cursor.execute(UPSERT_MODEL_EMBEDDING, (student_id, model, json.dumps([float(value) for value in embedding])))
+    record_gallery_change(cursor, student_id, model)
+
+
+def sync_gallery(gallery: Gallery, version: int, model: str = PRIMARY_MODEL) -> Gallery:
+    """
+    Bring a cached gallery up to date with the change log: only the changed
+    students are read and applied, the matrix is compacted once too
+    fragmented, and fully reloaded only when the change log cannot tell
+    what changed.
+    """
+    if gallery.change_id is None:
+        GALLERY_SYNC_TOTAL.inc(labels={"model": model, "kind": "full"})
+        return load_gallery_from_db(version, model)
+    change_id, upserts, removed = load_gallery_changes(model, gallery.change_id)
+    if not upserts and not removed and version == gallery.version and change_id == gallery.change_id:
+        return gallery
+    # Past this many changed students, one full read is cheaper than the lookups
+    if len(upserts) + len(removed) > max(CHANGE_LOOKBACK, len(gallery) // 2):
+        GALLERY_SYNC_TOTAL.inc(labels={"model": model, "kind": "full"})
+        return load_gallery_from_db(version, model)
+
+    synced = gallery.apply_changes(upserts, removed, version, change_id)
+    GALLERY_SYNC_TOTAL.inc(labels={"model": model, "kind": "delta"})
+    if synced.fragmentation > GALLERY_MAX_FRAGMENTATION:
+        GALLERY_SYNC_TOTAL.inc(labels={"model": model, "kind": "compaction"})
+        synced = synced.compacted()
+    return synced
+
+
+_galleries: Dict[str, Gallery] = {}
+_gallery_version = 0
+_gallery_lock = threading.Lock()
+_last_sync: Dict[str, float] = {}
+# Models whose next lookup must reload the whole gallery
+_full_reload: set = set()
+
+
+def _sync_due(model: str) -> bool:
+    return bool(GALLERY_SYNC_INTERVAL) and time.monotonic() - _last_sync.get(model, 0.0) > GALLERY_SYNC_INTERVAL
+
+
+def get_gallery(model: str = PRIMARY_MODEL) -> Gallery:
+    """
+    Return the cached gallery of a model, loading it from the database on
+    first use and applying the change log after an invalidation or every
+    GALLERY_SYNC_INTERVAL seconds.
+    """
+    gallery = _galleries.get(model)
+    if gallery is not None and gallery.version == _gallery_version and not _sync_due(model):
+        return gallery
+    with _gallery_lock:
+        gallery = _galleries.get(model)
+        if gallery is None or model in _full_reload:
+            gallery = load_gallery_from_db(_gallery_version, model)
+            _full_reload.discard(model)
+            logger.info(f"Loaded {model} gallery version {gallery.version} with {len(gallery)} faces")
+        elif gallery.version != _gallery_version or _sync_due(model):
+            previous = gallery
+            gallery = sync_gallery(gallery, _gallery_version, model)
+            if gallery.change_id != previous.change_id:
+                logger.info(
+                    f"Synced {model} gallery to change {gallery.change_id}: {len(gallery)} faces, "
+                    f"{gallery.fragmentation:.0%} fragmented"
+                )
+        else:
+            return gallery
+        _galleries[model] = gallery
+        _last_sync[model] = time.monotonic()
+        return gallery
+
+
+# Course ID -> (roster, gallery the subset was taken from, subset)
+_course_galleries: Dict[int, Tuple[frozenset, Gallery, Gallery]] = {}
+
+
+def get_course_gallery(course_id: int, student_ids) -> Gallery:
+    """
+    Gallery holding only the students enrolled in a course, cached until the
+    roster changes or the full gallery is replaced by a reload or a sync.
+    """
+    gallery = get_gallery()
+    roster = frozenset(student_ids)
+    cached = _course_galleries.get(course_id)
+    # A sync returns the same Gallery object when nothing changed, and a new one otherwise
+    if cached is not None and cached[0] == roster and cached[1] is gallery:
+        return cached[2]
+    course_gallery = gallery.subset(roster)
+    _course_galleries[course_id] = (roster, gallery, course_gallery)
+    return course_gallery
+
+
+def invalidate_gallery(full: bool = False) -> None:
+    """
+    Mark the cached galleries as stale so the next lookup syncs them with the
+    change log. full=True reloads them entirely, for edits made to the
+    embedding tables without going through record_gallery_change.
+    """
+    global _gallery_version
+    with _gallery_lock:
+        _gallery_version += 1
+        if full:
+            _full_reload.update(_galleries)
+
+
+def gallery_version() -> int:
+    """Current gallery version, bumped on every invalidation."""
+    return _gallery_version
@@ -0,0 +1,104 @@
+"""
+Startup cost of the API: wall time of importing a module in a fresh
+interpreter, plus the slowest imports reported by python -X importtime.
+
+    python import_time_benchmark.py apiBack
+    python import_time_benchmark.py apiBack --engine deepface --engine dlib
+"""
+import os
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+from typing import Dict, List, Tuple, Any
+
+# Importing the API must not need a database
+ENV = dict(os.environ, DB_BACKEND="local", LOG_LEVEL="WARNING")
+
+
+def import_statement(module: str, engine: str = None) -> str:
+    if engine is None:
+        return f"import {module}"
+    return f"import {module}; import engines; engines.get_engine({engine!r})"
+
+
+def time_import(statement: str, repetitions: int) -> List[float]:
+    """Seconds to run `statement` in a fresh interpreter, interpreter startup excluded."""
+    code = (
+        "import time; _start = time.perf_counter(); "
+        f"{statement}; "
+        "print(time.perf_counter() - _start)"
+    )
+    samples = []
+    for _ in range(repetitions):
+        output = subprocess.run(
+            [sys.executable, "-c", code], env=ENV, capture_output=True, text=True, check=True
+        ).stdout
+        samples.append(float(output.strip().splitlines()[-1]))
+    return samples
+
+
+def _import_times(statement: str) -> Dict[str, float]:
+    stderr = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", statement], env=ENV, capture_output=True, text=True, check=True
+    ).stderr
+    packages: Dict[str, float] = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        if not cumulative.strip().isdigit():
+            continue
+        # Nested imports are indented, only the outermost line carries the whole cost
+        if name.startswith("  "):
+            continue
+        package = name.strip().split(".")[0]
+        packages[package] = packages.get(package, 0.0) + int(cumulative) / 1e6
+    return packages
+
+
+def slowest_imports(statement: str, top: int) -> List[Tuple[str, float]]:
+    """Top-level packages by cumulative import time, from python -X importtime."""
+    # Modules imported by the interpreter itself at startup are not ours to optimize
+    startup = _import_times("pass")
+    packages = {name: seconds for name, seconds in _import_times(statement).items() if name not in startup}
+    return sorted(packages.items(), key=lambda item: item[1], reverse=True)[:top]
+
+
+def run(module: str, engines: List[str], repetitions: int, top: int) -> Dict[str, Any]:
+    cases = [None] + engines
+    report = {}
+    for engine in cases:
+        statement = import_statement(module, engine)
+        samples = time_import(statement, repetitions)
+        report[engine or "api"] = {
+            "statement": statement,
+            "median": statistics.median(samples),
+            "min": min(samples),
+            "max": max(samples),
+            "slowest_imports": slowest_imports(statement, top)
+        }
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Import-time benchmark of the API startup")
+    parser.add_argument("module", nargs="?", default="apiBack")
+    parser.add_argument("--engine", action="append", default=[], choices=["deepface", "dlib"],
+                        help="Also time loading this recognition engine (repeatable)")
+    parser.add_argument("--repetitions", type=int, default=5)
+    parser.add_argument("--top", type=int, default=10, help="Slowest packages to list")
+    parser.add_argument("--output", help="Write the report as JSON")
+    args = parser.parse_args()
+
+    report = run(args.module, args.engine, args.repetitions, args.top)
+    for case, result in report.items():
+        print(f"\n{result['statement']}")
+        print(f"  median {result['median']:.3f}s (min {result['min']:.3f}s, max {result['max']:.3f}s)")
+        for package, seconds in result["slowest_imports"]:
+            print(f"  {package:<30}{seconds:>8.3f}s")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"\nResults saved to {args.output}")
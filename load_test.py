@@ -0,0 +1,271 @@
+import os
+import sys
+import json
+import glob
+import time
+import uuid
+import random
+import socket
+import argparse
+import threading
+import subprocess
+import urllib.error
+import urllib.request
+import concurrent.futures
+from typing import Dict, List, Tuple, Optional
+
+# Images with a single face, usable for enrollment requests
+ENROLLMENT_IMAGES = [
+    "imgTest/victor.jpg", "imgTest/romain.jpg", "imgTest/mathilde.jpg",
+    "imgTest/lilian.jpg", "imgTest/leo.jpg", "imgTest/dimitar.jpg",
+    "imgTest/maxence.jpg", "imgTest/remi.jpg"
+]
+DEFAULT_MIX = "recognize=6,roster=3,enroll=1"
+
+
+def encode_multipart(fields: Dict[str, str], files: Dict[str, Tuple[str, bytes]]) -> Tuple[bytes, str]:
+    """multipart/form-data body and content type, without third-party packages."""
+    boundary = uuid.uuid4().hex
+    parts = []
+    for name, value in fields.items():
+        parts.append(
+            f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode()
+        )
+    for name, (filename, content) in files.items():
+        parts.append(
+            f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"; filename="{filename}"\r\n'
+            f'Content-Type: application/octet-stream\r\n\r\n'.encode() + content + b"\r\n"
+        )
+    parts.append(f"--{boundary}--\r\n".encode())
+    return b"".join(parts), f"multipart/form-data; boundary={boundary}"
+
+
+class LoadTester:
+    def __init__(self, base_url: str, images: List[str], course_id: int, timeout: float):
+        self.base_url = base_url.rstrip("/")
+        self.images = {path: open(path, "rb").read() for path in images}
+        self.enrollment_images = {
+            path: self.images.get(path) or open(path, "rb").read()
+            for path in ENROLLMENT_IMAGES if os.path.exists(path)
+        }
+        self.course_id = course_id
+        self.timeout = timeout
+        # (operation, start time, latency, status or None, error or None)
+        self.samples: List[Tuple[str, float, float, Optional[int], Optional[str]]] = []
+        self._lock = threading.Lock()
+
+    def _request(self, operation: str, method: str, path: str, body: bytes = None, content_type: str = None) -> None:
+        request = urllib.request.Request(self.base_url + path, data=body, method=method)
+        if content_type:
+            request.add_header("Content-Type", content_type)
+        start = time.perf_counter()
+        status, error = None, None
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                response.read()
+                status = response.status
+        except urllib.error.HTTPError as e:
+            status, error = e.code, f"HTTP {e.code}"
+        except Exception as e:
+            error = type(e).__name__
+        latency = time.perf_counter() - start
+        with self._lock:
+            self.samples.append((operation, start, latency, status, error))
+
+    def recognize(self) -> None:
+        path, content = random.choice(list(self.images.items()))
+        body, content_type = encode_multipart({}, {"file": (os.path.basename(path), content)})
+        self._request("recognize", "POST", "/recognize_faces/", body, content_type)
+
+    def enroll(self) -> None:
+        path, content = random.choice(list(self.enrollment_images.items()))
+        body, content_type = encode_multipart(
+            {"name": f"loadtest-{uuid.uuid4().hex[:12]}"},
+            {"file": (os.path.basename(path), content)}
+        )
+        self._request("enroll", "POST", "/add_face/", body, content_type)
+
+    def roster(self) -> None:
+        self._request("roster", "GET", f"/courses/{self.course_id}")
+
+    def run_operation(self, operation: str) -> None:
+        getattr(self, operation)()
+
+
+def parse_mix(mix: str) -> Dict[str, float]:
+    weights = {}
+    for item in mix.split(","):
+        name, _, weight = item.partition("=")
+        if name not in ("recognize", "enroll", "roster"):
+            raise ValueError(f"Unknown operation in mix: {name}")
+        weights[name] = float(weight or 1)
+    return weights
+
+
+def run_closed_loop(tester: LoadTester, mix: Dict[str, float], concurrency: int, duration: float) -> None:
+    """`concurrency` clients, each sending its next request as soon as the previous one returns."""
+    deadline = time.perf_counter() + duration
+    operations, weights = list(mix), list(mix.values())
+
+    def client():
+        while time.perf_counter() < deadline:
+            tester.run_operation(random.choices(operations, weights)[0])
+
+    threads = [threading.Thread(target=client, daemon=True) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+def run_open_loop(tester: LoadTester, mix: Dict[str, float], rate: float, duration: float, max_inflight: int) -> int:
+    """
+    Poisson arrivals at `rate` requests per second, independent of response times.
+
+    Returns:
+        int: Arrivals dropped because max_inflight requests were already pending
+    """
+    operations, weights = list(mix), list(mix.values())
+    inflight = threading.Semaphore(max_inflight)
+    dropped = 0
+
+    def send(operation):
+        try:
+            tester.run_operation(operation)
+        finally:
+            inflight.release()
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_inflight) as executor:
+        start = time.perf_counter()
+        next_arrival = start
+        while next_arrival < start + duration:
+            delay = next_arrival - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            if inflight.acquire(blocking=False):
+                executor.submit(send, random.choices(operations, weights)[0])
+            else:
+                dropped += 1
+            next_arrival += random.expovariate(rate)
+    return dropped
+
+
+def percentile(values: List[float], q: float) -> float:
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    index = (len(ordered) - 1) * q / 100
+    lower = int(index)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (index - lower)
+
+
+def report(samples: List[Tuple], elapsed: float, dropped: int = 0) -> Dict:
+    """Throughput, latency percentiles and error rate, overall and per operation."""
+    def summarize(rows):
+        latencies = [row[2] for row in rows]
+        errors = sum(1 for row in rows if row[4] is not None or (row[3] or 0) >= 400)
+        return {
+            "requests": len(rows),
+            "throughput_rps": len(rows) / elapsed if elapsed else 0.0,
+            "p50": percentile(latencies, 50),
+            "p95": percentile(latencies, 95),
+            "p99": percentile(latencies, 99),
+            "error_rate": errors / len(rows) if rows else 0.0
+        }
+
+    result = {"elapsed_seconds": elapsed, "dropped": dropped, "overall": summarize(samples), "operations": {}}
+    for operation in sorted({row[0] for row in samples}):
+        result["operations"][operation] = summarize([row for row in samples if row[0] == operation])
+    errors: Dict[str, int] = {}
+    for row in samples:
+        if row[4] is not None:
+            errors[row[4]] = errors.get(row[4], 0) + 1
+    result["errors"] = errors
+    return result
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def spawn_local_server(port: int, server_mode: str = "flask", workers: int = 1) -> subprocess.Popen:
+    """Start the API on the SQLite stand-in database and wait until it answers."""
+    # No debug reloader: it would fork a second server the harness cannot stop
+    env = dict(os.environ, DB_BACKEND="local", API_PORT=str(port), FLASK_DEBUG="0", LOG_LEVEL="WARNING")
+    if server_mode == "asgi":
+        command = [sys.executable, "serve.py", "--workers", str(workers)]
+    else:
+        command = [sys.executable, "apiBack.py"]
+    server = subprocess.Popen(command, env=env)
+    deadline = time.time() + 300
+    while time.time() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError("Local API server exited during startup")
+        try:
+            urllib.request.urlopen(f"http://127.0.0.1:{port}/metrics", timeout=1).read()
+            return server
+        except Exception:
+            time.sleep(0.5)
+    server.terminate()
+    raise RuntimeError("Local API server did not start in time")
+
+
+def print_report(result: Dict) -> None:
+    print(f"\nElapsed: {result['elapsed_seconds']:.1f}s, dropped arrivals: {result['dropped']}")
+    print(f"{'operation':<12}{'requests':>10}{'rps':>10}{'p50':>10}{'p95':>10}{'p99':>10}{'errors':>10}")
+    rows = list(result["operations"].items()) + [("overall", result["overall"])]
+    for name, stats in rows:
+        print(f"{name:<12}{stats['requests']:>10}{stats['throughput_rps']:>10.2f}"
+              f"{stats['p50']:>10.3f}{stats['p95']:>10.3f}{stats['p99']:>10.3f}{stats['error_rate']:>10.1%}")
+    if result["errors"]:
+        print(f"Errors: {result['errors']}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load test of the attendance API")
+    parser.add_argument("--url", help="API to test, defaults to a local server started on a stub database")
+    parser.add_argument("--server", choices=["flask", "asgi"], default="flask", help="Local server to start")
+    parser.add_argument("--workers", type=int, default=1, help="Worker processes of a local ASGI server")
+    parser.add_argument("--mode", choices=["closed", "open"], default="closed")
+    parser.add_argument("--concurrency", type=int, default=4, help="Clients in closed-loop mode")
+    parser.add_argument("--rate", type=float, default=2.0, help="Arrivals per second in open-loop mode")
+    parser.add_argument("--max-inflight", type=int, default=256, help="Pending requests allowed in open-loop mode")
+    parser.add_argument("--duration", type=float, default=60.0, help="Seconds of load")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="Weighted operations, e.g. recognize=6,roster=3,enroll=1")
+    parser.add_argument("--images", nargs="+", default=sorted(glob.glob("imgTest/*.jpg")))
+    parser.add_argument("--course-id", type=int, default=1)
+    parser.add_argument("--timeout", type=float, default=120.0)
+    parser.add_argument("--output", help="Write the report as JSON")
+    args = parser.parse_args()
+
+    mix = parse_mix(args.mix)
+    server = None
+    if args.url is None:
+        port = free_port()
+        print(f"Starting a local {args.server} API server on port {port} with the stub database...")
+        server = spawn_local_server(port, args.server, args.workers)
+        args.url = f"http://127.0.0.1:{port}"
+    elif "enroll" in mix:
+        print("Warning: enrollment requests write loadtest-* students to the target database")
+
+    try:
+        tester = LoadTester(args.url, args.images, args.course_id, args.timeout)
+        start = time.perf_counter()
+        dropped = 0
+        if args.mode == "closed":
+            run_closed_loop(tester, mix, args.concurrency, args.duration)
+        else:
+            dropped = run_open_loop(tester, mix, args.rate, args.duration, args.max_inflight)
+        result = report(tester.samples, time.perf_counter() - start, dropped)
+        result["config"] = vars(args)
+        print_report(result)
+        if args.output:
+            with open(args.output, "w") as f:
+                json.dump(result, f, indent=2)
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
@@ -0,0 +1,170 @@
+"""
+SQLite stand-in for the PostgreSQL database, used by the benchmarks and
+load tests so they run offline. Selected with DB_BACKEND=local.
+
+Only the subset of psycopg2 used by this project is emulated: %s
+placeholders, RealDictCursor-style rows, named cursors (read in one go)
+and execute_values batches.
+"""
+import os
+import re
+import csv
+import json
+import sqlite3
+import logging
+import threading
+from typing import Any, Iterable, List, Optional, Sequence
+
+logger = logging.getLogger(__name__)
+
+# ":memory:" is shared by every connection of the process
+LOCAL_DB_PATH = os.getenv("LOCAL_DB_PATH", ":memory:")
+LOCAL_DB_SEED_CSV = os.getenv("LOCAL_DB_SEED_CSV", "faceEncodingDeepface.csv")
+
+SCHEMA = """
+    CREATE TABLE IF NOT EXISTS teacher (
+        teacherid INTEGER PRIMARY KEY,
+        name TEXT NOT NULL,
+        username TEXT UNIQUE NOT NULL,
+        password TEXT NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS student (
+        studentid INTEGER PRIMARY KEY,
+        name TEXT NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS course (
+        courseid INTEGER PRIMARY KEY,
+        teacherid INTEGER NOT NULL REFERENCES teacher(teacherid),
+        subject TEXT NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS studentcourses (
+        studentid INTEGER NOT NULL REFERENCES student(studentid),
+        courseid INTEGER NOT NULL REFERENCES course(courseid),
+        PRIMARY KEY (studentid, courseid)
+    );
+    CREATE TABLE IF NOT EXISTS faceencoding (
+        studentid INTEGER PRIMARY KEY REFERENCES student(studentid),
+        faceencoding TEXT NOT NULL
+    );
+"""
+
+_PLACEHOLDER = re.compile(r"%s")
+_SERIAL = re.compile(r"\bSERIAL PRIMARY KEY\b", re.IGNORECASE)
+
+_keeper: Optional[sqlite3.Connection] = None
+_init_lock = threading.Lock()
+
+
+def _translate(query: str) -> str:
+    return _SERIAL.sub("INTEGER PRIMARY KEY", _PLACEHOLDER.sub("?", query))
+
+
+class LocalCursor:
+    def __init__(self, conn: sqlite3.Connection, dict_rows: bool):
+        self._cursor = conn.cursor()
+        self._dict_rows = dict_rows
+        # Accepted for compatibility with psycopg2 named cursors
+        self.itersize = 2000
+
+    def _row(self, row: Sequence) -> Any:
+        if row is None or not self._dict_rows:
+            return row if row is None else tuple(row)
+        return {column[0]: value for column, value in zip(self._cursor.description, row)}
+
+    def execute(self, query: str, params: Sequence = ()) -> None:
+        query = _translate(query)
+        if query.strip().upper().startswith("CREATE") and ";" in query.strip().rstrip(";"):
+            self._cursor.executescript(query)
+        else:
+            self._cursor.execute(query, tuple(params))
+
+    def execute_values(self, query: str, rows: Iterable[Sequence], page_size: int = 100) -> None:
+        """Equivalent of psycopg2.extras.execute_values for a single VALUES %s"""
+        rows = list(rows)
+        if not rows:
+            return
+        row_template = "(" + ", ".join(["?"] * len(rows[0])) + ")"
+        head, tail = query.split("%s", 1)
+        head, tail = _translate(head), _translate(tail)
+        for start in range(0, len(rows), page_size):
+            page = rows[start:start + page_size]
+            values = ", ".join([row_template] * len(page))
+            self._cursor.execute(head + values + tail, [value for row in page for value in row])
+
+    def fetchone(self) -> Any:
+        return self._row(self._cursor.fetchone())
+
+    def fetchall(self) -> List[Any]:
+        return [self._row(row) for row in self._cursor.fetchall()]
+
+    def __iter__(self):
+        for row in self._cursor:
+            yield self._row(row)
+
+    @property
+    def rowcount(self) -> int:
+        return self._cursor.rowcount
+
+    def close(self) -> None:
+        self._cursor.close()
+
+
+class LocalConnection:
+    def __init__(self, conn: sqlite3.Connection):
+        self._conn = conn
+
+    def cursor(self, name: Optional[str] = None, cursor_factory=None) -> LocalCursor:
+        return LocalCursor(self._conn, dict_rows=cursor_factory is not None)
+
+    def commit(self) -> None:
+        self._conn.commit()
+
+    def rollback(self) -> None:
+        self._conn.rollback()
+
+    def close(self) -> None:
+        self._conn.close()
+
+
+def _sqlite_connect() -> sqlite3.Connection:
+    if LOCAL_DB_PATH == ":memory:":
+        return sqlite3.connect("file:local_db?mode=memory&cache=shared", uri=True, check_same_thread=False)
+    return sqlite3.connect(LOCAL_DB_PATH, check_same_thread=False)
+
+
+def seed_from_csv(conn: sqlite3.Connection, csv_path: str = LOCAL_DB_SEED_CSV) -> int:
+    """
+    Fill an empty database with the students of an embedding CSV
+    (name, embedding_0..N) plus one teacher and one course holding them all.
+
+    Returns:
+        int: Number of students inserted
+    """
+    if conn.execute("SELECT COUNT(*) FROM student").fetchone()[0]:
+        return 0
+    conn.execute("INSERT INTO teacher (teacherid, name, username, password) VALUES (1, 'Local Teacher', 'teacher', 'teacher')")
+    conn.execute("INSERT INTO course (courseid, teacherid, subject) VALUES (1, 1, 'Local Course')")
+    count = 0
+    if os.path.exists(csv_path):
+        with open(csv_path, newline="", encoding="utf-8") as f:
+            for student_id, row in enumerate(csv.DictReader(f), start=1):
+                embedding = [float(row[key]) for key in row if key.startswith("embedding_")]
+                conn.execute("INSERT INTO student (studentid, name) VALUES (?, ?)", (student_id, row["name"]))
+                conn.execute("INSERT INTO faceencoding (studentid, faceencoding) VALUES (?, ?)", (student_id, json.dumps(embedding)))
+                conn.execute("INSERT INTO studentcourses (studentid, courseid) VALUES (?, 1)", (student_id,))
+                count += 1
+    conn.commit()
+    logger.info(f"Seeded local database with {count} students from {csv_path}")
+    return count
+
+
+def connect() -> LocalConnection:
+    """Open a connection to the local database, creating and seeding it on first use."""
+    global _keeper
+    with _init_lock:
+        if _keeper is None:
+            # Keeps the shared in-memory database alive between connections
+            _keeper = _sqlite_connect()
+            _keeper.executescript(SCHEMA)
+            seed_from_csv(_keeper)
+    return LocalConnection(_sqlite_connect())
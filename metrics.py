@@ -0,0 +1,225 @@
+import time
+import threading
+import contextvars
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Tuple
+
+# Latency buckets in seconds, from a cache hit up to a crowded lecture photo
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+
+def _label_key(labels: Optional[Dict[str, str]]) -> LabelKey:
+    return tuple(sorted((labels or {}).items()))
+
+
+def _format_labels(key: LabelKey, extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = list(key) + ([extra] if extra else [])
+    if not pairs:
+        return ""
+    escaped = [(k, str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")) for k, v in pairs]
+    return "{" + ",".join(f'{k}="{v}"' for k, v in escaped) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value))
+
+
+class Counter:
+    def __init__(self, name: str, documentation: str):
+        self.name = name
+        self.documentation = documentation
+        self._values: Dict[LabelKey, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0, labels: Optional[Dict[str, str]] = None) -> None:
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, labels: Optional[Dict[str, str]] = None) -> float:
+        with self._lock:
+            return self._values.get(_label_key(labels), 0.0)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(key)} {_format_value(value)}")
+        return lines
+
+
+class Gauge:
+    def __init__(self, name: str, documentation: str):
+        self.name = name
+        self.documentation = documentation
+        self._values: Dict[LabelKey, float] = {}
+        self._lock = threading.Lock()
+
+    def set(self, value: float, labels: Optional[Dict[str, str]] = None) -> None:
+        with self._lock:
+            self._values[_label_key(labels)] = float(value)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} gauge"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(key)} {_format_value(value)}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, documentation: str, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+        # labels -> (per-bucket counts, sum, count)
+        self._series: Dict[LabelKey, Tuple[List[int], float, int]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, labels: Optional[Dict[str, str]] = None) -> None:
+        key = _label_key(labels)
+        with self._lock:
+            counts, total, count = self._series.get(key, ([0] * len(self.buckets), 0.0, 0))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            self._series[key] = (counts, total + value, count + 1)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, (counts, total, count) in sorted(self._series.items()):
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets, counts):
+                    cumulative += bucket_count
+                    labels = _format_labels(key, ("le", _format_value(bound)))
+                    lines.append(f"{self.name}_bucket{labels} {cumulative}")
+                lines.append(f"{self.name}_sum{_format_labels(key)} {_format_value(total)}")
+                lines.append(f"{self.name}_count{_format_labels(key)} {count}")
+        return lines
+
+
+_registry: List = []
+
+
+def register(metric):
+    _registry.append(metric)
+    return metric
+
+
+STAGE_SECONDS = register(Histogram(
+    "recognition_stage_seconds",
+    "Time spent in each stage of the recognition pipeline."
+))
+REQUESTS_TOTAL = register(Counter(
+    "recognition_requests_total",
+    "Recognition requests by endpoint and outcome."
+))
+FACES_TOTAL = register(Counter(
+    "recognition_faces_total",
+    "Faces processed by the recognition pipeline, by result."
+))
+CASCADE_FACES_TOTAL = register(Counter(
+    "recognition_cascade_faces_total",
+    "Faces of the model cascade, by the stage that resolved them."
+))
+ATTENDANCE_REJECTED_TOTAL = register(Counter(
+    "attendance_rows_rejected_total",
+    "Attendance rows dropped because they violate a constraint of the attendance table."
+))
+GALLERY_SYNC_TOTAL = register(Counter(
+    "gallery_sync_total",
+    "Updates of the cached galleries, by model and kind (full, delta, compaction)."
+))
+CAMERA_FRAMES_TOTAL = register(Counter(
+    "camera_frames_total",
+    "Frames of scheduled cameras, by camera and outcome."
+))
+CAMERA_TARGET_FPS = register(Gauge(
+    "camera_target_fps",
+    "Frame rate the scheduler currently grants each camera."
+))
+CAMERA_LAG_SECONDS = register(Gauge(
+    "camera_lag_seconds",
+    "Time from the capture of a camera's last processed frame to its result."
+))
+CAMERA_SCHEDULE_DELAY_SECONDS = register(Gauge(
+    "camera_schedule_delay_seconds",
+    "How late the last frame of a camera was submitted compared with its rate."
+))
+
+# Stage durations of the request being served, read by the capture and profiling tools
+_request_stages: contextvars.ContextVar = contextvars.ContextVar("request_stages", default=None)
+
+
+def start_request() -> Dict[str, float]:
+    """Start collecting the stage timings of the current request."""
+    stages: Dict[str, float] = {}
+    _request_stages.set(stages)
+    return stages
+
+
+def request_stages() -> Dict[str, float]:
+    """Stage timings collected since start_request(), empty outside a request."""
+    return dict(_request_stages.get() or {})
+
+
+@contextmanager
+def stage_timer(stage: str):
+    """
+    Time a block as one pipeline stage
+
+    Usage:
+        with stage_timer("embedding"):
+            ...
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        STAGE_SECONDS.observe(elapsed, {"stage": stage})
+        stages = _request_stages.get()
+        if stages is not None:
+            stages[stage] = stages.get(stage, 0.0) + elapsed
+
+
+def render_prometheus() -> str:
+    """Every registered metric in the Prometheus text exposition format."""
+    lines: List[str] = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self) -> None:
+        if self.path.split("?", 1)[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = render_prometheus().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format: str, *args) -> None:
+        # Scrapes every few seconds would flood the log
+        pass
+
+
+def start_metrics_server(port: int, host: str = "0.0.0.0") -> ThreadingHTTPServer:
+    """
+    Serve /metrics on a background thread, for processes without the API
+    (camera_scheduler.py). Returns the server, shutdown() stops it.
+    """
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    return server
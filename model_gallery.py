@@ -0,0 +1,86 @@
+"""
+Fill the gallery of a secondary embedding model (faceencoding_model) from
+photos of students already enrolled, for the model cascade.
+
+    python model_gallery.py --model SFace imgTest/victor.jpg=Victor imgTest/romain.jpg=Romain
+    python model_gallery.py --model SFace --images-dir photos/    # file name = student name
+
+Running API processes load the new gallery after their next invalidation
+(an enrollment) or restart.
+"""
+import os
+import sys
+import argparse
+import logging
+from typing import Dict
+
+from psycopg2.extras import RealDictCursor
+
+from db import get_db_connection
+from gallery import save_model_embedding, invalidate_gallery
+
+logger = logging.getLogger(__name__)
+
+
+def enroll_model_embeddings(model: str, images: Dict[str, str], detector_backend: str = "retinaface") -> Dict[str, str]:
+    """
+    Embed each student's photo with `model` and store it in faceencoding_model
+
+    Args:
+        model (str): DeepFace model name
+        images (dict): Student name -> image path
+
+    Returns:
+        dict: Student name -> "ok" or the reason it was skipped
+    """
+    from face_lookalike_deepface import get_face_embedding
+
+    outcome = {}
+    conn = get_db_connection()
+    cursor = conn.cursor(cursor_factory=RealDictCursor)
+    try:
+        for name, image_path in images.items():
+            cursor.execute("SELECT studentid FROM student WHERE name = %s", (name,))
+            student = cursor.fetchone()
+            if student is None:
+                outcome[name] = "not enrolled"
+                continue
+            try:
+                embedding = get_face_embedding(image_path, model_name=model, detector_backend=detector_backend)
+            except Exception as e:
+                outcome[name] = f"no embedding: {str(e)}"
+                continue
+            save_model_embedding(cursor, student['studentid'], model, embedding)
+            outcome[name] = "ok"
+        conn.commit()
+    finally:
+        cursor.close()
+        conn.close()
+    invalidate_gallery()
+    return outcome
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fill the gallery of a secondary embedding model")
+    parser.add_argument("images", nargs="*", metavar="PATH=NAME", help="Photo of an enrolled student")
+    parser.add_argument("--model", default=os.getenv("CASCADE_MODEL", "SFace"))
+    parser.add_argument("--images-dir", help="Directory of photos named after the students")
+    parser.add_argument("--detector", default="retinaface")
+    args = parser.parse_args()
+
+    images = {}
+    for item in args.images:
+        path, _, name = item.partition("=")
+        images[name or os.path.splitext(os.path.basename(path))[0]] = path
+    if args.images_dir:
+        for filename in sorted(os.listdir(args.images_dir)):
+            images[os.path.splitext(filename)[0]] = os.path.join(args.images_dir, filename)
+    if not images:
+        parser.error("No images given")
+
+    outcome = enroll_model_embeddings(args.model, images, args.detector)
+    for name, status in outcome.items():
+        print(f"{name}: {status}")
+    stored = sum(1 for status in outcome.values() if status == "ok")
+    print(f"\nStored {stored}/{len(outcome)} {args.model} embeddings")
+    sys.exit(0 if stored else 1)
@@ -0,0 +1,158 @@
+import json
+import base64
+import uuid
+import logging
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from psycopg2.extras import RealDictCursor
+
+from db import get_db_connection
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+# Rows fetched per round trip by the server-side cursor
+STREAM_ITERSIZE = 2000
+
+
+def encode_cursor(values: Tuple) -> str:
+    """Opaque cursor from the sort key of the last row of a page."""
+    return base64.urlsafe_b64encode(json.dumps(list(values)).encode()).decode()
+
+
+def decode_cursor(cursor: str) -> List[Any]:
+    """
+    Sort key encoded by encode_cursor
+
+    Raises:
+        ValueError: If the cursor is malformed
+    """
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except Exception:
+        raise ValueError("Invalid cursor")
+    if not isinstance(values, list):
+        raise ValueError("Invalid cursor")
+    return values
+
+
+def parse_page_size(value: Optional[str]) -> Optional[int]:
+    """
+    Validate the `limit` query parameter
+
+    Raises:
+        ValueError: If the limit is not a positive integer
+    """
+    if value is None:
+        return None
+    try:
+        limit = int(value)
+    except ValueError:
+        raise ValueError("limit must be an integer")
+    if limit <= 0:
+        raise ValueError("limit must be positive")
+    return min(limit, MAX_PAGE_SIZE)
+
+
+def _keyset_query(
+    query: str,
+    key_columns: Tuple[str, ...],
+    limit: int,
+    after: Optional[str]
+) -> Tuple[str, Tuple]:
+    """SQL and parameters of one page, with one extra row that tells whether another page exists."""
+    params: List[Any] = []
+    if after:
+        values = decode_cursor(after)
+        if len(values) != len(key_columns):
+            raise ValueError("Invalid cursor")
+        query += f" WHERE ({', '.join(key_columns)}) > ({', '.join(['%s'] * len(values))})"
+        params.extend(values)
+    query += f" ORDER BY {', '.join(key_columns)} LIMIT %s"
+    params.append(limit + 1)
+    return query, tuple(params)
+
+
+def _split_page(
+    rows: List[Dict[str, Any]],
+    key_fields: Tuple[str, ...],
+    limit: int
+) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(tuple(rows[-1][field] for field in key_fields))
+    return rows, next_cursor
+
+
+def fetch_page(
+    query: str,
+    key_columns: Tuple[str, ...],
+    key_fields: Tuple[str, ...],
+    limit: int,
+    after: Optional[str] = None
+) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+    """
+    Fetch one page of a keyset-paginated query
+
+    Args:
+        query (str): SELECT without WHERE/ORDER BY/LIMIT, may end with a JOIN
+        key_columns (tuple): SQL expressions of the sort key, unique together
+        key_fields (tuple): Names of the same columns in the result rows
+        limit (int): Page size
+        after (str): Cursor returned with the previous page
+
+    Returns:
+        tuple: (rows, cursor of the next page or None on the last page)
+    """
+    page_query, params = _keyset_query(query, key_columns, limit, after)
+
+    conn = get_db_connection()
+    cursor = conn.cursor(cursor_factory=RealDictCursor)
+    try:
+        cursor.execute(page_query, params)
+        rows = cursor.fetchall()
+    finally:
+        cursor.close()
+        conn.close()
+
+    return _split_page(rows, key_fields, limit)
+
+
+async def fetch_page_async(
+    query: str,
+    key_columns: Tuple[str, ...],
+    key_fields: Tuple[str, ...],
+    limit: int,
+    after: Optional[str] = None
+) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+    """fetch_page on the async connection pool of async_db"""
+    import async_db
+    page_query, params = _keyset_query(query, key_columns, limit, after)
+    return _split_page(await async_db.fetch(page_query, *params), key_fields, limit)
+
+
+def iter_rows(query: str, params: Tuple = ()) -> Iterator[Dict[str, Any]]:
+    """
+    Iterate over a query through a server-side named cursor, so only
+    STREAM_ITERSIZE rows are held in memory at a time.
+    """
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor(name=f"stream_{uuid.uuid4().hex}", cursor_factory=RealDictCursor)
+        cursor.itersize = STREAM_ITERSIZE
+        try:
+            cursor.execute(query, params)
+            for row in cursor:
+                yield row
+        finally:
+            cursor.close()
+    finally:
+        conn.close()
+
+
+def iter_ndjson(rows: Iterator[Dict[str, Any]]) -> Iterator[str]:
+    """Serialize rows as newline-delimited JSON, one row per line."""
+    for row in rows:
+        yield json.dumps(row, default=str) + "\n"
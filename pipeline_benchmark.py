@@ -0,0 +1,351 @@
+import os
+# Benchmarks run offline against the SQLite stand-in unless told otherwise
+os.environ.setdefault("DB_BACKEND", "local")
+
+import sys
+import json
+import time
+import platform
+import argparse
+import tempfile
+import subprocess
+from datetime import datetime
+from typing import Callable, Dict, List, Any, Tuple
+
+import numpy as np
+
+from metrics import start_request, request_stages
+from gallery import Gallery, load_gallery_from_db, invalidate_gallery
+
+IMAGES = {
+    "single": "imgTest/lilian.jpg",
+    "class": "imgTest/class.jpg",
+    "classroom": "imgTest/classroom.jpg",
+}
+
+# Known faces enrolled in the CSV gallery of the dlib engine
+DLIB_GALLERY_IMAGES = {
+    "Victor": "imgTest/victor.jpg", "Romain": "imgTest/romain.jpg",
+    "Mathilde": "imgTest/mathilde.jpg", "Lilian": "imgTest/lilian.jpg",
+    "Leo": "imgTest/leo.jpg", "Dimitar": "imgTest/dimitar.jpg",
+    "Maxence": "imgTest/maxence.jpg", "Rémi": "imgTest/remi.jpg"
+}
+
+SYNTHETIC_GALLERY_SIZES = (1000, 10000)
+
+
+def summarize(samples: List[float]) -> Dict[str, float]:
+    """p50/p95/mean of a list of durations in seconds."""
+    values = np.array(samples, dtype=np.float64)
+    return {
+        "n": int(len(values)),
+        "p50": float(np.percentile(values, 50)),
+        "p95": float(np.percentile(values, 95)),
+        "mean": float(values.mean()),
+        "min": float(values.min()),
+        "max": float(values.max())
+    }
+
+
+def measure(fn: Callable[[], Any], warmup: int, repetitions: int) -> Dict[str, List[float]]:
+    """
+    Run fn warmup + repetitions times and collect the total duration and
+    the per-stage durations recorded by metrics.stage_timer.
+
+    Returns:
+        dict: stage name -> list of durations, "total" included
+    """
+    for _ in range(warmup):
+        fn()
+    samples: Dict[str, List[float]] = {}
+    for _ in range(repetitions):
+        start_request()
+        start = time.perf_counter()
+        fn()
+        elapsed = time.perf_counter() - start
+        samples.setdefault("total", []).append(elapsed)
+        for stage, duration in request_stages().items():
+            samples.setdefault(stage, []).append(duration)
+    return samples
+
+
+def bench_deepface(image_path: str, profile: str, warmup: int, repetitions: int) -> Dict[str, List[float]]:
+    import cv2
+    from engines import recognize
+    img = cv2.imread(image_path)
+    return measure(lambda: recognize(img, engine="deepface", profile=profile), warmup, repetitions)
+
+
+def build_dlib_gallery() -> str:
+    """Enroll DLIB_GALLERY_IMAGES in a temporary CSV gallery for the dlib engine."""
+    from face_lookalike import add_face_to_database
+    database_path = os.path.join(tempfile.mkdtemp(prefix="pipeline_benchmark_"), "facesEncoding.csv")
+    for name, image_path in DLIB_GALLERY_IMAGES.items():
+        add_face_to_database(image_path, name, database_path)
+    return database_path
+
+
+def bench_dlib(image_path: str, database_path: str, profile: str, warmup: int, repetitions: int) -> Dict[str, List[float]]:
+    import cv2
+    from engines import profile_options, downscale
+    from face_lookalike import recognize_facesAPI
+    img = cv2.imread(image_path)
+    options = profile_options("dlib", profile)
+    max_side = options.pop("max_side")
+    # Same steps as engines.recognize, against the temporary CSV gallery
+    return measure(
+        lambda: recognize_facesAPI(downscale(img, max_side)[0], database_path=database_path, **options),
+        warmup,
+        repetitions
+    )
+
+
+def bench_cascade(image_path: str, warmup: int, repetitions: int) -> Tuple[Dict[str, Dict[str, List[float]]], Dict[str, float]]:
+    """
+    Time recognition with and without the model cascade on the same image
+
+    Returns:
+        tuple: ({"primary": samples, "cascade": samples}, summary with the
+                fraction of faces resolved at stage one, the speedup of the
+                median and the share of faces named identically)
+    """
+    import cv2
+    from metrics import CASCADE_FACES_TOTAL
+    from face_lookalike_deepface import recognize_faces_deepface_parralelisation, CASCADE_MODEL
+
+    img = cv2.imread(image_path)
+    primary = measure(lambda: recognize_faces_deepface_parralelisation(img), warmup, repetitions)
+    stage_one = CASCADE_FACES_TOTAL.value({"stage": "1"})
+    stage_two = CASCADE_FACES_TOTAL.value({"stage": "2"})
+    cascade = measure(
+        lambda: recognize_faces_deepface_parralelisation(img, cascade_model=CASCADE_MODEL),
+        warmup,
+        repetitions
+    )
+    stage_one = CASCADE_FACES_TOTAL.value({"stage": "1"}) - stage_one
+    stage_two = CASCADE_FACES_TOTAL.value({"stage": "2"}) - stage_two
+
+    def student_ids(results):
+        return {face["student_id"] for face in results.values() if "student_id" in face}
+
+    primary_names = student_ids(recognize_faces_deepface_parralelisation(img))
+    cascade_names = student_ids(recognize_faces_deepface_parralelisation(img, cascade_model=CASCADE_MODEL))
+    both = primary_names | cascade_names
+    summary = {
+        "stage_one_fraction": stage_one / (stage_one + stage_two) if stage_one + stage_two else 0.0,
+        "speedup": float(np.median(primary["total"]) / np.median(cascade["total"])),
+        "identity_agreement": len(primary_names & cascade_names) / len(both) if both else 1.0
+    }
+    return {"primary": primary, "cascade": cascade}, summary
+
+
+def bench_quality(image_path: str, warmup: int, repetitions: int) -> Tuple[Dict[str, Dict[str, List[float]]], Dict[str, float]]:
+    """
+    Time recognition with and without the quality filter on the same image
+
+    Returns:
+        tuple: ({"unfiltered": samples, "filtered": samples}, summary with
+                the faces embedded in each mode and the embedding time saved)
+    """
+    import cv2
+    from metrics import FACES_TOTAL
+    from face_lookalike_deepface import recognize_faces_deepface_parralelisation
+
+    img = cv2.imread(image_path)
+    unfiltered = measure(lambda: recognize_faces_deepface_parralelisation(img, quality_filter=False), warmup, repetitions)
+    filtered = measure(lambda: recognize_faces_deepface_parralelisation(img, quality_filter=True), warmup, repetitions)
+
+    skipped: List[Dict[str, Any]] = []
+    detected = FACES_TOTAL.value({"result": "detected"})
+    recognize_faces_deepface_parralelisation(img, quality_filter=True, skipped=skipped)
+    detected = FACES_TOTAL.value({"result": "detected"}) - detected
+    embedding_before = float(np.median(unfiltered.get("embedding", [0.0])))
+    embedding_after = float(np.median(filtered.get("embedding", [0.0])))
+    reasons: Dict[str, int] = {}
+    for face in skipped:
+        for reason in face["reasons"]:
+            reasons[reason] = reasons.get(reason, 0) + 1
+    summary = {
+        "faces_detected": int(detected),
+        "faces_embedded": int(detected) - len(skipped),
+        "faces_skipped": len(skipped),
+        "skip_reasons": reasons,
+        "embedding_p50_unfiltered": embedding_before,
+        "embedding_p50_filtered": embedding_after,
+        "embedding_saved": 1 - embedding_after / embedding_before if embedding_before else 0.0,
+        "speedup": float(np.median(unfiltered["total"]) / np.median(filtered["total"]))
+    }
+    return {"unfiltered": unfiltered, "filtered": filtered}, summary
+
+
+def build_cascade_gallery() -> int:
+    """Embed DLIB_GALLERY_IMAGES with the cascade model, the local database only seeds Facenet512."""
+    from model_gallery import enroll_model_embeddings
+    from face_lookalike_deepface import CASCADE_MODEL
+    outcome = enroll_model_embeddings(CASCADE_MODEL, DLIB_GALLERY_IMAGES)
+    return sum(1 for status in outcome.values() if status == "ok")
+
+
+def bench_gallery_load(warmup: int, repetitions: int) -> Dict[str, List[float]]:
+    def load():
+        invalidate_gallery()
+        load_gallery_from_db()
+    return measure(load, warmup, repetitions)
+
+
+def bench_matching(warmup: int, repetitions: int, probes: int = 64) -> Dict[str, Dict[str, List[float]]]:
+    """
+    Time gallery.best_match one probe at a time, and gallery.top_k for the
+    same probes as one batch (the /match_embeddings/ path), against synthetic galleries.
+    """
+    rng = np.random.default_rng(0)
+    results = {}
+    for size in SYNTHETIC_GALLERY_SIZES:
+        embeddings = rng.standard_normal((size, 512)).astype(np.float32)
+        gallery = Gallery(list(range(size)), [str(i) for i in range(size)], embeddings)
+        queries = rng.standard_normal((probes, 512)).astype(np.float32)
+        results[f"gallery_{size}"] = measure(
+            lambda: [gallery.best_match(query) for query in queries],
+            warmup,
+            repetitions
+        )
+        results[f"gallery_{size}_top_k"] = measure(lambda: gallery.top_k(queries, 5), warmup, repetitions)
+    return results
+
+
+def code_version() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True).strip()
+    except Exception:
+        return "unknown"
+
+
+def run_suite(
+    engines: List[str],
+    images: List[str],
+    profiles: List[str],
+    warmup: int,
+    repetitions: int,
+    cascade: bool = False,
+    quality: bool = False
+) -> Dict[str, Any]:
+    """
+    Run every benchmark and return the machine-readable report
+
+    Returns:
+        dict: {"meta": {...}, "stages": {"<case>/<stage>": summary},
+               "cascade": {image: summary}, "quality": {image: summary}}
+    """
+    stages: Dict[str, Dict[str, float]] = {}
+    cascade_summaries: Dict[str, Dict[str, float]] = {}
+    quality_summaries: Dict[str, Dict[str, Any]] = {}
+
+    def add(case: str, samples: Dict[str, List[float]]) -> None:
+        for stage, values in samples.items():
+            stages[f"{case}/{stage}"] = summarize(values)
+            print(f"{case}/{stage}: p50={stages[f'{case}/{stage}']['p50']:.4f}s p95={stages[f'{case}/{stage}']['p95']:.4f}s")
+
+    add("gallery_load", bench_gallery_load(warmup, repetitions))
+    for case, samples in bench_matching(warmup, repetitions).items():
+        add(f"matching/{case}", samples)
+
+    if "deepface" in engines:
+        for profile in profiles:
+            for image in images:
+                add(f"deepface/{profile}/{image}", bench_deepface(IMAGES[image], profile, warmup, repetitions))
+
+    if cascade:
+        print(f"Cascade gallery: {build_cascade_gallery()} students")
+        for image in images:
+            samples, summary = bench_cascade(IMAGES[image], warmup, repetitions)
+            for mode, mode_samples in samples.items():
+                add(f"cascade/{image}/{mode}", mode_samples)
+            cascade_summaries[image] = summary
+            print(f"cascade/{image}: {summary['stage_one_fraction']:.0%} of faces resolved at stage one, "
+                  f"speedup x{summary['speedup']:.2f}, identity agreement {summary['identity_agreement']:.0%}")
+
+    if quality:
+        for image in images:
+            samples, summary = bench_quality(IMAGES[image], warmup, repetitions)
+            for mode, mode_samples in samples.items():
+                add(f"quality/{image}/{mode}", mode_samples)
+            quality_summaries[image] = summary
+            print(f"quality/{image}: {summary['faces_skipped']}/{summary['faces_detected']} faces skipped "
+                  f"{summary['skip_reasons']}, "
+                  f"{summary['embedding_saved']:.0%} of the embedding time saved, speedup x{summary['speedup']:.2f}")
+
+    if "dlib" in engines:
+        database_path = build_dlib_gallery()
+        for profile in profiles:
+            for image in images:
+                add(f"dlib/{profile}/{image}", bench_dlib(IMAGES[image], database_path, profile, warmup, repetitions))
+
+    return {
+        "meta": {
+            "timestamp": datetime.now().isoformat(),
+            "code_version": code_version(),
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "warmup": warmup,
+            "repetitions": repetitions,
+            "profiles": profiles,
+            "db_backend": os.environ["DB_BACKEND"]
+        },
+        "stages": stages,
+        "cascade": cascade_summaries,
+        "quality": quality_summaries
+    }
+
+
+def compare(current: Dict[str, Any], baseline: Dict[str, Any], threshold: float, metric: str, min_delta: float) -> List[str]:
+    """
+    Stages of `current` slower than `baseline` by more than `threshold` (relative)
+    and `min_delta` seconds (absolute, keeps sub-millisecond stages from flapping)
+
+    Returns:
+        list: One message per regression
+    """
+    regressions = []
+    for stage, summary in current["stages"].items():
+        reference = baseline["stages"].get(stage)
+        if reference is None:
+            continue
+        before, after = reference[metric], summary[metric]
+        if after > before * (1 + threshold) and after - before > min_delta:
+            regressions.append(f"{stage}: {metric} {before:.4f}s -> {after:.4f}s (+{(after / before - 1) * 100:.0f}%)")
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Latency benchmark of the recognition pipeline")
+    parser.add_argument("--engines", nargs="+", default=["deepface", "dlib"], choices=["deepface", "dlib"])
+    parser.add_argument("--images", nargs="+", default=list(IMAGES), choices=list(IMAGES))
+    parser.add_argument("--profiles", nargs="+", default=["accurate"], choices=["fast", "balanced", "accurate"])
+    parser.add_argument("--cascade", action="store_true", help="Compare Facenet512 alone with the model cascade")
+    parser.add_argument("--quality", action="store_true", help="Compare recognition with and without the quality filter")
+    parser.add_argument("--warmup", type=int, default=2)
+    parser.add_argument("--repetitions", type=int, default=10)
+    parser.add_argument("--output", default="pipeline_benchmark_results.json")
+    parser.add_argument("--compare", metavar="BASELINE", help="Fail if a stage regressed against this report")
+    parser.add_argument("--threshold", type=float, default=0.20, help="Allowed relative slowdown (0.20 = 20%%)")
+    parser.add_argument("--metric", default="p50", choices=["p50", "p95", "mean"])
+    parser.add_argument("--min-delta", type=float, default=0.005, help="Ignore slowdowns smaller than this many seconds")
+    args = parser.parse_args()
+
+    report = run_suite(
+        args.engines, args.images, args.profiles, args.warmup, args.repetitions, args.cascade, args.quality
+    )
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"\nResults saved to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(report, baseline, args.threshold, args.metric, args.min_delta)
+        if regressions:
+            print(f"\n{len(regressions)} stage(s) regressed past {args.threshold:.0%}:")
+            for message in regressions:
+                print(f"- {message}")
+            sys.exit(1)
+        print(f"\nNo stage regressed past {args.threshold:.0%} against {args.compare}")
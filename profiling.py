@@ -0,0 +1,185 @@
+import os
+import sys
+import json
+import time
+import uuid
+import pstats
+import cProfile
+import logging
+import threading
+from collections import Counter
+from functools import wraps
+from typing import Dict, Any, List, Optional
+
+from flask import request, make_response
+
+logger = logging.getLogger(__name__)
+
+# Profiling is off unless enabled here, and a request must also carry
+# the admin token in the X-Profile header to be profiled
+PROFILING_ENABLED = os.getenv("PROFILING_ENABLED", "0") == "1"
+PROFILE_TOKEN = os.getenv("PROFILE_TOKEN")
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+PROFILE_SAMPLE_INTERVAL = float(os.getenv("PROFILE_SAMPLE_INTERVAL", "0.005"))
+
+# Modules that get a per-function breakdown in the profile summary
+BREAKDOWN_MODULES = ("face_lookalike_deepface", "face_lookalike")
+SAMPLE = "sample"
+DETERMINISTIC = "deterministic"
+
+
+def _frame_name(frame) -> str:
+    return f"{frame.f_globals.get('__name__', '?')}:{frame.f_code.co_name}"
+
+
+class StackSampler:
+    """
+    Samples the stack of a single thread at a fixed interval.
+    Other threads, and therefore other requests, are never inspected.
+    """
+
+    def __init__(self, thread_id: int, interval: float = PROFILE_SAMPLE_INTERVAL):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks: Counter = Counter()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="profile-sampler", daemon=True)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stopped.set()
+        self._thread.join()
+
+    def _run(self) -> None:
+        while not self._stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                stack.append(_frame_name(frame))
+                frame = frame.f_back
+            if stack:
+                self.stacks[";".join(reversed(stack))] += 1
+
+    def collapsed(self) -> str:
+        """Samples in the collapsed-stack format read by flamegraph.pl and speedscope."""
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+    def breakdown(self) -> List[Dict[str, Any]]:
+        """Inclusive and self time of every function of BREAKDOWN_MODULES."""
+        inclusive: Counter = Counter()
+        own: Counter = Counter()
+        for stack, count in self.stacks.items():
+            frames = stack.split(";")
+            for name in set(frames):
+                if name.split(":", 1)[0] in BREAKDOWN_MODULES:
+                    inclusive[name] += count
+            if frames[-1].split(":", 1)[0] in BREAKDOWN_MODULES:
+                own[frames[-1]] += count
+        return [
+            {
+                'function': name,
+                'inclusive_seconds': count * self.interval,
+                'self_seconds': own[name] * self.interval
+            }
+            for name, count in inclusive.most_common()
+        ]
+
+
+def deterministic_breakdown(stats: pstats.Stats) -> List[Dict[str, Any]]:
+    """Per-function totals of BREAKDOWN_MODULES from a cProfile run."""
+    rows = []
+    for (filename, _, function), (_, ncalls, tottime, cumtime, _) in stats.stats.items():
+        module = os.path.splitext(os.path.basename(filename))[0]
+        if module in BREAKDOWN_MODULES:
+            rows.append({
+                'function': f"{module}:{function}",
+                'calls': ncalls,
+                'inclusive_seconds': cumtime,
+                'self_seconds': tottime
+            })
+    return sorted(rows, key=lambda row: row['inclusive_seconds'], reverse=True)
+
+
+def requested_profile_mode() -> Optional[str]:
+    """Profiling mode asked for by the current request, None if it must not be profiled."""
+    if not PROFILING_ENABLED or not PROFILE_TOKEN:
+        return None
+    if request.headers.get("X-Profile") != PROFILE_TOKEN:
+        return None
+    mode = request.headers.get("X-Profile-Mode", SAMPLE)
+    return mode if mode in (SAMPLE, DETERMINISTIC) else SAMPLE
+
+
+def profiled(view):
+    """
+    Profile the wrapped endpoint for requests that opt in with the X-Profile header.
+
+    The profile is written to PROFILE_DIR and its ID returned in the
+    X-Profile-Id response header:
+        <id>.collapsed  collapsed stacks (sample mode)
+        <id>.prof       pstats dump (deterministic mode)
+        <id>.json       wall time and per-function breakdown
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        mode = requested_profile_mode()
+        if mode is None:
+            return view(*args, **kwargs)
+
+        profile_id = uuid.uuid4().hex
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        base_path = os.path.join(PROFILE_DIR, profile_id)
+        start = time.perf_counter()
+
+        if mode == SAMPLE:
+            sampler = StackSampler(threading.get_ident())
+            sampler.start()
+            try:
+                response = make_response(view(*args, **kwargs))
+            finally:
+                sampler.stop()
+            with open(base_path + ".collapsed", "w") as f:
+                f.write(sampler.collapsed())
+            breakdown = sampler.breakdown()
+        else:
+            # cProfile hooks the calling thread only
+            profiler = cProfile.Profile()
+            profiler.enable()
+            try:
+                response = make_response(view(*args, **kwargs))
+            finally:
+                profiler.disable()
+            profiler.dump_stats(base_path + ".prof")
+            breakdown = deterministic_breakdown(pstats.Stats(profiler))
+
+        summary = {
+            'profile_id': profile_id,
+            'mode': mode,
+            'endpoint': request.path,
+            'wall_seconds': time.perf_counter() - start,
+            'functions': breakdown
+        }
+        with open(base_path + ".json", "w") as f:
+            json.dump(summary, f, indent=2)
+        logger.info(f"Profiled {request.path} in {mode} mode: {base_path}")
+
+        response.headers["X-Profile-Id"] = profile_id
+        return response
+    return wrapper
+
+
+def load_profile(profile_id: str) -> Optional[Dict[str, Any]]:
+    """Summary of a stored profile, with its collapsed stacks when sampled."""
+    if not profile_id.isalnum():
+        return None
+    base_path = os.path.join(PROFILE_DIR, profile_id)
+    if not os.path.exists(base_path + ".json"):
+        return None
+    with open(base_path + ".json") as f:
+        summary = json.load(f)
+    if os.path.exists(base_path + ".collapsed"):
+        with open(base_path + ".collapsed") as f:
+            summary['collapsed'] = f.read()
+    return summary
@@ -0,0 +1,162 @@
+import os
+# Replays run offline against the SQLite stand-in unless told otherwise
+os.environ.setdefault("DB_BACKEND", "local")
+
+import sys
+import json
+import glob
+import time
+import argparse
+from typing import Dict, Any, List
+
+import cv2
+import numpy as np
+
+from metrics import start_request, request_stages
+from gallery import get_gallery
+from capture import load_capture_gallery
+
+
+def load_captures(capture_dir: str, endpoint: str = "recognize_faces") -> List[Dict[str, Any]]:
+    """Capture records of `endpoint` under capture_dir, oldest first."""
+    captures = []
+    for record_path in sorted(glob.glob(os.path.join(capture_dir, "*", "capture.json"))):
+        with open(record_path) as f:
+            record = json.load(f)
+        if record.get("endpoint") != endpoint:
+            continue
+        record["path"] = os.path.dirname(record_path)
+        captures.append(record)
+    return captures
+
+
+def diff_faces(before: List[Dict[str, Any]], after: List[Dict[str, Any]], confidence_tolerance: float) -> Dict[str, Any]:
+    """
+    Identities recognized in only one of the runs, and confidence changes of the others
+
+    Strangers are compared by count, their placeholder names are not stable.
+    """
+    def known(faces):
+        return {face.get("student_id", face["name"]): face for face in faces if "student_id" in face}
+
+    known_before, known_after = known(before), known(after)
+    confidence_changes = {}
+    for key in known_before.keys() & known_after.keys():
+        delta = known_after[key]["confidence"] - known_before[key]["confidence"]
+        if abs(delta) > confidence_tolerance:
+            confidence_changes[str(key)] = round(delta, 4)
+    strangers_before = len(before) - len(known_before)
+    strangers_after = len(after) - len(known_after)
+    return {
+        "added": sorted(str(known_after[key]["name"]) for key in known_after.keys() - known_before.keys()),
+        "removed": sorted(str(known_before[key]["name"]) for key in known_before.keys() - known_after.keys()),
+        "confidence_changes": confidence_changes,
+        "strangers": [strangers_before, strangers_after] if strangers_before != strangers_after else None
+    }
+
+
+def replay(record: Dict[str, Any], capture_dir: str, confidence_tolerance: float) -> Dict[str, Any]:
+    """Re-run one capture with the current code and compare it with what production returned."""
+    from engines import recognize
+
+    with open(os.path.join(record["path"], "image.bin"), "rb") as f:
+        img = cv2.imdecode(np.frombuffer(f.read(), np.uint8), cv2.IMREAD_COLOR)
+    if img is None:
+        return {"capture_id": record["capture_id"], "error": "Failed to decode captured image"}
+
+    gallery = None
+    if record.get("gallery_fingerprint"):
+        gallery = load_capture_gallery(capture_dir, record["gallery_fingerprint"])
+    gallery_source = "snapshot"
+    if gallery is None:
+        gallery = get_gallery()
+        gallery_source = "current"
+        if gallery.fingerprint() != record.get("gallery_fingerprint"):
+            print(f"Warning: no gallery snapshot for {record['capture_id']}, "
+                  f"replaying against the current gallery, identities may differ")
+
+    start_request()
+    start = time.perf_counter()
+    # The engine is the one this process is configured with, the profile and mask the ones of the request
+    params = record.get("params", {})
+    results = recognize(img, profile=params.get("profile") or None, gallery=gallery, roi=params.get("roi"))
+    total = time.perf_counter() - start
+    stages = request_stages()
+    faces = [dict(face_data, name=name) for name, face_data in results.items()]
+
+    # Production timings also cover the upload, decode and gallery lookup, compare like with like
+    captured_stages = record.get("stages", {})
+    stage_deltas = {
+        stage: {"before": captured_stages.get(stage), "after": stages.get(stage)}
+        for stage in sorted(set(captured_stages) | set(stages))
+    }
+    pipeline_before = sum(captured_stages.get(stage, 0.0) for stage in stages)
+    return {
+        "capture_id": record["capture_id"],
+        "gallery": gallery_source,
+        "faces_before": len(record.get("faces", [])),
+        "faces_after": len(faces),
+        "pipeline_before": pipeline_before,
+        "pipeline_after": total,
+        "stages": stage_deltas,
+        "diff": diff_faces(record.get("faces", []), faces, confidence_tolerance)
+    }
+
+
+def has_diff(result: Dict[str, Any]) -> bool:
+    if "error" in result:
+        return True
+    diff = result["diff"]
+    return bool(diff["added"] or diff["removed"] or diff["confidence_changes"] or diff["strangers"])
+
+
+def print_report(results: List[Dict[str, Any]]) -> None:
+    print(f"\n{'capture':<28}{'faces':>10}{'before':>10}{'after':>10}{'change':>9}  identities")
+    for result in results:
+        if "error" in result:
+            print(f"{result['capture_id']:<28}  {result['error']}")
+            continue
+        before, after = result["pipeline_before"], result["pipeline_after"]
+        change = f"{(after / before - 1) * 100:+.0f}%" if before else "n/a"
+        diff = result["diff"]
+        identities = []
+        if diff["added"]:
+            identities.append(f"+{','.join(diff['added'])}")
+        if diff["removed"]:
+            identities.append(f"-{','.join(diff['removed'])}")
+        if diff["confidence_changes"]:
+            identities.append(f"~{len(diff['confidence_changes'])} confidence")
+        if diff["strangers"]:
+            identities.append(f"strangers {diff['strangers'][0]}->{diff['strangers'][1]}")
+        print(f"{result['capture_id']:<28}{result['faces_before']:>4}->{result['faces_after']:<4}"
+              f"{before:>10.3f}{after:>10.3f}{change:>9}  {' '.join(identities) or 'same'}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay captured /recognize_faces/ requests against the current code")
+    parser.add_argument("capture_dir", nargs="?", default=os.getenv("CAPTURE_DIR", "captures"))
+    parser.add_argument("--limit", type=int, help="Replay only the most recent N captures")
+    parser.add_argument("--confidence-tolerance", type=float, default=0.01,
+                        help="Ignore confidence changes smaller than this")
+    parser.add_argument("--output", help="Write the per-capture results as JSON")
+    parser.add_argument("--fail-on-diff", action="store_true", help="Exit 1 if any recognition output changed")
+    args = parser.parse_args()
+
+    captures = load_captures(args.capture_dir)
+    if args.limit:
+        captures = captures[-args.limit:]
+    if not captures:
+        print(f"No captures found in {args.capture_dir}")
+        sys.exit(0)
+
+    results = [replay(record, args.capture_dir, args.confidence_tolerance) for record in captures]
+    print_report(results)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"\nResults saved to {args.output}")
+
+    changed = [result["capture_id"] for result in results if has_diff(result)]
+    print(f"\n{len(changed)}/{len(results)} capture(s) with different recognition output")
+    if args.fail_on_diff and changed:
+        sys.exit(1)
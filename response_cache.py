@@ -0,0 +1,124 @@
+import os
+import time
+import hashlib
+import logging
+import threading
+from functools import wraps
+from typing import Dict, Any, Optional, Tuple
+
+from flask import request, make_response
+
+logger = logging.getLogger(__name__)
+
+# Writes made through the API bump the versions immediately, the TTL bounds
+# how long a change made elsewhere (another worker, psql) can stay hidden
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", "60"))
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "1024"))
+
+_versions: Dict[str, int] = {}
+_entries: Dict[str, Tuple[Tuple[int, ...], float, str, Any]] = {}
+_stats: Dict[str, int] = {"hits": 0, "misses": 0, "not_modified": 0}
+_lock = threading.Lock()
+
+
+def bump_version(*resources: str) -> None:
+    """Invalidate every cached response that depends on one of the resources."""
+    with _lock:
+        for resource in resources:
+            _versions[resource] = _versions.get(resource, 0) + 1
+
+
+def _current_versions(resources: Tuple[str, ...]) -> Tuple[int, ...]:
+    return tuple(_versions.get(resource, 0) for resource in resources)
+
+
+def lookup_response(key: str, resources: Tuple[str, ...]) -> Tuple[Tuple[int, ...], Optional[Tuple[str, bytes]]]:
+    """
+    Cached response of `key` if it is still valid
+
+    Returns:
+        tuple: (current versions of the resources, (etag, body) or None)
+    """
+    versions = _current_versions(resources)
+    entry = _entries.get(key)
+    if entry is None or entry[0] != versions or time.time() - entry[1] > RESPONSE_CACHE_TTL:
+        return versions, None
+    return versions, (entry[2], entry[3])
+
+
+def store_response(key: str, resources: Tuple[str, ...], versions: Tuple[int, ...], body: bytes) -> str:
+    """
+    Cache a response body computed while the resources were at `versions`
+
+    Returns:
+        str: ETag of the body
+    """
+    etag = hashlib.sha1(body).hexdigest()
+    with _lock:
+        # Only keep the entry if no write happened while the view was running
+        if _current_versions(resources) == versions:
+            _entries.pop(key, None)
+            _entries[key] = (versions, time.time(), etag, body)
+            # Dicts keep insertion order, the first key is the oldest entry
+            while len(_entries) > RESPONSE_CACHE_MAX_ENTRIES:
+                del _entries[next(iter(_entries))]
+    return etag
+
+
+def cached_response(*resources: str):
+    """
+    Cache the JSON response of a GET endpoint until one of `resources` changes.
+
+    The ETag is a hash of the response body. A request whose If-None-Match
+    matches the cached entry gets a 304 without the view (or the database)
+    being called.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            key = request.full_path
+            versions, entry = lookup_response(key, resources)
+
+            if entry is not None:
+                etag, body = entry
+                if etag in request.if_none_match:
+                    count_lookup("not_modified")
+                    response = make_response("", 304)
+                else:
+                    count_lookup("hits")
+                    response = make_response(body)
+                    response.mimetype = "application/json"
+                response.set_etag(etag)
+                return response
+
+            count_lookup("misses")
+            response = make_response(view(*args, **kwargs))
+            if response.status_code != 200 or response.is_streamed:
+                return response
+
+            etag = store_response(key, resources, versions, response.get_data())
+            response.set_etag(etag)
+            return response.make_conditional(request)
+        return wrapper
+    return decorator
+
+
+def count_lookup(name: str) -> None:
+    with _lock:
+        _stats[name] += 1
+
+
+def cache_stats() -> Dict[str, Any]:
+    """Hit/miss counters of the response cache."""
+    with _lock:
+        stats = dict(_stats)
+        stats["entries"] = len(_entries)
+    lookups = stats["hits"] + stats["misses"] + stats["not_modified"]
+    stats["hit_rate"] = (stats["hits"] + stats["not_modified"]) / lookups if lookups else 0.0
+    stats["ttl"] = RESPONSE_CACHE_TTL
+    return stats
+
+
+def clear_cache() -> None:
+    with _lock:
+        _entries.clear()
@@ -0,0 +1,194 @@
+"""
+Static regions of interest of classroom cameras.
+
+A mask is a list of polygons in coordinates relative to the frame size,
+[[x, y], ...] with x and y in [0, 1], so it survives a change of camera
+resolution. Masks are stored per camera or per course; a camera's mask
+takes precedence over the mask of the course it films. The frame is cropped
+to the bounding box of the mask and blacked out around the polygons before
+detection, and detections whose center falls outside the polygons are dropped.
+"""
+import os
+import json
+import time
+import logging
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+import cv2
+import numpy as np
+
+from db import get_db_connection
+from metrics import stage_timer
+
+logger = logging.getLogger(__name__)
+
+# Masks are invalidated on every write made through the API, the TTL only
+# bounds how long an edit made directly in the database can go unnoticed
+ROI_CACHE_TTL = float(os.getenv("ROI_CACHE_TTL", "300"))
+
+CREATE_ROI_TABLE = """
+    CREATE TABLE IF NOT EXISTS roi_mask (
+        scope TEXT PRIMARY KEY,
+        polygons TEXT NOT NULL
+    )
+"""
+UPSERT_ROI = """
+    INSERT INTO roi_mask (scope, polygons)
+    VALUES (%s, %s)
+    ON CONFLICT (scope) DO UPDATE SET polygons = EXCLUDED.polygons
+"""
+
+Polygons = List[List[List[float]]]
+
+_masks: Dict[str, Tuple[float, Optional[Polygons]]] = {}
+_masks_lock = threading.Lock()
+
+
+def roi_scope(course_id: Optional[int] = None, camera_id: Optional[str] = None) -> str:
+    """Key of a mask in roi_mask, a camera's when camera_id is given"""
+    if camera_id:
+        return f"camera:{camera_id}"
+    if course_id is None:
+        raise ValueError("A mask belongs to a course or a camera")
+    return f"course:{course_id}"
+
+
+def validate_polygons(data: Any) -> Polygons:
+    """
+    Check a mask sent by a client
+
+    Raises:
+        ValueError: If it is not a non-empty list of polygons of at least
+            3 points with relative coordinates in [0, 1]
+    """
+    if not isinstance(data, list) or not data:
+        raise ValueError("polygons must be a non-empty array of polygons")
+    polygons = []
+    for polygon in data:
+        if not isinstance(polygon, list) or len(polygon) < 3:
+            raise ValueError("Each polygon needs at least 3 points")
+        points = []
+        for point in polygon:
+            try:
+                x, y = float(point[0]), float(point[1])
+            except (TypeError, IndexError, ValueError):
+                raise ValueError(f"Invalid point: {point}")
+            if not (0 <= x <= 1 and 0 <= y <= 1):
+                raise ValueError(f"Point {point} is outside the frame, coordinates are relative to its size")
+            points.append([x, y])
+        polygons.append(points)
+    return polygons
+
+
+def load_roi(scope: str) -> Optional[Polygons]:
+    """Mask stored for a scope, None if there is none"""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute(CREATE_ROI_TABLE)
+        cursor.execute("SELECT polygons FROM roi_mask WHERE scope = %s", (scope,))
+        row = cursor.fetchone()
+        return json.loads(row[0]) if row else None
+    finally:
+        cursor.close()
+        conn.close()
+
+
+def _cached_roi(scope: str) -> Optional[Polygons]:
+    cached = _masks.get(scope)
+    if cached is not None and time.time() - cached[0] < ROI_CACHE_TTL:
+        return cached[1]
+    with stage_timer("db_io"):
+        polygons = load_roi(scope)
+    with _masks_lock:
+        _masks[scope] = (time.time(), polygons)
+    return polygons
+
+
+def get_roi(course_id: Optional[int] = None, camera_id: Optional[str] = None) -> Optional[Polygons]:
+    """
+    Mask to apply to a frame: the camera's, else the course's, else None
+    """
+    if camera_id:
+        polygons = _cached_roi(roi_scope(camera_id=camera_id))
+        if polygons is not None:
+            return polygons
+    if course_id is not None:
+        return _cached_roi(roi_scope(course_id=course_id))
+    return None
+
+
+def save_roi(scope: str, polygons: Polygons) -> None:
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute(CREATE_ROI_TABLE)
+        cursor.execute(UPSERT_ROI, (scope, json.dumps(polygons)))
+        conn.commit()
+    finally:
+        cursor.close()
+        conn.close()
+    invalidate_roi(scope)
+
+
+def delete_roi(scope: str) -> bool:
+    """Remove a mask, False if there was none"""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute(CREATE_ROI_TABLE)
+        cursor.execute("DELETE FROM roi_mask WHERE scope = %s", (scope,))
+        deleted = cursor.rowcount > 0
+        conn.commit()
+    finally:
+        cursor.close()
+        conn.close()
+    invalidate_roi(scope)
+    return deleted
+
+
+def invalidate_roi(scope: Optional[str] = None) -> None:
+    """Drop the cached mask of one scope, or every cached mask."""
+    with _masks_lock:
+        if scope is None:
+            _masks.clear()
+        else:
+            _masks.pop(scope, None)
+
+
+def to_pixels(polygons: Polygons, width: int, height: int) -> List[np.ndarray]:
+    """Relative polygons as int32 point arrays in the pixels of a width x height frame"""
+    scale = np.array([width, height], dtype=np.float64)
+    return [np.round(np.asarray(polygon, dtype=np.float64) * scale).astype(np.int32) for polygon in polygons]
+
+
+def crop_to_roi(image: np.ndarray, polygons: Polygons) -> Tuple[np.ndarray, Tuple[int, int], List[np.ndarray]]:
+    """
+    Crop a BGR frame to the bounding box of a mask and black out what lies
+    outside the polygons, so the detector neither scans nor fires there
+
+    Returns:
+        tuple: (cropped image, (x, y) offset of the crop in the frame,
+            polygons in the pixels of the full frame)
+    """
+    height, width = image.shape[:2]
+    pixel_polygons = to_pixels(polygons, width, height)
+    points = np.concatenate(pixel_polygons)
+    x0, y0 = np.maximum(points.min(axis=0), 0)
+    x1, y1 = np.minimum(points.max(axis=0) + 1, [width, height])
+    crop = image[y0:y1, x0:x1]
+
+    mask = np.zeros(crop.shape[:2], dtype=np.uint8)
+    cv2.fillPoly(mask, [polygon - [x0, y0] for polygon in pixel_polygons], 255)
+    if not mask.all():
+        # bitwise_and allocates the output, the caller's frame is left untouched
+        crop = cv2.bitwise_and(crop, crop, mask=mask)
+    return crop, (int(x0), int(y0)), pixel_polygons
+
+
+def inside_roi(bounding_box: Tuple[int, int, int, int], pixel_polygons: List[np.ndarray]) -> bool:
+    """Whether the center of a (top, right, bottom, left) box lies inside one of the polygons"""
+    top, right, bottom, left = bounding_box
+    center = ((left + right) / 2, (top + bottom) / 2)
+    return any(cv2.pointPolygonTest(polygon, center, False) >= 0 for polygon in pixel_polygons)
@@ -0,0 +1,66 @@
+import os
+import time
+import logging
+import threading
+from typing import Dict, Any, List, Optional, Tuple
+
+from psycopg2.extras import RealDictCursor
+
+from db import get_db_connection
+from metrics import stage_timer
+
+logger = logging.getLogger(__name__)
+
+# Rosters are invalidated on every write made through the API, the TTL only
+# bounds how long an edit made directly in the database can go unnoticed
+ROSTER_CACHE_TTL = float(os.getenv("ROSTER_CACHE_TTL", "300"))
+
+_rosters: Dict[int, Tuple[float, Optional[List[Dict[str, Any]]]]] = {}
+_rosters_lock = threading.Lock()
+
+
+def load_course_roster(course_id: int) -> Optional[List[Dict[str, Any]]]:
+    """
+    Students enrolled in a course, read from the database
+
+    Returns:
+        list: [{'studentid': ..., 'name': ...}], or None if the course does not exist
+    """
+    conn = get_db_connection()
+    cursor = conn.cursor(cursor_factory=RealDictCursor)
+    try:
+        cursor.execute("SELECT courseid FROM course WHERE courseid = %s", (course_id,))
+        if cursor.fetchone() is None:
+            return None
+        cursor.execute("""
+            SELECT s.studentid, s.name
+            FROM student s
+            JOIN studentcourses sc ON s.studentid = sc.studentid
+            WHERE sc.courseid = %s
+            ORDER BY s.name
+        """, (course_id,))
+        return [dict(row) for row in cursor.fetchall()]
+    finally:
+        cursor.close()
+        conn.close()
+
+
+def get_course_roster(course_id: int) -> Optional[List[Dict[str, Any]]]:
+    """Cached version of load_course_roster."""
+    cached = _rosters.get(course_id)
+    if cached is not None and time.time() - cached[0] < ROSTER_CACHE_TTL:
+        return cached[1]
+    with stage_timer("db_io"):
+        roster = load_course_roster(course_id)
+    with _rosters_lock:
+        _rosters[course_id] = (time.time(), roster)
+    return roster
+
+
+def invalidate_course_roster(course_id: Optional[int] = None) -> None:
+    """Drop the cached roster of one course, or of every course."""
+    with _rosters_lock:
+        if course_id is None:
+            _rosters.clear()
+        else:
+            _rosters.pop(course_id, None)
@@ -0,0 +1,30 @@
+"""
+Production entry point: serves asgi.api with uvicorn.
+
+    python serve.py --workers 4
+
+Each worker is a separate process with its own models, gallery cache,
+database pool and recognition threads (RECOGNITION_WORKERS).
+"""
+import os
+import argparse
+
+import uvicorn
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve the attendance API over ASGI")
+    parser.add_argument("--host", default=os.getenv("API_HOST", "127.0.0.1"))
+    parser.add_argument("--port", type=int, default=int(os.getenv("API_PORT", "8000")))
+    parser.add_argument("--workers", type=int, default=int(os.getenv("API_WORKERS", "1")),
+                        help="Worker processes, each loads its own copy of the models")
+    parser.add_argument("--log-level", default=os.getenv("LOG_LEVEL", "info").lower())
+    args = parser.parse_args()
+
+    # An import string, so uvicorn can import the app again in every worker
+    uvicorn.run(
+        "asgi:api",
+        host=args.host,
+        port=args.port,
+        workers=args.workers,
+        log_level=args.log_level
+    )
@@ -0,0 +1,37 @@
+import numpy as np
+
+from gallery import Gallery, EMBEDDING_DIMENSIONS, PRIMARY_MODEL
+
+DIMENSION = EMBEDDING_DIMENSIONS[PRIMARY_MODEL]
+
+
+def embedding(seed: int) -> np.ndarray:
+    return np.random.default_rng(seed).standard_normal(DIMENSION).astype(np.float32)
+
+
+def test_empty_gallery_append_compact_append():
+    # A fresh deployment: no student enrolled, the matrix shape is unknown to the database
+    gallery = Gallery([], [], np.empty((0, 0), dtype=np.float32), change_id=0)
+
+    gallery = gallery.apply_changes({1: ("Ada", embedding(1))}, [], version=1, change_id=1)
+    assert len(gallery) == 1
+    assert gallery.best_match(embedding(1))[0] == 0
+
+    gallery = gallery.apply_changes({}, [1], version=2, change_id=2).compacted()
+    assert len(gallery) == 0
+    assert gallery.embeddings.shape == (0, DIMENSION)
+
+    gallery = gallery.apply_changes({2: ("Grace", embedding(2))}, [], version=3, change_id=3)
+    assert len(gallery) == 1
+    index, distance = gallery.best_match(embedding(2))
+    assert gallery.student_ids[index] == 2
+    assert distance < 1e-5
+    assert 1 not in gallery
+
+
+def test_empty_subset_keeps_dimension():
+    gallery = Gallery([1], ["Ada"], embedding(1)[None, :])
+    subset = gallery.subset([42])
+    assert len(subset) == 0
+    assert subset.embeddings.shape == (0, DIMENSION)
+    assert subset.top_k(embedding(1)[None, :], k=3)[0].shape == (1, 0)
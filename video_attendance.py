@@ -0,0 +1,310 @@
+"""
+Take attendance from a recorded lecture.
+
+The video is decoded on a background thread into a bounded queue, so memory
+stays flat whatever the length of the file; frames between two samples are
+only grabbed, never decoded. Each sampled frame goes through the same
+recognition pipeline as /recognize_faces/, and sightings are aggregated per
+student over the whole video. With the deepface engine, a face tracker
+follows the faces from frame to frame so only new or changed faces are
+embedded again (see face_tracker.py).
+
+    python video_attendance.py lecture.mp4 --fps 0.5 --course-id 3 --record
+    python video_attendance.py lecture.mp4 --best-frames-dir best/ --output report.json
+"""
+import os
+import sys
+import json
+import time
+import queue
+import argparse
+import logging
+import threading
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import cv2
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Used when the container does not report its frame rate
+DEFAULT_SOURCE_FPS = 25.0
+
+_END = object()
+
+
+class VideoFrameReader:
+    """
+    Decode a video file on a background thread, keeping `sample_fps` frames
+    per second of video. At most `queue_size` decoded frames wait in memory;
+    the thread blocks when the consumer falls behind.
+    """
+
+    def __init__(self, path: str, sample_fps: float = 1.0, queue_size: int = 8):
+        self.path = path
+        self.sample_fps = sample_fps
+        self._frames: "queue.Queue" = queue.Queue(maxsize=queue_size)
+        self._stop = threading.Event()
+        self._error: Optional[BaseException] = None
+
+        self._capture = cv2.VideoCapture(path)
+        if not self._capture.isOpened():
+            raise ValueError(f"Cannot open video: {path}")
+        self.source_fps = self._capture.get(cv2.CAP_PROP_FPS) or DEFAULT_SOURCE_FPS
+        self.frame_count = int(self._capture.get(cv2.CAP_PROP_FRAME_COUNT) or 0)
+        # Keep one frame out of `step`, every frame if sampling faster than the video
+        self.step = max(1, round(self.source_fps / sample_fps)) if sample_fps > 0 else 1
+        self._thread = threading.Thread(target=self._run, name="video-decode", daemon=True)
+
+    def _put(self, item: Any) -> bool:
+        while not self._stop.is_set():
+            try:
+                self._frames.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _run(self) -> None:
+        index = 0
+        try:
+            while not self._stop.is_set():
+                # grab() demuxes without decoding, only sampled frames are decoded
+                if not self._capture.grab():
+                    break
+                if index % self.step == 0:
+                    ok, frame = self._capture.retrieve()
+                    if ok and not self._put((index, index / self.source_fps, frame)):
+                        break
+                index += 1
+        except BaseException as e:
+            self._error = e
+        finally:
+            self._capture.release()
+            self._put(_END)
+
+    def __iter__(self) -> Iterator[Tuple[int, float, np.ndarray]]:
+        """(frame index, timestamp in seconds, BGR frame) of every sampled frame"""
+        self._thread.start()
+        try:
+            while True:
+                item = self._frames.get()
+                if item is _END:
+                    break
+                yield item
+        finally:
+            self.stop()
+        if self._error is not None:
+            raise self._error
+
+    def stop(self) -> None:
+        self._stop.set()
+
+
+class SightingAggregator:
+    """
+    Sightings of each student over a video: first and last time seen, number
+    of sampled frames seen in, and the most confident sighting
+    """
+
+    def __init__(self, keep_crops: bool = False):
+        self.keep_crops = keep_crops
+        self.students: Dict[int, Dict[str, Any]] = {}
+        self.crops: Dict[int, np.ndarray] = {}
+        self.frames = 0
+        self.max_strangers = 0
+
+    def add(self, frame_index: int, timestamp: float, faces: Dict[str, Any], frame: np.ndarray) -> None:
+        self.frames += 1
+        strangers = 0
+        for face in faces.values():
+            student_id = face.get('student_id')
+            if student_id is None:
+                strangers += 1
+                continue
+            entry = self.students.get(student_id)
+            if entry is None:
+                entry = self.students[student_id] = {
+                    'student_id': student_id,
+                    'name': face['name'],
+                    'first_seen': timestamp,
+                    'frames_seen': 0,
+                    'confidence': -1.0
+                }
+            entry['last_seen'] = timestamp
+            entry['frames_seen'] += 1
+            if face['confidence'] > entry['confidence']:
+                entry.update(
+                    confidence=face['confidence'],
+                    best_frame=frame_index,
+                    best_timestamp=timestamp,
+                    bounding_box=face['bounding_box']
+                )
+                if self.keep_crops:
+                    top, right, bottom, left = face['bounding_box']
+                    self.crops[student_id] = frame[max(top, 0):bottom, max(left, 0):right].copy()
+        self.max_strangers = max(self.max_strangers, strangers)
+
+    def sightings(self) -> List[Dict[str, Any]]:
+        """One entry per student seen, most seen first"""
+        return sorted(self.students.values(), key=lambda entry: (-entry['frames_seen'], entry['name']))
+
+
+def process_video(
+    path: str,
+    sample_fps: float = 1.0,
+    profile: Optional[str] = None,
+    course_id: Optional[int] = None,
+    camera_id: Optional[str] = None,
+    queue_size: int = 8,
+    keep_crops: bool = False,
+    track: bool = True
+) -> Tuple[Dict[str, Any], SightingAggregator]:
+    """
+    Recognize the sampled frames of a video and aggregate the sightings
+
+    Raises:
+        ValueError: If the course does not exist, or the configured engine
+            does not identify students
+
+    Returns:
+        tuple: (report, aggregator holding the best crops when keep_crops is set)
+    """
+    from engines import recognize, require_student_ids, RECOGNITION_ENGINE
+    from face_tracker import FaceTracker
+    from gallery import get_gallery, get_course_gallery
+    from roster import get_course_roster
+    from roi import get_roi
+
+    # Sightings are aggregated per student_id
+    require_student_ids()
+    roster = None
+    gallery, fallback_gallery = get_gallery(), None
+    if course_id is not None:
+        roster = get_course_roster(course_id)
+        if roster is None:
+            raise ValueError(f"Course {course_id} not found")
+        # Enrolled students first, the full gallery for the remaining faces
+        gallery, fallback_gallery = get_course_gallery(course_id, [student['studentid'] for student in roster]), gallery
+    roi = get_roi(course_id, camera_id)
+
+    # Only the deepface engine embeds faces separately from detecting them
+    tracking = {}
+    if track and RECOGNITION_ENGINE == "deepface":
+        tracking["tracker"] = FaceTracker()
+
+    reader = VideoFrameReader(path, sample_fps, queue_size)
+    aggregator = SightingAggregator(keep_crops)
+    start = time.perf_counter()
+    for frame_index, timestamp, frame in reader:
+        if tracking:
+            tracking["timestamp"] = timestamp
+        faces = recognize(
+            frame,
+            profile=profile,
+            gallery=gallery,
+            fallback_gallery=fallback_gallery,
+            roi=roi,
+            **tracking
+        )
+        aggregator.add(frame_index, timestamp, faces, frame)
+        logger.info("t=%.1fs: %d face(s)", timestamp, len(faces))
+    elapsed = time.perf_counter() - start
+
+    sightings = aggregator.sightings()
+    report: Dict[str, Any] = {
+        "video": path,
+        "source_fps": reader.source_fps,
+        "sample_fps": sample_fps,
+        "frames_processed": aggregator.frames,
+        "duration_seconds": reader.frame_count / reader.source_fps if reader.frame_count else None,
+        "processing_seconds": elapsed,
+        "tracking": bool(tracking),
+        "students": sightings,
+        "max_strangers_in_frame": aggregator.max_strangers
+    }
+    if roster is not None:
+        seen = {entry['student_id'] for entry in sightings}
+        roster_ids = {student['studentid'] for student in roster}
+        report["courseid"] = course_id
+        report["absent"] = [student for student in roster if student['studentid'] not in seen]
+        report["unexpected"] = [entry for entry in sightings if entry['student_id'] not in roster_ids]
+    return report, aggregator
+
+
+def record_attendance(course_id: int, session_id: str, sightings: List[Dict[str, Any]]) -> int:
+    """Write the best sighting of every student to the attendance table, returns the rows queued"""
+    from attendance import attendance_buffer
+
+    queued = attendance_buffer.record_faces(course_id, session_id, sightings)
+    attendance_buffer.flush()
+    return queued
+
+
+def save_best_frames(aggregator: SightingAggregator, directory: str) -> None:
+    os.makedirs(directory, exist_ok=True)
+    for student_id, crop in aggregator.crops.items():
+        if crop.size:
+            name = aggregator.students[student_id]['name']
+            cv2.imwrite(os.path.join(directory, f"{student_id}_{name}.jpg"), crop)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Take attendance from a recorded lecture")
+    parser.add_argument("video")
+    parser.add_argument("--fps", type=float, default=1.0, help="Frames sampled per second of video")
+    parser.add_argument("--profile", choices=["fast", "balanced", "accurate"])
+    parser.add_argument("--course-id", type=int, help="Match against the course roster first and report absences")
+    parser.add_argument("--camera-id", help="Apply the ROI mask of this camera")
+    parser.add_argument("--session-id", help="Attendance session, defaults to the course's session of the day")
+    parser.add_argument("--record", action="store_true", help="Write the attendance of the course (needs --course-id)")
+    parser.add_argument("--no-track", action="store_true", help="Embed every face of every frame")
+    parser.add_argument("--queue-size", type=int, default=8, help="Decoded frames kept in memory ahead of recognition")
+    parser.add_argument("--best-frames-dir", help="Save the most confident face crop of every student here")
+    parser.add_argument("--output", help="Write the report as JSON")
+    args = parser.parse_args()
+    if args.record and args.course_id is None:
+        parser.error("--record needs --course-id")
+    logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO").upper(), format='%(asctime)s - %(levelname)s - %(message)s')
+
+    try:
+        report, aggregator = process_video(
+            args.video,
+            sample_fps=args.fps,
+            profile=args.profile,
+            course_id=args.course_id,
+            camera_id=args.camera_id,
+            queue_size=args.queue_size,
+            keep_crops=bool(args.best_frames_dir),
+            track=not args.no_track
+        )
+    except ValueError as e:
+        parser.error(str(e))
+
+    for entry in report["students"]:
+        print(
+            f"{entry['name']}: seen in {entry['frames_seen']} frame(s) from {entry['first_seen']:.1f}s "
+            f"to {entry['last_seen']:.1f}s, best {entry['confidence']:.2f} at {entry['best_timestamp']:.1f}s"
+        )
+    for student in report.get("absent", []):
+        print(f"{student['name']}: absent")
+    print(f"\n{report['frames_processed']} frame(s) in {report['processing_seconds']:.1f}s")
+
+    if args.best_frames_dir:
+        save_best_frames(aggregator, args.best_frames_dir)
+    if args.record:
+        from attendance import default_session_id
+        session_id = args.session_id or default_session_id(args.course_id)
+        # Like /courses/<id>/attendance, only enrolled students are recorded
+        unexpected = {entry['student_id'] for entry in report["unexpected"]}
+        queued = record_attendance(
+            args.course_id,
+            session_id,
+            [entry for entry in report["students"] if entry['student_id'] not in unexpected]
+        )
+        print(f"Recorded {queued} student(s) in session {session_id}")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2, default=str)
+        print(f"Report saved to {args.output}")
+    sys.exit(0 if report["frames_processed"] else 1)